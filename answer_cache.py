@@ -0,0 +1,78 @@
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Configuration
+ANSWER_SIMILARITY = 0.95  # cosine similarity for two questions to share an answer
+ANSWER_TTL = 24 * 3600  # seconds a cached answer stays valid
+MAX_ANSWERS = 500
+
+class SemanticAnswerCache:
+    """
+    In-memory answer cache keyed on query embeddings: a question whose embedding is
+    within `threshold` cosine similarity of a cached one gets that answer back.
+    Entries expire after `ttl` seconds, the least recently used are evicted beyond
+    max_entries. Each index version gets its own cache (see app.py and server.py).
+    Safe to share between threads (Streamlit sessions).
+    """
+    def __init__(self, threshold=ANSWER_SIMILARITY, ttl=ANSWER_TTL, max_entries=MAX_ANSWERS, version=None):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version = version
+        self.entries = OrderedDict()  # question -> {"vector", "answer", "sources", "created"}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding):
+        """
+        Returns (question, entry, similarity) for the closest live entry within the threshold, or None.
+        """
+        query = self._unit(embedding)
+        now = time.time()
+        with self.lock:
+            for question in [q for q, e in self.entries.items() if now - e["created"] > self.ttl]:
+                del self.entries[question]
+            if not self.entries:
+                self.misses += 1
+                return None
+            questions = list(self.entries)
+            similarities = np.stack([self.entries[q]["vector"] for q in questions]) @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(questions[best])
+            return questions[best], self.entries[questions[best]], float(similarities[best])
+
+    def store(self, question, embedding, answer, sources=()):
+        with self.lock:
+            self.entries[question] = {
+                "vector": self._unit(embedding),
+                "answer": answer,
+                "sources": list(sources),
+                "created": time.time()
+            }
+            self.entries.move_to_end(question)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+            "version": self.version
+        }
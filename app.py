@@ -1,28 +1,34 @@
 import streamlit as st
 import os
-import sys
-import subprocess
-from llama_index.core import VectorStoreIndex, StorageContext, Settings
-from llama_index.vector_stores.chroma import ChromaVectorStore
-from llama_index.llms.google_genai import GoogleGenAI
-from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
-import chromadb
-from dotenv import load_dotenv
-
-# Load API Key
-load_dotenv()
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+import time
+from llama_index.core import VectorStoreIndex, Settings
+import providers
+from indexer import open_vector_store
+from index_artifacts import build_in_progress, current_index, index_status, start_background_build
+from local_store import IVF_LISTS, STORE_DTYPE
+from lexical import load_lexical_index
+from answer_cache import SemanticAnswerCache
+from chat_memory import SummaryMemory
+from engine import context_tokens, index_params, make_chat_engine, memory_tokens, prompt_tokens, record_generation
+from telemetry import METRICS_PORT, span, start_metrics_server
+import threading
+from llama_index.core.llms import ChatMessage, MessageRole
 
 # Configuration
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-CHROMA_DB_DIR = os.path.join(BASE_DIR, "chroma_db")
-COLLECTION_NAME = "uzio_docs"
+COLLECTION_NAME = providers.collection_name("uzio_docs")
+# Welcome-screen buttons: (label, prompt). Their answers are warmed into the answer cache.
+SUGGESTED_PROMPTS = [
+    ("👥 How to add employees?", "How do I add employees to Time Tracking?"),
+    ("⏱️ Explain Overtime Rules", "How do I configure overtime rules (Daily/Weekly)?"),
+    ("📍 What is Geofencing?", "How does Geofencing work and how do I set it up?"),
+]
 
 # Debug Config
 import sqlite3
 print(f"DEBUG: SQLite Version: {sqlite3.sqlite_version}")
 print(f"DEBUG: Base Directory: {BASE_DIR}")
-print(f"DEBUG: Target Chroma DB Path: {CHROMA_DB_DIR}")
+print(f"DEBUG: Index Status: {index_status()}")
 
 # Page Config
 st.set_page_config(
@@ -111,45 +117,80 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 @st.cache_resource
-def load_index():
+def load_index(index_dir, backend, dtype=STORE_DTYPE, ivf_lists=IVF_LISTS):
+    # Cached per index directory: publishing a new version loads it on the next rerun,
+    # while sessions already holding the previous version keep using it
     print(f"DEBUG: Current Directory: {os.getcwd()}")
-    print(f"DEBUG: Files in CWD: {os.listdir(os.getcwd())}")
-    if os.path.exists(CHROMA_DB_DIR):
-         print(f"DEBUG: {CHROMA_DB_DIR} contents: {os.listdir(CHROMA_DB_DIR)}")
-    
-    # Strict check: Does the SQLite file exist?
-    sqlite_path = os.path.join(CHROMA_DB_DIR, "chroma.sqlite3")
-    if not os.path.exists(CHROMA_DB_DIR) or not os.path.exists(sqlite_path):
-        print(f"DEBUG: CHROMA_DB_DIR or sqlite3 missing at {CHROMA_DB_DIR}! Attempting to rebuild...")
-        st.warning(f"⚠️ Index not found at {CHROMA_DB_DIR}. Auto-building index... This may take 1-2 minutes.")
-        
-        try:
-            # Run indexer.py as a separate process
-            indexer_path = os.path.join(BASE_DIR, "indexer.py")
-            subprocess.run([sys.executable, indexer_path], check=True)
-            print("DEBUG: Index rebuild complete.")
-            st.success("✅ Index built successfully! Reloading...")
-        except Exception as e:
-            print(f"ERROR: Failed to rebuild index: {e}")
-            st.error(f"Failed to rebuild index: {e}")
-            return None
-            
-    # Retry loading after build
+    print(f"DEBUG: Loading {backend} index from {index_dir}: {os.listdir(index_dir)}")
     try:
         # Setup Models (Must fail gracefully if key is missing)
-        Settings.embed_model = GoogleGenAIEmbedding(model_name="models/text-embedding-004", api_key=GOOGLE_API_KEY)
-        Settings.llm = GoogleGenAI(model="models/gemini-flash-latest", api_key=GOOGLE_API_KEY)
+        Settings.embed_model = providers.get_embed_model()
+        Settings.llm = providers.get_llm()
         
-        db = chromadb.PersistentClient(path=CHROMA_DB_DIR)
-        chroma_collection = db.get_or_create_collection(COLLECTION_NAME)
-        vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-        storage_context = StorageContext.from_defaults(vector_store=vector_store)
-        return VectorStoreIndex.from_vector_store(vector_store, storage_context=storage_context)
+        vector_store, _ = open_vector_store(backend, index_dir, dtype=dtype, ivf_lists=ivf_lists)
+        return VectorStoreIndex.from_vector_store(vector_store)
     except Exception as e:
         print(f"CRITICAL ERROR LOADING INDEX: {e}")
         st.error(f"System Error: Failed to load database. Details: {str(e)}")
         return None
 
+@st.cache_resource
+def metrics_server():
+    # One /metrics endpoint per process (set METRICS_PORT); traces go to telemetry.TRACE_FILE regardless
+    return start_metrics_server(METRICS_PORT) if METRICS_PORT else None
+
+@st.cache_resource
+def load_lexical(index_dir):
+    # BM25 index written next to the vector index by indexer.py (None for older builds)
+    return load_lexical_index(index_dir)
+
+def session_chat_engine(index, index_dir):
+    # One engine per session, rebuilt only when a new index version is loaded; the
+    # token-budgeted memory lives in session state so it survives reruns and rebuilds
+    if "chat_memory" not in st.session_state:
+        st.session_state.chat_memory = SummaryMemory.from_defaults(llm=Settings.llm)
+    if st.session_state.get("chat_engine_index") != index_dir:
+        st.session_state.chat_engine = make_chat_engine(index, load_lexical(index_dir), st.session_state.chat_memory)
+        st.session_state.chat_engine_index = index_dir
+    return st.session_state.chat_engine
+
+@st.cache_resource
+def load_answer_cache(index_dir, version, _index):
+    # One cache per index version, shared by all sessions; the suggested prompts are
+    # answered in a background thread so the first clicks are already cached
+    cache = SemanticAnswerCache(version=version)
+    index = _index
+
+    def warm():
+        for _, prompt in SUGGESTED_PROMPTS:
+            try:
+                response = make_chat_engine(index, load_lexical(index_dir)).chat(prompt)
+                cache.store(prompt, Settings.embed_model.get_query_embedding(prompt), response.response, response.source_nodes)
+            except Exception as e:
+                print(f"WARNING: Could not warm answer for '{prompt}': {e}")
+        print(f"DEBUG: Answer cache warmed: {cache.stats()}")
+
+    threading.Thread(target=warm, daemon=True).start()
+    return cache
+
+def render_sources(source_nodes):
+    # Show source nodes (especially images)
+    with st.expander("🔍 View Source Context (Text & Images)"):
+        for node in source_nodes:
+            st.markdown(f"**Score:** {node.score:.2f}")
+            # Clean up text for display
+            text_content = node.node.get_text().replace("Image Path:", "").strip()
+            st.markdown(f"> {text_content[:300]}...")
+            
+            # Check for Image
+            if "image_path" in node.node.metadata:
+                # Serve the small cached thumbnail when extraction produced one
+                img_path = node.node.metadata.get("thumb_path") or node.node.metadata["image_path"]
+                if not os.path.exists(img_path):
+                    img_path = node.node.metadata["image_path"]
+                if os.path.exists(img_path):
+                    st.image(img_path, caption="Relevant Screenshot/Chart", width=400)
+
 # Sidebar
 with st.sidebar:
     # UZIO Logo (Local Asset)
@@ -166,8 +207,22 @@ with st.sidebar:
     st.markdown("### 🛠️ Actions")
     if st.button("🗑️ Clear Conversation", type="secondary"):
         st.session_state.messages = []
+        if "chat_memory" in st.session_state:
+            st.session_state.chat_memory.reset()
+        st.rerun()
+    # Rebuilds run in a background process; the current version keeps serving until the new one is published
+    if st.button("🔄 Rebuild Index", type="secondary", disabled=build_in_progress()):
+        start_background_build()
         st.rerun()
     
+    status = index_status()
+    if status["building"]:
+        st.caption("⏳ Index rebuild in progress...")
+    elif status.get("state") == "failed":
+        st.caption(f"⚠️ Last index build failed: {status.get('error')}")
+    if status["version"]:
+        st.caption(f"Index version: {status['version']}")
+    
     st.markdown("---")
     st.markdown("### 📊 Capabilities")
     st.info("""
@@ -177,23 +232,28 @@ with st.sidebar:
     """)
 
 # Main Content
+metrics_server()
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
-index = load_index()
+index_dir, manifest = current_index()
+index = load_index(index_dir, *index_params(manifest)) if index_dir else None
 
-if not index:
-    st.error("⚠️ **System Not Ready**: Index not found. Please run the data processing scripts.")
+if not index_dir and status.get("state") == "failed" and not status["building"]:
+    st.error(f"⚠️ **System Not Ready**: the index build failed ({status.get('error')}). Please run the data processing scripts.")
+elif not index_dir:
+    # No index yet: build it in the background instead of blocking this session
+    if start_background_build():
+        print("DEBUG: Index missing, started a background build.")
+    st.info("⏳ **Preparing the knowledge base**: the index is being built in the background. "
+            "This usually takes a few minutes; the assistant will be available once it's ready.")
+    if st.button("Check again"):
+        st.rerun()
+elif not index:
+    st.error("⚠️ **System Not Ready**: Index could not be loaded. Please run the data processing scripts.")
 else:
-    chat_engine = index.as_chat_engine(
-        chat_mode="context", 
-        system_prompt=(
-            "You are an expert UZIO Software Consultant. "
-            "Your goal is to provide clear, step-by-step answers based strictly on the provided documentation. "
-            "If the context includes image descriptions (screenshots/charts), use them to explain where to click or what the UI looks like. "
-            "Be professional, concise, and friendly."
-        )
-    )
+    chat_engine = session_chat_engine(index, index_dir)
+    answer_cache = load_answer_cache(index_dir, manifest.get("version"), index)
 
     # Welcome Screen (if no messages)
     if not st.session_state.messages:
@@ -202,61 +262,83 @@ else:
         st.write("")
         st.write("")
         
-        col1, col2, col3 = st.columns(3)
-        
-        # Helper Button Logic
-        def add_msg(text):
-            st.session_state.messages.append({"role": "user", "content": text})
-            
-        with col1:
-            if st.button("👥 How to add employees?", key="btn1"):
-                add_msg("How do I add employees to Time Tracking?")
-                st.rerun()
-        with col2:
-            if st.button("⏱️ Explain Overtime Rules", key="btn2"):
-                add_msg("How do I configure overtime rules (Daily/Weekly)?")
-                st.rerun()
-        with col3:
-            if st.button("📍 What is Geofencing?", key="btn3"):
-                add_msg("How does Geofencing work and how do I set it up?")
-                st.rerun()
+        # Helper Button Logic: the prompt is answered on the next run like a typed question
+        for i, (col, (label, text)) in enumerate(zip(st.columns(len(SUGGESTED_PROMPTS)), SUGGESTED_PROMPTS)):
+            with col:
+                if st.button(label, key=f"btn{i + 1}"):
+                    st.session_state.pending_prompt = text
+                    st.rerun()
 
     # Chat Interface
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
 
-    if prompt := st.chat_input("Ask about Scheduling, Time Tracking, or Reports..."):
+    typed = st.chat_input("Ask about Scheduling, Time Tracking, or Reports...")
+    if prompt := typed or st.session_state.pop("pending_prompt", None):
         # Add user message
         st.session_state.messages.append({"role": "user", "content": prompt})
         with st.chat_message("user"):
             st.markdown(prompt)
 
-        # Generate response
+        # Generate response: retrieval runs first, then the answer streams token by token
         with st.chat_message("assistant"):
-            with st.spinner("Analyzing UZIO documentation..."):
-                try:
-                    # Debug print for Cloud logs
-                    print(f"DEBUG: Querying LLM with model {Settings.llm.model}...")
-                    response = chat_engine.chat(prompt)
-                    st.markdown(response.response)
-                    
-                    # Show source nodes (especially images)
-                    with st.expander("🔍 View Source Context (Text & Images)"):
-                        if hasattr(response, 'source_nodes'):
-                            for node in response.source_nodes:
-                                st.markdown(f"**Score:** {node.score:.2f}")
-                                # Clean up text for display
-                                text_content = node.node.get_text().replace("Image Path:", "").strip()
-                                st.markdown(f"> {text_content[:300]}...")
-                                
-                                # Check for Image
-                                if "image_path" in node.node.metadata:
-                                    img_path = node.node.metadata["image_path"]
-                                    if os.path.exists(img_path):
-                                        st.image(img_path, caption="Relevant Screenshot/Chart", width=400)
-                except Exception as e:
-                    st.error(f"An error occurred: {str(e)}")
+            answer_area = st.empty()
+            sources_area = st.container()
+            answer = None
+            try:
+                # Debug print for Cloud logs
+                print(f"DEBUG: Querying LLM with model {Settings.llm.metadata.model_name}...")
+                with span("chat") as turn:
+                    start = time.perf_counter()
+                    # Only standalone questions are cached: follow-ups depend on the conversation.
+                    # The transcript holds just this prompt when nothing was asked before it
+                    standalone = len(st.session_state.messages) == 1
+                    query_embedding = Settings.embed_model.get_query_embedding(prompt) if standalone else None
+                    cached = answer_cache.lookup(query_embedding) if standalone else None
+                    turn["cached"] = bool(cached)
+                    if cached:
+                        question, entry, similarity = cached
+                        answer = entry["answer"]
+                        with span("rendering", sources=len(entry["sources"])):
+                            with answer_area.container():
+                                st.markdown(answer)
+                                st.caption(f"⚡ Cached answer (similarity {similarity:.2f}) · {time.perf_counter() - start:.2f}s")
+                            with sources_area:
+                                render_sources(entry["sources"])
+                        # Keep the turn in memory so follow-up questions have it as context
+                        st.session_state.chat_memory.put_messages([
+                            ChatMessage(role=MessageRole.USER, content=prompt),
+                            ChatMessage(role=MessageRole.ASSISTANT, content=answer)
+                        ])
+                        print(f"DEBUG: answer cache hit for '{question}' ({similarity:.3f}): {answer_cache.stats()}")
+                    else:
+                        with answer_area, st.spinner("Analyzing UZIO documentation..."):
+                            response = chat_engine.stream_chat(prompt)
+                        retrieved = time.perf_counter()
+                        # Memory is only updated once the stream is consumed
+                        input_tokens = prompt_tokens(prompt, response.source_nodes, memory_tokens(st.session_state.chat_memory))
+                        with span("rendering", sources=len(response.source_nodes)), sources_area:
+                            render_sources(response.source_nodes)
+
+                        timing = {}
+                        def tokens():
+                            for token in response.response_gen:
+                                timing.setdefault("first_token", time.perf_counter())
+                                yield token
+                        with answer_area.container():
+                            answer = st.write_stream(tokens())
+                            done = time.perf_counter()
+                            first_token = timing.get("first_token", done) - start
+                            st.caption(f"⏱️ First token {first_token:.1f}s · Total {done - start:.1f}s")
+                        # Streamed: the LLM call runs while the tokens are rendered
+                        record_generation(done - retrieved, input_tokens, answer, timing.get("first_token", done) - retrieved)
+                        print(f"DEBUG: retrieval={retrieved - start:.2f}s ttft={first_token:.2f}s total={done - start:.2f}s "
+                              f"context={len(response.source_nodes)} nodes/{context_tokens(response.source_nodes)} tokens")
+                        if standalone and answer:
+                            answer_cache.store(prompt, query_embedding, answer, response.source_nodes)
+            except Exception as e:
+                st.error(f"An error occurred: {str(e)}")
         
-        if 'response' in locals() and response:
-            st.session_state.messages.append({"role": "assistant", "content": response.response})
+        if answer:
+            st.session_state.messages.append({"role": "assistant", "content": answer})
@@ -0,0 +1,242 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import itertools
+
+import numpy as np
+from llama_index.core import VectorStoreIndex, Settings
+import providers
+from chunker import iter_items
+from embedding_cache import QUERY_CACHE_SIZE, EmbeddingCache
+from indexer import (
+    CHUNK_OVERLAP,
+    CHUNK_SIZE,
+    ENRICHED_DATA_FILE,
+    VECTOR_BACKEND,
+    build_index,
+    item_to_document,
+    open_vector_store,
+)
+from engine import index_params
+from index_artifacts import current_index
+from lexical import RETRIEVAL_MODE, HybridRetriever, load_lexical_index
+from local_store import IVF_LISTS, STORE_DTYPE
+
+# Configuration
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCHMARK_DIR = os.path.join(BASE_DIR, "processed_data", "benchmarks")
+K_VALUES = (1, 3, 5, 10)
+MAX_QUERIES = 500  # sampled (deterministically) from the generated questions
+RECALL_TOLERANCE = 0.02  # allowed absolute drop in recall@k / MRR versus the baseline
+LATENCY_TOLERANCE = 1.25  # allowed growth factor of p95 latency versus the baseline
+
+def split_questions(questions):
+    """
+    generated_questions is a list, or free-form text with one numbered question per line.
+    """
+    if isinstance(questions, list):
+        return [str(q).strip() for q in questions if str(q).strip()]
+    lines = [re.sub(r"^\s*(?:[-*•]|\d+[.)])\s*", "", line).strip() for line in str(questions).splitlines()]
+    return [line for line in lines if "?" in line] or [line for line in lines if line]
+
+def load_queries(path, max_queries=MAX_QUERIES, seed=0):
+    """
+    Labelled queries: every generated question maps to the document ID indexer.py
+    gives its source chunk. The questions are indexed with their chunks ("Related
+    Questions"), so scores are optimistic; use them to compare runs, not as absolute quality.
+    """
+    queries = []
+    for item in iter_items(path):
+        if not item.get("generated_questions"):
+            continue
+        doc_id = item_to_document(item).id_
+        for question in split_questions(item["generated_questions"]):
+            queries.append({"question": question, "doc_id": doc_id})
+    if max_queries and len(queries) > max_queries:
+        queries = random.Random(seed).sample(queries, max_queries)
+    return queries
+
+def evaluate(retriever, queries, top_k):
+    ranks, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results = retriever.retrieve(query["question"])
+        latencies.append((time.perf_counter() - start) * 1000)
+        # Node ids are "<document id>:<n>"
+        docs = [result.node.node_id.rsplit(":", 1)[0] for result in results]
+        ranks.append(docs.index(query["doc_id"]) + 1 if query["doc_id"] in docs else None)
+    found = [rank for rank in ranks if rank is not None]
+    metrics = {f"recall@{k}": sum(rank <= k for rank in found) / len(ranks) for k in K_VALUES if k <= top_k}
+    metrics["mrr"] = sum(1.0 / rank for rank in found) / len(ranks)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    metrics["latency_ms"] = {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3),
+                             "mean": round(float(np.mean(latencies)), 3)}
+    return metrics
+
+def build_grid(args):
+    """
+    Distinct index builds for the sweep; parameters that don't apply to a backend are dropped.
+    """
+    builds = []
+    for backend, chunk_size, embed_model, m, ef, dtype, ivf in itertools.product(
+            args.backends, args.chunk_sizes, args.embed_models, args.hnsw_m, args.hnsw_ef, args.dtypes, args.ivf_lists):
+        build = {"backend": backend, "chunk_size": chunk_size, "embed_model": embed_model}
+        if backend == "chroma":
+            build.update({"hnsw_m": m, "hnsw_ef": ef})
+        else:
+            build.update({"dtype": dtype, "ivf_lists": ivf})
+        if build not in builds:
+            builds.append(build)
+    return builds
+
+def build_scratch_index(build, input_file, scratch_dir):
+    index_dir = os.path.join(scratch_dir, f"index-{len(os.listdir(scratch_dir))}")
+    hnsw = None
+    if build["backend"] == "chroma":
+        hnsw = {"hnsw:M": build["hnsw_m"], "hnsw:construction_ef": build["hnsw_ef"], "hnsw:search_ef": build["hnsw_ef"]}
+    # Vectors come from the embedding cache, so repeated builds cost no API calls
+    summary = build_index(input_file, index_dir, full=True, backend=build["backend"],
+                          dtype=build.get("dtype", STORE_DTYPE), ivf_lists=build.get("ivf_lists", IVF_LISTS),
+                          hnsw=hnsw, chunk_size=build["chunk_size"],
+                          chunk_overlap=min(CHUNK_OVERLAP, build["chunk_size"] // 4),
+                          embed_model=build["embed_model"])
+    return index_dir, summary
+
+def run_benchmark(args):
+    queries = load_queries(args.input, args.max_queries)
+    if not queries:
+        print(f"No generated_questions found in {args.input}. Run processor.py first.")
+        return None
+    print(f"Benchmarking {len(queries)} queries from {args.input}")
+
+    live_dir = None
+    if not args.sweep and not args.index_dir:
+        live_dir, manifest = current_index(backend=args.backends[0])
+        if live_dir is None:
+            print("No index has been published yet. Run indexer.py first, or pass --index-dir.")
+            return None
+        backend, dtype, ivf_lists = index_params(manifest)
+        print(f"Benchmarking the live index at {live_dir}")
+
+    scratch_dir = tempfile.mkdtemp(prefix="uzio-bench-") if args.sweep else None
+    if args.sweep:
+        builds = build_grid(args)
+    elif live_dir:
+        builds = [{"backend": backend, "embed_model": args.embed_models[0]}]
+        if backend == "mmap":
+            builds[0].update(dtype=dtype, ivf_lists=ivf_lists)
+    else:
+        builds = [{"backend": args.backends[0], "embed_model": args.embed_models[0]}]
+    runs = []
+    try:
+        for build in builds:
+            if args.sweep:
+                print(f"\nBuilding {build}...")
+                index_dir, summary = build_scratch_index(build, args.input, scratch_dir)
+            else:
+                index_dir, summary = args.index_dir or live_dir, None
+            vector_store, _ = open_vector_store(build["backend"], index_dir,
+                                                dtype=build.get("dtype", STORE_DTYPE),
+                                                ivf_lists=build.get("ivf_lists", IVF_LISTS))
+            # Query embeddings bypass the disk cache and the in-memory query LRU by default, so
+            # every (mode, top_k) run's latency includes the embed call, not just the first one's
+            Settings.embed_model = providers.get_embed_model(
+                build["embed_model"],
+                cache=None if args.cached_queries else EmbeddingCache(enabled=False),
+                query_cache_size=QUERY_CACHE_SIZE if args.cached_queries else 0)
+            index = VectorStoreIndex.from_vector_store(vector_store)
+            bm25 = load_lexical_index(index_dir)
+            for mode, top_k in itertools.product(args.modes, args.top_k):
+                retriever = HybridRetriever(index, bm25, top_k, mode)
+                metrics = evaluate(retriever, queries, top_k)
+                params = dict(build, mode=mode, top_k=top_k)
+                run = {"params": params, **metrics}
+                if summary:
+                    run["build_seconds"] = round(summary["seconds"], 3)
+                    run["nodes"] = summary["nodes"]
+                runs.append(run)
+                recall = " ".join(f"{key}={value:.3f}" for key, value in metrics.items() if key.startswith("recall@"))
+                print(f"  {mode:13} k={top_k:<3} {recall} mrr={metrics['mrr']:.3f} "
+                      f"p50={metrics['latency_ms']['p50']:.1f}ms p95={metrics['latency_ms']['p95']:.1f}ms")
+    finally:
+        if scratch_dir:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "provider": providers.PROVIDER,
+        "input": os.path.relpath(args.input, BASE_DIR),
+        "queries": len(queries),
+        "runs": runs
+    }
+
+def compare_reports(report, baseline):
+    """
+    Returns regressions of runs with identical params: recall/MRR drops beyond
+    RECALL_TOLERANCE and p95 latency growth beyond LATENCY_TOLERANCE.
+    """
+    previous = {json.dumps(run["params"], sort_keys=True): run for run in baseline.get("runs", [])}
+    regressions = []
+    for run in report["runs"]:
+        old = previous.get(json.dumps(run["params"], sort_keys=True))
+        if old is None:
+            continue
+        for key, value in run.items():
+            if (key.startswith("recall@") or key == "mrr") and key in old and value < old[key] - RECALL_TOLERANCE:
+                regressions.append(f"{run['params']}: {key} {old[key]:.3f} -> {value:.3f}")
+        old_p95, p95 = old["latency_ms"]["p95"], run["latency_ms"]["p95"]
+        if old_p95 and p95 > old_p95 * LATENCY_TOLERANCE:
+            regressions.append(f"{run['params']}: p95 {old_p95:.1f}ms -> {p95:.1f}ms")
+    return regressions
+
+def csv_list(cast):
+    return lambda value: [cast(part) for part in value.split(",") if part]
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay generated_questions against the index and report retrieval quality and latency.")
+    parser.add_argument("--input", default=ENRICHED_DATA_FILE, help="Enriched chunks with generated_questions.")
+    parser.add_argument("--index-dir", help="Index to benchmark without --sweep (default: the published index the app serves).")
+    parser.add_argument("--max-queries", type=int, default=MAX_QUERIES, help="Questions sampled per run (0 = all).")
+    parser.add_argument("--modes", type=csv_list(str), default=[RETRIEVAL_MODE], help="Retrieval modes, e.g. vector,hybrid,lexical-first.")
+    parser.add_argument("--top-k", type=csv_list(int), default=[max(K_VALUES)], help="Retrieval depths, e.g. 2,5,10.")
+    parser.add_argument("--sweep", action="store_true", help="Build a scratch index per combination of the build parameters below.")
+    parser.add_argument("--backends", type=csv_list(str), default=[VECTOR_BACKEND], help="chroma and/or mmap.")
+    parser.add_argument("--chunk-sizes", type=csv_list(int), default=[CHUNK_SIZE], help="Node sizes in tokens for the splitter.")
+    parser.add_argument("--embed-models", type=csv_list(str), default=[providers.EMBED_MODEL], help="Embedding models.")
+    parser.add_argument("--hnsw-m", type=csv_list(int), default=[16], help="Chroma HNSW M.")
+    parser.add_argument("--hnsw-ef", type=csv_list(int), default=[100], help="Chroma HNSW construction/search ef.")
+    parser.add_argument("--dtypes", type=csv_list(str), default=[STORE_DTYPE], help="mmap store precision: float16 and/or int8.")
+    parser.add_argument("--ivf-lists", type=csv_list(int), default=[IVF_LISTS], help="mmap store IVF partitions (0 = exact).")
+    parser.add_argument("--cached-queries", action="store_true", help="Serve query embeddings from the disk cache too.")
+    parser.add_argument("--output", help="Report path (default: processed_data/benchmarks/retrieval-<timestamp>.json).")
+    parser.add_argument("--baseline", help="Earlier report to compare against; exits non-zero on regressions.")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    if report is None:
+        return 1
+    output = args.output or os.path.join(BENCHMARK_DIR, f"retrieval-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport saved to {output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_reports(report, json.load(f))
+        if regressions:
+            print(f"{len(regressions)} regression(s) versus {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"No regressions versus {args.baseline}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+import os
+from typing import Any, List, Optional
+
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.bridge.pydantic import Field, SerializeAsAny
+from llama_index.core.llms.llm import LLM
+from llama_index.core.memory.types import BaseChatStoreMemory
+
+from chunker import count_tokens, truncate_tokens
+from telemetry import record_llm, span
+
+# Configuration
+MEMORY_TOKEN_LIMIT = int(os.getenv("MEMORY_TOKEN_LIMIT", "1500"))  # budget for summary + recent turns
+SUMMARY_TOKEN_LIMIT = 300  # the running summary is truncated beyond this
+SUMMARY_PROMPT = (
+    "Update the running summary of a support conversation about UZIO. "
+    "Keep the user's goal, settings and names they mentioned, and what has already been answered. "
+    "Write at most {max_words} words.\n\n"
+    "Current summary:\n{summary}\n\n"
+    "Older turns to fold in:\n{transcript}\n\n"
+    "Updated summary:"
+)
+
+class SummaryMemory(BaseChatStoreMemory):
+    """
+    Chat memory with a fixed token budget. The newest turns are kept verbatim; once
+    they no longer fit, the oldest turns are folded into a running summary by the LLM
+    and dropped from the store, so the prompt stops growing with the conversation.
+    Without an LLM (or if summarizing fails) the overflowing turns are simply dropped.
+    """
+    token_limit: int = Field(default=MEMORY_TOKEN_LIMIT, gt=0)
+    summary_token_limit: int = Field(default=SUMMARY_TOKEN_LIMIT, gt=0)
+    llm: Optional[SerializeAsAny[LLM]] = Field(default=None, exclude=True)
+    summary: str = Field(default="")
+    compactions: int = Field(default=0)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "SummaryMemory"
+
+    @classmethod
+    def from_defaults(cls, llm=None, token_limit=MEMORY_TOKEN_LIMIT, summary_token_limit=SUMMARY_TOKEN_LIMIT,
+                      chat_history=None, **kwargs: Any) -> "SummaryMemory":
+        memory = cls(llm=llm, token_limit=token_limit, summary_token_limit=summary_token_limit, **kwargs)
+        if chat_history:
+            memory.set(chat_history)
+        return memory
+
+    @staticmethod
+    def _tokens(messages):
+        return sum(count_tokens(str(message.content or "")) for message in messages)
+
+    def _split(self, messages, budget):
+        """
+        Returns (older, recent): the newest messages fitting in budget, starting at a user turn.
+        """
+        start, used = len(messages), 0
+        while start > 0 and used + self._tokens(messages[start - 1:start]) <= budget:
+            used += self._tokens(messages[start - 1:start])
+            start -= 1
+        while start < len(messages) and messages[start].role != MessageRole.USER:
+            start += 1
+        return messages[:start], messages[start:]
+
+    def _summary_prompt(self, older):
+        transcript = "\n".join(f"{message.role.value}: {message.content}" for message in older if message.content)
+        return SUMMARY_PROMPT.format(max_words=self.summary_token_limit * 3 // 4,
+                                     summary=self.summary or "(none)", transcript=transcript)
+
+    def _record_summary(self, prompt, summary, attrs):
+        record_llm("summarization", self.llm.metadata.model_name, count_tokens(prompt), count_tokens(summary), attrs)
+
+    def _history(self, recent):
+        if not self.summary:
+            return recent
+        summary = ChatMessage(role=MessageRole.SYSTEM, content=f"Summary of the earlier conversation: {self.summary}")
+        return [summary, *recent]
+
+    def _compact(self, older, recent, summary):
+        if summary is not None:
+            self.summary = truncate_tokens(summary.strip(), self.summary_token_limit)
+        self.compactions += 1
+        self.set(recent)
+        print(f"DEBUG: Compacted {len(older)} messages into the conversation summary "
+              f"({count_tokens(self.summary)} tokens, {self._tokens(recent)} recent)")
+
+    def get(self, input: Optional[str] = None, **kwargs: Any) -> List[ChatMessage]:
+        messages = self.get_all()
+        older, recent = self._split(messages, self.token_limit - count_tokens(self.summary))
+        if older:
+            summary = None
+            if self.llm is not None:
+                try:
+                    prompt = self._summary_prompt(older)
+                    with span("summarization", messages=len(older)) as attrs:
+                        summary = self.llm.complete(prompt).text
+                        self._record_summary(prompt, summary, attrs)
+                except Exception as e:
+                    print(f"WARNING: Could not summarize the conversation, dropping older turns: {e}")
+            self._compact(older, recent, summary)
+        return self._history(recent)
+
+    async def aget(self, input: Optional[str] = None, **kwargs: Any) -> List[ChatMessage]:
+        messages = await self.aget_all()
+        older, recent = self._split(messages, self.token_limit - count_tokens(self.summary))
+        if older:
+            summary = None
+            if self.llm is not None:
+                try:
+                    prompt = self._summary_prompt(older)
+                    with span("summarization", messages=len(older)) as attrs:
+                        summary = (await self.llm.acomplete(prompt)).text
+                        self._record_summary(prompt, summary, attrs)
+                except Exception as e:
+                    print(f"WARNING: Could not summarize the conversation, dropping older turns: {e}")
+            self._compact(older, recent, summary)
+        return self._history(recent)
+
+    def reset(self) -> None:
+        super().reset()
+        self.summary = ""
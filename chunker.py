@@ -0,0 +1,247 @@
+import os
+import re
+import json
+import hashlib
+import argparse
+
+# Configuration
+INPUT_FILE = "processed_data/text_content.json"
+OUTPUT_FILE = "processed_data/chunks.json"
+MAX_TOKENS = 512  # token budget per section chunk
+OVERLAP_TOKENS = 64  # trailing paragraphs carried into the next chunk of the same section
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+def count_tokens(text):
+    """
+    Cheap, deterministic token estimate (words and punctuation marks).
+    Close enough to model tokenizers for budgeting without an extra dependency.
+    """
+    return len(TOKEN_PATTERN.findall(text))
+
+def truncate_tokens(text, max_tokens):
+    """
+    Leading whole words of text within max_tokens (by count_tokens).
+    """
+    words = text.split()[:max_tokens]  # every word is at least one token
+    while words and count_tokens(" ".join(words)) > max_tokens:
+        words.pop()
+    return " ".join(words)
+
+def iter_json_array(f, block_size=1 << 16):
+    """
+    Incrementally decodes the elements of a top-level JSON array, holding at most one
+    element plus one read block in memory instead of the whole document.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, started, eof = "", 0, False, False
+    while True:
+        # Skip whitespace, the opening bracket and separators between elements
+        while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] == "," or (not started and buffer[pos] == "[")):
+            started = started or buffer[pos] == "["
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == "]":
+            return
+        try:
+            if pos >= len(buffer):
+                raise ValueError("need more data")
+            item, end = decoder.raw_decode(buffer, pos)
+            if end == len(buffer) and not eof:
+                raise ValueError("element may continue in the next block")  # e.g. a number cut mid-digits
+        except ValueError:
+            if eof:
+                if buffer[pos:].strip():
+                    raise
+                return
+            block = f.read(block_size)
+            eof = not block
+            buffer = buffer[pos:] + block
+            pos = 0
+            continue
+        yield item
+        pos = end
+
+def iter_items(path):
+    """
+    Streams extracted chunks from a JSON array or a JSONL file.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from iter_json_array(f)
+
+def iter_by_source(items):
+    """
+    Groups consecutive items by their source document.
+    """
+    batch = []
+    for item in items:
+        if batch and item.get("source") != batch[0].get("source"):
+            yield batch
+            batch = []
+        batch.append(item)
+    if batch:
+        yield batch
+
+# (pattern, joiner) used to split an oversized paragraph: lines, then sentences, then words
+SPLIT_LEVELS = [
+    (re.compile(r"\n"), "\n"),
+    (re.compile(r"(?<=[.!?])\s+"), " "),
+    (re.compile(r"\s+"), " "),
+]
+
+def split_oversized(text, max_tokens, levels=SPLIT_LEVELS):
+    """
+    Splits a single paragraph/table that is larger than the budget on line, then
+    sentence, then word boundaries.
+    """
+    if count_tokens(text) <= max_tokens or not levels:
+        return [text]
+    (pattern, joiner), rest = levels[0], levels[1:]
+    pieces = pattern.split(text)
+    if len(pieces) == 1:
+        return split_oversized(text, max_tokens, rest)
+    parts, current = [], ""
+    for piece in pieces:
+        candidate = f"{current}{joiner}{piece}" if current else piece
+        if current and count_tokens(candidate) > max_tokens:
+            parts.extend(split_oversized(current, max_tokens, rest))
+            current = piece
+        else:
+            current = candidate
+    if current:
+        parts.extend(split_oversized(current, max_tokens, rest))
+    return parts
+
+def chunk_document(items, max_tokens=MAX_TOKENS, overlap_tokens=OVERLAP_TOKENS):
+    """
+    Groups one document's paragraphs and tables into section chunks.
+    Word headings open a new section; a section is split when it exceeds the token
+    budget, repeating up to overlap_tokens of trailing paragraphs in the next chunk.
+    Image items are passed through (they still need captioning) and tagged with the
+    section they appear in; the section chunk lists them in "image_refs".
+    """
+    source = items[0].get("source")
+    sections = []
+    headings = []  # [(level, text)] of the current heading path
+    body, body_ids = [], []
+    chunk_of = {}  # extracted chunk id -> index into sections
+
+    def section_title():
+        return " > ".join(text for _, text in headings)
+
+    def flush(carry_overlap):
+        nonlocal body, body_ids
+        if not body:
+            return
+        title = section_title()
+        parts = ([title] if title else []) + body
+        sections.append({
+            "source": source,
+            "type": "text",
+            "section": title,
+            "content": "\n".join(parts),
+            "chunk_ids": list(body_ids),
+            "image_refs": [],
+            "tokens": count_tokens("\n".join(parts))
+        })
+        for chunk_id in body_ids:
+            chunk_of.setdefault(chunk_id, len(sections) - 1)
+        kept, kept_ids = [], []
+        if carry_overlap and overlap_tokens > 0:
+            budget = overlap_tokens
+            for text, chunk_id in zip(reversed(body), reversed(body_ids)):
+                budget -= count_tokens(text)
+                if budget < 0:
+                    break
+                kept.insert(0, text)
+                kept_ids.insert(0, chunk_id)
+        body, body_ids = kept, kept_ids
+
+    images = []
+    for item in items:
+        if item["type"] == "image":
+            images.append(item)
+            continue
+        level = item.get("heading_level")
+        if level is not None:
+            flush(carry_overlap=False)
+            headings = [h for h in headings if h[0] < level] + [(level, item["content"])]
+            if item.get("id"):
+                # Headings map to the first chunk of their section
+                chunk_of[item["id"]] = len(sections)
+            continue
+        title_tokens = count_tokens(section_title())
+        for piece in split_oversized(item["content"], max(1, max_tokens - title_tokens)):
+            pending = count_tokens("\n".join(body + [piece])) + title_tokens
+            if body and pending > max_tokens:
+                flush(carry_overlap=True)
+                # Drop the overlap again if the piece alone would not fit beside it
+                if count_tokens("\n".join(body + [piece])) + title_tokens > max_tokens:
+                    body, body_ids = [], []
+            body.append(piece)
+            body_ids.append(item.get("id"))
+    flush(carry_overlap=False)
+
+    assign_section_ids(sections)
+
+    for image in images:
+        anchor = chunk_of.get(image.get("after_chunk"))
+        if anchor is not None and anchor < len(sections):
+            section = sections[anchor]
+            section["image_refs"].append(image.get("id"))
+            image = dict(image, section=section["section"], parent_chunk=section["id"])
+        sections.append(image)
+    return sections
+
+def assign_section_ids(sections):
+    occurrences = {}
+    for section in sections:
+        key = f"{section['source']}\x00{section['content']}"
+        n = occurrences.get(key, 0)
+        occurrences[key] = n + 1
+        digest = hashlib.sha1(f"{key}\x00{n}".encode("utf-8")).hexdigest()[:16]
+        section["id"] = f"{section['source']}:s-{digest}"
+
+def run_chunking(input_path=INPUT_FILE, output_path=OUTPUT_FILE, max_tokens=MAX_TOKENS, overlap_tokens=OVERLAP_TOKENS):
+    if not os.path.exists(input_path):
+        print(f"Input file {input_path} not found. Run extractor.py first.")
+        return
+
+    total_in, total_out, text_out = 0, 0, 0
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as out:
+        if not output_path.endswith(".jsonl"):
+            out.write("[\n")
+        first = True
+        for items in iter_by_source(iter_items(input_path)):
+            total_in += len(items)
+            for chunk in chunk_document(items, max_tokens, overlap_tokens):
+                if output_path.endswith(".jsonl"):
+                    out.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+                else:
+                    out.write(("" if first else ",\n") + json.dumps(chunk, indent=2))
+                first = False
+                total_out += 1
+                text_out += chunk["type"] != "image"
+        if not output_path.endswith(".jsonl"):
+            out.write("\n]\n")
+    os.replace(tmp_path, output_path)
+
+    print(f"Chunking complete. Data saved to {output_path}")
+    print(f"{total_in} extracted items -> {total_out} chunks ({text_out} section chunks, budget {max_tokens} tokens)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Group extracted paragraphs, tables and images into token-budgeted section chunks.")
+    parser.add_argument("--input", default=INPUT_FILE, help="extractor.py output (.json or .jsonl).")
+    parser.add_argument("--output", default=OUTPUT_FILE, help="Chunked output (.json or .jsonl), input for processor.py.")
+    parser.add_argument("--max-tokens", type=int, default=MAX_TOKENS, help="Token budget per section chunk.")
+    parser.add_argument("--overlap", type=int, default=OVERLAP_TOKENS, help="Tokens of trailing paragraphs repeated in the next chunk (0 disables).")
+    args = parser.parse_args()
+    run_chunking(args.input, args.output, args.max_tokens, args.overlap)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import os
+import re
+import math
+from typing import Any, List, Optional
+
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle, TextNode
+
+from chunker import count_tokens, truncate_tokens
+from lexical import tokenize
+
+# Configuration
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "8"))  # nodes retrieved before reranking
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))  # tokens of context sent to the LLM
+MAX_CONTEXT_NODES = 4
+RERANK_WEIGHT = 0.6  # share of the rerank score from query-term coverage; the rest is the retrieval rank
+DUPLICATE_OVERLAP = 0.5  # share of a node's word shingles already in the context that marks it a duplicate
+SHINGLE_SIZE = 8
+IMAGE_DESCRIPTION_TOKENS = 150  # screenshot descriptions are trimmed to this in the context
+LLM_EXCLUDED_METADATA = ["image_path", "thumb_path"]  # file paths mean nothing to the LLM
+
+RELATED_QUESTIONS = re.compile(r"\n+Related Questions:\n.*\Z", re.DOTALL)  # appended by indexer.py
+ORIGINAL_FILE = re.compile(r"\n?\[ORIGINAL FILE\].*\Z", re.DOTALL)  # appended by processor.py to image chunks
+IMAGE_DESCRIPTION = "[IMAGE DESCRIPTION]"
+UNCAPTIONED_IMAGE = re.compile(r"\AImage File: \S+\Z")  # extractor.py placeholder, nothing for the LLM to read
+
+def clean_text(text):
+    """
+    The part of an indexed chunk worth showing the LLM: the generated "Related Questions"
+    and the original-file line only help retrieval, and long screenshot descriptions are trimmed.
+    """
+    text = RELATED_QUESTIONS.sub("", text).strip()
+    if UNCAPTIONED_IMAGE.match(text):
+        return ""
+    if text.startswith(IMAGE_DESCRIPTION):
+        description = ORIGINAL_FILE.sub("", text[len(IMAGE_DESCRIPTION):]).strip()
+        text = "Screenshot: " + truncate_tokens(description, IMAGE_DESCRIPTION_TOKENS)
+    return text.strip()
+
+def shingles(text):
+    words = text.lower().split()
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(len(words) - SHINGLE_SIZE + 1, 1))}
+
+class ContextPacker(BaseNodePostprocessor):
+    """
+    Reranks over-fetched candidates with a local scorer (IDF-weighted query-term and
+    bigram coverage, blended with the retrieval rank), drops chunks that mostly repeat
+    one already selected (e.g. the overlap between neighbouring chunks), strips
+    index-only text and packs the best under a token budget for the LLM context.
+    Returns copies of the nodes; the originals in the store are untouched.
+    """
+    token_budget: int = Field(default=CONTEXT_TOKEN_BUDGET, gt=0)
+    max_nodes: int = Field(default=MAX_CONTEXT_NODES, gt=0)
+    bm25: Optional[Any] = Field(default=None, exclude=True, description="BM25Index for term IDF, if available.")
+    last_stats: dict = Field(default_factory=dict, exclude=True)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ContextPacker"
+
+    def _idf(self, term):
+        if self.bm25 is None or not self.bm25.ids:
+            return 1.0
+        n, df = len(self.bm25.ids), len(self.bm25.postings.get(term, ()))
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def rerank(self, nodes, query):
+        terms = tokenize(query)
+        weights = {term: self._idf(term) for term in set(terms)}
+        bigrams = set(zip(terms, terms[1:]))
+        total = sum(weights.values())
+        scored = []
+        for rank, result in enumerate(nodes):
+            words = tokenize(result.node.get_content())
+            present = set(words)
+            coverage = sum(weight for term, weight in weights.items() if term in present) / total if total else 0.0
+            if bigrams:
+                coverage = 0.8 * coverage + 0.2 * len(bigrams & set(zip(words, words[1:]))) / len(bigrams)
+            prior = 1.0 - rank / len(nodes)
+            scored.append((RERANK_WEIGHT * coverage + (1 - RERANK_WEIGHT) * prior, rank, result))
+        scored.sort(key=lambda entry: (-entry[0], entry[1]))
+        return [(score, result) for score, _, result in scored]
+
+    def _postprocess_nodes(self, nodes: List[NodeWithScore], query_bundle: Optional[QueryBundle] = None) -> List[NodeWithScore]:
+        if not nodes:
+            self.last_stats = {"candidates": 0, "packed": 0, "duplicates": 0, "tokens": 0}
+            return []
+        ranked = self.rerank(nodes, query_bundle.query_str if query_bundle else "")
+        packed, seen, used, duplicates = [], set(), 0, 0
+        for score, result in ranked:
+            if len(packed) >= self.max_nodes:
+                break
+            text = clean_text(result.node.get_content())
+            if not text:
+                continue
+            node_shingles = shingles(text)
+            if len(node_shingles & seen) >= DUPLICATE_OVERLAP * len(node_shingles):
+                duplicates += 1
+                continue
+            node = TextNode(id_=result.node.node_id, text=text, metadata=dict(result.node.metadata),
+                            excluded_llm_metadata_keys=LLM_EXCLUDED_METADATA)
+            tokens = count_tokens(node.get_content(metadata_mode=MetadataMode.LLM))
+            if used + tokens > self.token_budget:
+                if packed:
+                    continue  # a shorter, lower ranked chunk may still fit
+                # The best chunk alone is over budget: keep its beginning
+                node.text = truncate_tokens(text, self.token_budget - (tokens - count_tokens(text)))
+                tokens = count_tokens(node.get_content(metadata_mode=MetadataMode.LLM))
+            packed.append(NodeWithScore(node=node, score=score))
+            seen |= node_shingles
+            used += tokens
+        self.last_stats = {"candidates": len(nodes), "packed": len(packed), "duplicates": duplicates, "tokens": used}
+        return packed
+
+    async def _apostprocess_nodes(self, nodes: List[NodeWithScore], query_bundle: Optional[QueryBundle] = None) -> List[NodeWithScore]:
+        # Pure CPU work on a handful of nodes; not worth a thread hop
+        return self._postprocess_nodes(nodes, query_bundle)
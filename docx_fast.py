@@ -0,0 +1,260 @@
+import os
+import time
+import zipfile
+import argparse
+import posixpath
+from lxml import etree
+
+from extractor import store_image, add_image_chunks, doc_name_for, embedded_rids, heading_level
+
+# Fast-path extraction engine.
+# Streams word/document.xml straight out of the .docx zip with iterparse instead of
+# wrapping every block in python-docx Paragraph/Table objects. Its chunks, including
+# where in the flow each image is first referenced, are identical to extractor.process_docx.
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+IMAGE_REL_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/image"
+
+W = f"{{{W_NS}}}"
+BODY = f"{W}body"
+P, TBL, TR, TC, R, HYPERLINK = f"{W}p", f"{W}tbl", f"{W}tr", f"{W}tc", f"{W}r", f"{W}hyperlink"
+
+BENCHMARK_FILES = [
+    "UZIO Overview (Master).docx",
+    "UZIO Scheduling.docx",
+    "UZIO Time Tracking.docx"
+]
+
+def run_text(r):
+    # Mirrors python-docx CT_R.text
+    parts = []
+    for child in r:
+        tag = child.tag
+        if tag == f"{W}t":
+            parts.append(child.text or "")
+        elif tag in (f"{W}tab", f"{W}ptab"):
+            parts.append("\t")
+        elif tag == f"{W}cr":
+            parts.append("\n")
+        elif tag == f"{W}br":
+            if child.get(f"{W}type", "textWrapping") == "textWrapping":
+                parts.append("\n")
+        elif tag == f"{W}noBreakHyphen":
+            parts.append("-")
+    return "".join(parts)
+
+def paragraph_text(p):
+    # Mirrors python-docx CT_P.text: direct runs plus runs inside direct hyperlinks
+    parts = []
+    for child in p:
+        if child.tag == R:
+            parts.append(run_text(child))
+        elif child.tag == HYPERLINK:
+            parts.extend(run_text(r) for r in child if r.tag == R)
+    return "".join(parts)
+
+def cell_text(tc):
+    return "\n".join(paragraph_text(p) for p in tc if p.tag == P)
+
+def table_rows(tbl):
+    """
+    Mirrors python-docx row.cells: a horizontally merged cell repeats once per grid
+    column it spans, and a vertically merged continuation cell repeats the cell
+    above it at the same grid offset.
+    """
+    rows = []
+    above = []  # (grid_start, grid_span, text, repeat) per cell of the previous row
+    for tr in tbl:
+        if tr.tag != TR:
+            continue
+        offset = 0
+        tr_pr = tr.find(f"{W}trPr")
+        if tr_pr is not None:
+            grid_before = tr_pr.find(f"{W}gridBefore")
+            if grid_before is not None:
+                offset = int(grid_before.get(f"{W}val", "0"))
+        row, current = [], []
+        for tc in tr:
+            if tc.tag != TC:
+                continue
+            span, v_merge = 1, None
+            tc_pr = tc.find(f"{W}tcPr")
+            if tc_pr is not None:
+                grid_span = tc_pr.find(f"{W}gridSpan")
+                if grid_span is not None:
+                    span = int(grid_span.get(f"{W}val", "1"))
+                v_merge_el = tc_pr.find(f"{W}vMerge")
+                if v_merge_el is not None:
+                    v_merge = v_merge_el.get(f"{W}val", "continue")
+            text, repeat = None, span
+            if v_merge == "continue":
+                for start, width, above_text, above_repeat in above:
+                    if start <= offset < start + width:
+                        text, repeat = above_text, above_repeat
+                        break
+            if text is None:
+                text, repeat = cell_text(tc), span
+            row.extend([text] * repeat)
+            current.append((offset, span, text, repeat))
+            offset += span
+        rows.append(row)
+        above = current
+    return rows
+
+def paragraph_style_names(zf):
+    """
+    Returns {styleId: style name} for paragraph styles, so headings can be detected
+    the same way python-docx's paragraph.style.name does.
+    """
+    if "word/styles.xml" not in zf.namelist():
+        return {}
+    styles = etree.fromstring(zf.read("word/styles.xml"))
+    names = {}
+    for style in styles.iter(f"{W}style"):
+        if style.get(f"{W}type") != "paragraph":
+            continue
+        name = style.find(f"{W}name")
+        names[style.get(f"{W}styleId")] = name.get(f"{W}val") if name is not None else None
+    return names
+
+def paragraph_style_id(p):
+    p_pr = p.find(f"{W}pPr")
+    if p_pr is None:
+        return None
+    p_style = p_pr.find(f"{W}pStyle")
+    return p_style.get(f"{W}val") if p_style is not None else None
+
+def image_rels(zf):
+    """
+    Returns {rId: part name} for internal image relationships, in rels-file order
+    (the same order python-docx exposes doc.part.rels).
+    """
+    rels_xml = etree.fromstring(zf.read("word/_rels/document.xml.rels"))
+    rels = {}
+    for rel in rels_xml.iter(f"{{{PKG_REL_NS}}}Relationship"):
+        if rel.get("Type") != IMAGE_REL_TYPE or rel.get("TargetMode") == "External":
+            continue
+        target = rel.get("Target")
+        if target.startswith("/"):
+            part_name = target.lstrip("/")
+        else:
+            part_name = posixpath.normpath(posixpath.join("word", target))
+        rels[rel.get("Id")] = part_name
+    return rels
+
+def iter_body_blocks(zf):
+    """
+    Streams the direct children of w:body, clearing each one after it is yielded
+    so memory stays bounded by a single paragraph or table.
+    """
+    depth = 0
+    in_body = False
+    with zf.open("word/document.xml") as f:
+        for event, elem in etree.iterparse(f, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if elem.tag == BODY:
+                    in_body = True
+                continue
+            depth -= 1
+            if elem.tag == BODY:
+                in_body = False
+            elif in_body and depth == 2:
+                yield elem
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+
+def process_docx_fast(file_path, doc_name=None):
+    """
+    Drop-in replacement for extractor.process_docx built on lxml iterparse.
+    """
+    doc_name = doc_name or doc_name_for(file_path)
+    content = []
+    first_seen = {}
+
+    with zipfile.ZipFile(file_path) as zf:
+        print(f"Extracting images from {doc_name}...")
+        image_map = {}
+        for rid, part_name in image_rels(zf).items():
+            try:
+                ext = os.path.splitext(part_name)[1].lower() or ".png"
+                image_map[rid] = store_image(zf.read(part_name), ext)
+            except Exception as e:
+                print(f"Failed to extract image {rid} from {doc_name}: {e}")
+
+        print(f"Extracting text from {doc_name}...")
+        style_names = paragraph_style_names(zf)
+        for block_index, elem in enumerate(iter_body_blocks(zf)):
+            if elem.tag == P:
+                text = paragraph_text(elem).strip()
+                if text:
+                    chunk = {
+                        "source": doc_name,
+                        "type": "text",
+                        "content": text
+                    }
+                    level = heading_level(style_names.get(paragraph_style_id(elem)))
+                    if level is not None:
+                        chunk["heading_level"] = level
+                    content.append(chunk)
+            elif elem.tag == TBL:
+                table_data = [" | ".join(cell.strip() for cell in row) for row in table_rows(elem)]
+                table_text = "\n".join(table_data)
+                if table_text.strip():
+                    content.append({
+                        "source": doc_name,
+                        "type": "table",
+                        "content": table_text
+                    })
+            else:
+                continue
+            for rid in embedded_rids(elem):
+                # Remember the chunk index so ids can be resolved after assign_chunk_ids
+                first_seen.setdefault(rid, (len(content) - 1, block_index))
+
+    return add_image_chunks(content, doc_name, image_map, first_seen)
+
+def _comparable(chunks):
+    return [(c["type"], c["content"], c.get("heading_level")) for c in chunks if c["type"] != "image"]
+
+def _anchors(chunks):
+    return {c["image_hash"]: (c["after_chunk"], c["block_index"]) for c in chunks if c["type"] == "image"}
+
+def benchmark(files, repeat=3):
+    """
+    Times extractor.process_docx against process_docx_fast on each file and checks
+    that both produce the same text/table chunks and the same images at the same positions.
+    """
+    from extractor import process_docx
+
+    print(f"{'document':40} {'python-docx':>12} {'lxml':>10} {'speedup':>8}  identical")
+    for f in files:
+        if not os.path.exists(f):
+            print(f"File not found: {f}")
+            continue
+        timings = {}
+        outputs = {}
+        for name, fn in (("python-docx", process_docx), ("lxml", process_docx_fast)):
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                outputs[name] = fn(f)
+                best = min(best, time.perf_counter() - start)
+            timings[name] = best
+        same_text = _comparable(outputs["python-docx"]) == _comparable(outputs["lxml"])
+        same_images = _anchors(outputs["python-docx"]) == _anchors(outputs["lxml"])
+        speedup = timings["python-docx"] / timings["lxml"] if timings["lxml"] else float("inf")
+        print(f"{os.path.basename(f)[:40]:40} {timings['python-docx']:>11.3f}s {timings['lxml']:>9.3f}s "
+              f"{speedup:>7.1f}x  {same_text and same_images}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the lxml fast-path extractor against python-docx.")
+    parser.add_argument("files", nargs="*", default=BENCHMARK_FILES, help="Documents to benchmark (default: bundled UZIO manuals).")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per engine; the best time is reported.")
+    args = parser.parse_args()
+    benchmark(args.files, repeat=args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+import os
+import asyncio
+import sqlite3
+import contextvars
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import numpy as np
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.embeddings import BaseEmbedding
+
+from chunker import count_tokens
+from telemetry import record_embedding, span
+
+# Configuration
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EMBED_CACHE_FILE = os.path.join(BASE_DIR, "processed_data", "embedding_cache.sqlite3")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))  # texts per embedding API call
+EMBED_PARALLEL = int(os.getenv("EMBED_PARALLEL", "4"))  # batches in flight at once
+QUERY_CACHE_SIZE = 1024  # query embeddings kept in memory
+QUERY_BATCH_WINDOW = float(os.getenv("QUERY_BATCH_WINDOW", "0.005"))  # seconds concurrent queries wait to share a call
+QUERY_BATCH_SIZE = 32  # queries per coalesced embedding call
+
+def vector_key(model, kind, text):
+    # kind separates document and query vectors: providers embed them with different task types
+    return f"{model}|{kind}|{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+class EmbeddingCache:
+    """
+    On-disk store of embedding vectors keyed by (model, kind, text hash).
+    Vectors are stored as raw float32 blobs. Safe to share between threads.
+    """
+    def __init__(self, path=EMBED_CACHE_FILE, enabled=True):
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = None
+        if not enabled:
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self.conn.commit()
+
+    def get_many(self, keys):
+        """
+        Returns {key: vector} for the keys that are stored.
+        """
+        found = {}
+        if self.enabled and keys:
+            with self.lock:
+                for i in range(0, len(keys), 500):  # stay under SQLite's bound-parameter limit
+                    page = keys[i:i + 500]
+                    rows = self.conn.execute(
+                        f"SELECT key, vector FROM vectors WHERE key IN ({','.join('?' * len(page))})", page
+                    ).fetchall()
+                    found.update((key, np.frombuffer(blob, dtype=np.float32).tolist()) for key, blob in rows)
+        self.hits += len(found)
+        self.misses += len(set(keys)) - len(found)
+        return found
+
+    def put_many(self, items):
+        if not self.enabled or not items:
+            return
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items]
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO vectors (key, vector) VALUES (?, ?)", rows)
+            self.conn.commit()
+
+    def stats(self):
+        entries = 0
+        if self.enabled:
+            with self.lock:
+                entries = self.conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries
+        }
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Wraps an embedding model with the on-disk vector cache. Cache misses are sent in
+    batches of batch_size with up to `parallel` batches in flight; query embeddings
+    are also kept in an in-memory LRU so repeated questions skip the round-trip.
+    """
+    batch_size: int = Field(default=EMBED_BATCH_SIZE, description="Texts per call to the wrapped model.")
+    parallel: int = Field(default=EMBED_PARALLEL, description="Batches in flight at once.")
+    query_cache_size: int = Field(default=QUERY_CACHE_SIZE, description="Query vectors kept in memory.")
+
+    _inner: Any = PrivateAttr()
+    _store: Any = PrivateAttr()
+    _queries: Any = PrivateAttr()
+    _queries_lock: Any = PrivateAttr()
+
+    def __init__(self, inner, store=None, batch_size=EMBED_BATCH_SIZE, parallel=EMBED_PARALLEL,
+                 query_cache_size=QUERY_CACHE_SIZE, **kwargs):
+        batch_size, parallel = max(1, batch_size), max(1, parallel)
+        super().__init__(
+            model_name=inner.model_name,
+            # Hand this wrapper enough texts at once to fill every parallel batch
+            embed_batch_size=batch_size * parallel,
+            batch_size=batch_size,
+            parallel=parallel,
+            query_cache_size=query_cache_size,
+            **kwargs
+        )
+        self._inner = inner
+        self._store = store if store is not None else EmbeddingCache()
+        self._queries = OrderedDict()
+        self._queries_lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def store(self):
+        return self._store
+
+    def _remember_query(self, key, vector):
+        with self._queries_lock:
+            self._queries[key] = vector
+            self._queries.move_to_end(key)
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+
+    def _recall_query(self, key):
+        with self._queries_lock:
+            vector = self._queries.get(key)
+            if vector is not None:
+                self._queries.move_to_end(key)
+            return vector
+
+    def _lookup(self, texts):
+        """
+        Returns (keys, vectors by key, texts still to embed with their keys).
+        """
+        keys = [vector_key(self.model_name, "doc", text) for text in texts]
+        found = self._store.get_many(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        return keys, found, list(missing.items())
+
+    def _batches(self, missing):
+        return [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+
+    def _get_text_embeddings(self, texts):
+        keys, found, missing = self._lookup(texts)
+        batches = self._batches(missing)
+
+        def embed(batch):
+            texts = [text for _, text in batch]
+            with span("embedding", kind="doc", texts=len(texts)) as attrs:
+                vectors = self._inner._get_text_embeddings(texts)
+                record_embedding(self.model_name, "doc", len(texts), sum(map(count_tokens, texts)), attrs)
+            items = [(key, vector) for (key, _), vector in zip(batch, vectors)]
+            self._store.put_many(items)
+            return items
+
+        if len(batches) > 1 and self.parallel > 1:
+            with ThreadPoolExecutor(max_workers=min(self.parallel, len(batches))) as pool:
+                results = list(pool.map(embed, batches))
+        else:
+            results = [embed(batch) for batch in batches]
+        for items in results:
+            found.update(items)
+        return [found[key] for key in keys]
+
+    async def _aget_text_embeddings(self, texts):
+        keys, found, missing = self._lookup(texts)
+        semaphore = asyncio.Semaphore(self.parallel)
+
+        async def embed(batch):
+            texts = [text for _, text in batch]
+            async with semaphore:
+                with span("embedding", kind="doc", texts=len(texts)) as attrs:
+                    vectors = await self._inner._aget_text_embeddings(texts)
+                    record_embedding(self.model_name, "doc", len(texts), sum(map(count_tokens, texts)), attrs)
+            items = [(key, vector) for (key, _), vector in zip(batch, vectors)]
+            self._store.put_many(items)
+            return items
+
+        for items in await asyncio.gather(*(embed(batch) for batch in self._batches(missing))):
+            found.update(items)
+        return [found[key] for key in keys]
+
+    def _get_text_embedding(self, text):
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text):
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _cached_query(self, query):
+        key = vector_key(self.model_name, "query", query)
+        vector = self._recall_query(key)
+        if vector is None:
+            vector = self._store.get_many([key]).get(key)
+            if vector is not None:
+                self._remember_query(key, vector)
+        return key, vector
+
+    def _get_query_embedding(self, query):
+        key, vector = self._cached_query(query)
+        if vector is None:
+            with span("embedding", kind="query", texts=1) as attrs:
+                vector = self._inner._get_query_embedding(query)
+                record_embedding(self.model_name, "query", 1, count_tokens(query), attrs)
+            self._store.put_many([(key, vector)])
+            self._remember_query(key, vector)
+        return vector
+
+    async def _aget_query_embedding(self, query):
+        key, vector = self._cached_query(query)
+        if vector is None:
+            with span("embedding", kind="query", texts=1) as attrs:
+                vector = await self._inner._aget_query_embedding(query)
+                record_embedding(self.model_name, "query", 1, count_tokens(query), attrs)
+            self._store.put_many([(key, vector)])
+            self._remember_query(key, vector)
+        return vector
+
+    async def _aget_query_embeddings(self, queries):
+        """
+        Embeds several queries at once: cached ones are served from memory/disk, and the
+        misses go to the wrapped model in one batch when it supports batched queries
+        (otherwise as concurrent single calls).
+        """
+        found, missing = {}, {}
+        for query in queries:
+            key, vector = self._cached_query(query)
+            if vector is not None:
+                found[query] = vector
+            else:
+                missing[query] = key
+        if missing:
+            batched = getattr(self._inner, "_aget_query_embeddings", None)
+            with span("embedding", kind="query", texts=len(missing)) as attrs:
+                if batched is not None:
+                    vectors = await batched(list(missing))
+                    record_embedding(self.model_name, "query", len(missing), sum(map(count_tokens, missing)), attrs)
+                else:
+                    vectors = await asyncio.gather(*(self._inner._aget_query_embedding(query) for query in missing))
+                    for query in missing:
+                        record_embedding(self.model_name, "query", 1, count_tokens(query), attrs)
+            self._store.put_many([(key, vector) for key, vector in zip(missing.values(), vectors)])
+            for (query, key), vector in zip(missing.items(), vectors):
+                self._remember_query(key, vector)
+                found[query] = vector
+        return [found[query] for query in queries]
+
+class CoalescingEmbedding(BaseEmbedding):
+    """
+    Coalesces concurrent async query embeddings into batches: calls arriving within
+    `window` seconds of each other (up to max_batch) share one call to the wrapped
+    model's _aget_query_embeddings. Used by the HTTP service, where many requests
+    embed their questions at the same time. Must be used from a single event loop;
+    sync calls and document embeddings go straight to the wrapped model.
+    """
+    window: float = Field(default=QUERY_BATCH_WINDOW, description="Seconds to wait for more queries.")
+    max_batch: int = Field(default=QUERY_BATCH_SIZE, description="Queries per coalesced call.")
+
+    _inner: Any = PrivateAttr()
+    _pending: Any = PrivateAttr()
+    _timer: Any = PrivateAttr()
+    _batches: int = PrivateAttr(default=0)
+    _queries: int = PrivateAttr(default=0)
+
+    def __init__(self, inner, window=QUERY_BATCH_WINDOW, max_batch=QUERY_BATCH_SIZE, **kwargs):
+        super().__init__(model_name=inner.model_name, embed_batch_size=inner.embed_batch_size,
+                         window=window, max_batch=max(1, max_batch), **kwargs)
+        self._inner = inner
+        self._pending = []  # [(query, future)]
+        self._timer = None
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CoalescingEmbedding"
+
+    @property
+    def inner(self):
+        return self._inner
+
+    def stats(self):
+        return {
+            "batches": self._batches,
+            "queries": self._queries,
+            "mean_batch": self._queries / self._batches if self._batches else 0.0
+        }
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            # A fresh context: the batch serves several requests, so its span belongs to none of their traces
+            asyncio.get_running_loop().create_task(self._embed_batch(batch), context=contextvars.Context())
+
+    async def _embed_batch(self, batch):
+        self._batches += 1
+        self._queries += len(batch)
+        queries = list(dict.fromkeys(query for query, _ in batch))
+        try:
+            batched = getattr(self._inner, "_aget_query_embeddings", None)
+            if batched is not None:
+                vectors = await batched(queries)
+            else:
+                vectors = await asyncio.gather(*(self._inner._aget_query_embedding(query) for query in queries))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        by_query = dict(zip(queries, vectors))
+        for query, future in batch:
+            if not future.done():
+                future.set_result(by_query[query])
+
+    async def _aget_query_embedding(self, query):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((query, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _get_query_embedding(self, query):
+        return self._inner._get_query_embedding(query)
+
+    def _get_text_embedding(self, text):
+        return self._inner._get_text_embedding(text)
+
+    def _get_text_embeddings(self, texts):
+        return self._inner._get_text_embeddings(texts)
+
+    async def _aget_text_embedding(self, text):
+        return await self._inner._aget_text_embedding(text)
+
+    async def _aget_text_embeddings(self, texts):
+        return await self._inner._aget_text_embeddings(texts)
@@ -0,0 +1,69 @@
+from llama_index.core import Settings, VectorStoreIndex
+from llama_index.core.chat_engine import ContextChatEngine
+from llama_index.core.schema import MetadataMode
+
+from chunker import count_tokens
+from context_packer import RERANK_CANDIDATES, ContextPacker
+from indexer import open_vector_store
+from lexical import HybridRetriever, load_lexical_index
+from local_store import IVF_LISTS, STORE_DTYPE
+from telemetry import record, record_llm
+
+# Chat engine construction shared by the Streamlit UI (app.py) and the HTTP service (server.py)
+
+# Configuration
+SYSTEM_PROMPT = (
+    "You are an expert UZIO Software Consultant. "
+    "Your goal is to provide clear, step-by-step answers based strictly on the provided documentation. "
+    "If the context includes image descriptions (screenshots/charts), use them to explain where to click or what the UI looks like. "
+    "Be professional, concise, and friendly."
+)
+
+def index_params(manifest):
+    # (backend, dtype, ivf_lists) the index was built with, for open_index
+    params = manifest.get("params", {})
+    return manifest.get("backend", "chroma"), params.get("dtype", STORE_DTYPE), params.get("ivf_lists", IVF_LISTS)
+
+def open_index(index_dir, backend, dtype=STORE_DTYPE, ivf_lists=IVF_LISTS):
+    """
+    Returns (VectorStoreIndex, BM25 index or None) for a built index directory.
+    Uses the models in Settings, which the caller sets up first.
+    """
+    vector_store, _ = open_vector_store(backend, index_dir, dtype=dtype, ivf_lists=ivf_lists)
+    return VectorStoreIndex.from_vector_store(vector_store), load_lexical_index(index_dir)
+
+def make_chat_engine(index, bm25, memory=None):
+    # Over-fetch candidates; the packer reranks them and fits the best into the context budget
+    retriever = HybridRetriever(index, bm25, similarity_top_k=RERANK_CANDIDATES)
+    return ContextChatEngine.from_defaults(retriever=retriever, system_prompt=SYSTEM_PROMPT, memory=memory,
+                                           node_postprocessors=[ContextPacker(bm25=bm25)])
+
+def reuse_query_embedding(chat_engine, question, embedding):
+    # A question already embedded for the answer cache is not embedded again for retrieval
+    chat_engine._retriever.reuse_embedding(question, embedding)
+
+def context_tokens(source_nodes):
+    return sum(count_tokens(node.node.get_content(metadata_mode=MetadataMode.LLM)) for node in source_nodes)
+
+def memory_tokens(memory):
+    # Conversation history (and running summary) sent with the next turn
+    if memory is None:
+        return 0
+    return (count_tokens(getattr(memory, "summary", ""))
+            + sum(count_tokens(str(message.content or "")) for message in memory.get_all()))
+
+def prompt_tokens(question, source_nodes, history_tokens=0):
+    """
+    Estimated LLM input of a chat turn: system prompt, packed context, conversation
+    history (see memory_tokens) and the question.
+    """
+    return count_tokens(SYSTEM_PROMPT) + context_tokens(source_nodes) + history_tokens + count_tokens(question)
+
+def record_generation(seconds, input_tokens, answer, first_token_seconds=None):
+    # One chat completion timed by the caller, with its API call and token counts
+    model = Settings.llm.metadata.model_name
+    attrs = {"model": model}
+    if first_token_seconds is not None:
+        attrs["first_token_ms"] = round(first_token_seconds * 1000, 1)
+    record_llm("generation", model, input_tokens, count_tokens(answer or ""), attrs)
+    record("generation", seconds, **attrs)
@@ -1,12 +1,19 @@
 import os
+import re
+import json
+import hashlib
+import argparse
+from telemetry import span
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from docx import Document
 from docx.document import Document as _Document
 from docx.oxml.text.paragraph import CT_P
 from docx.oxml.table import CT_Tbl
 from docx.table import _Cell, Table, _Row
 from docx.text.paragraph import Paragraph
+from docx.oxml.ns import qn
 import pandas as pd
-from PIL import Image
+from PIL import Image, features
 import io
 
 # Configuration
@@ -14,8 +21,32 @@ DOCS_DIR = "."
 OUTPUT_DIR = "processed_data"
 IMAGES_DIR = os.path.join(OUTPUT_DIR, "images")
 TEXT_OUTPUT = os.path.join(OUTPUT_DIR, "text_content.json")
+TEXT_JSONL_OUTPUT = os.path.join(OUTPUT_DIR, "text_content.jsonl")
+IMAGE_MANIFEST = os.path.join(IMAGES_DIR, "manifest.json")
+EXTRACT_MANIFEST = os.path.join(OUTPUT_DIR, "extract_manifest.json")
+CAPTION_DIR = os.path.join(IMAGES_DIR, "caption")
+THUMBS_DIR = os.path.join(IMAGES_DIR, "thumbs")
+
+# Image derivatives (env overrides are inherited by worker processes)
+CAPTION_MAX_EDGE = int(os.getenv("CAPTION_MAX_EDGE", "1568"))  # longest edge sent to the vision model
+THUMB_MAX_EDGE = int(os.getenv("THUMB_MAX_EDGE", "480"))  # longest edge of UI thumbnails
+THUMB_FORMAT = os.getenv("THUMB_FORMAT", "WEBP").upper()  # WEBP or JPEG
+
+PIL_EXTENSIONS = {"PNG": ".png", "JPEG": ".jpg", "GIF": ".gif", "BMP": ".bmp", "TIFF": ".tif", "WEBP": ".webp"}
+# Formats the vision model accepts as-is; anything else is converted to PNG for captioning
+CAPTION_FORMATS = {"PNG", "JPEG", "WEBP"}
+
+BLIP = qn("a:blip")
+BLIP_EMBED = qn("r:embed")
+IMAGEDATA = "{urn:schemas-microsoft-com:vml}imagedata"  # legacy VML pictures
+VML_RID = qn("r:id")
+
+# Directories never searched when discovering .docx files
+SKIP_DIRS = {".git", "venv", ".venv", "__pycache__", "chroma_db", OUTPUT_DIR}
 
 os.makedirs(IMAGES_DIR, exist_ok=True)
+os.makedirs(CAPTION_DIR, exist_ok=True)
+os.makedirs(THUMBS_DIR, exist_ok=True)
 
 def iter_block_items(parent):
     """
@@ -36,56 +67,258 @@ def iter_block_items(parent):
         elif isinstance(child, CT_Tbl):
             yield Table(child, parent)
 
+def sniff_extension(blob, default):
+    """
+    Returns the file extension of the image's real format, or default if Pillow
+    can't identify it (e.g. WMF/EMF drawings).
+    """
+    try:
+        with Image.open(io.BytesIO(blob)) as img:
+            return PIL_EXTENSIONS.get(img.format, default)
+    except Exception:
+        return default
+
+def store_image(blob, ext=".png"):
+    """
+    Writes an image blob under its SHA-256 digest, once.
+    Identical screenshots (within or across documents) share a single file.
+    Returns (digest, filename).
+    """
+    digest = hashlib.sha256(blob).hexdigest()
+    ext = sniff_extension(blob, ext)
+    filename = f"{digest}{ext}"
+    filepath = os.path.join(IMAGES_DIR, filename)
+    if not os.path.exists(filepath):
+        # Write-then-rename so parallel workers never observe a half-written file
+        tmp_path = f"{filepath}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(blob)
+        os.replace(tmp_path, filepath)
+    return digest, filename
+
+def _save_resized(img, path, max_edge, fmt):
+    resized = img.copy()
+    resized.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    if fmt == "JPEG" and resized.mode not in ("RGB", "L"):
+        resized = resized.convert("RGB")
+    elif fmt in ("PNG", "WEBP") and resized.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+        resized = resized.convert("RGBA")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    resized.save(tmp_path, format=fmt, quality=85)
+    os.replace(tmp_path, path)
+
+def prepare_image_variants(filename):
+    """
+    Builds the derivatives of a stored image, once per content hash:
+    - a caption copy downscaled to CAPTION_MAX_EDGE (converted to PNG if the vision
+      model can't take the original format); the original is used when it already fits.
+    - a THUMB_MAX_EDGE thumbnail for the UI.
+    Returns (caption_path, thumb_path); thumb_path is None if Pillow can't decode the image.
+    """
+    src = os.path.join(IMAGES_DIR, filename)
+    digest = os.path.splitext(filename)[0]
+    thumb_format = "WEBP" if THUMB_FORMAT == "WEBP" and features.check("webp") else "JPEG"
+    thumb_path = os.path.join(THUMBS_DIR, digest + PIL_EXTENSIONS[thumb_format])
+    try:
+        img = Image.open(src)
+    except Exception:
+        return src, None
+    with img:
+        caption_path = src
+        if max(img.size) > CAPTION_MAX_EDGE or img.format not in CAPTION_FORMATS:
+            caption_format = "JPEG" if img.format == "JPEG" else "PNG"
+            caption_path = os.path.join(CAPTION_DIR, digest + PIL_EXTENSIONS[caption_format])
+            if not os.path.exists(caption_path):
+                _save_resized(img, caption_path, CAPTION_MAX_EDGE, caption_format)
+        if not os.path.exists(thumb_path):
+            _save_resized(img, thumb_path, THUMB_MAX_EDGE, thumb_format)
+    return caption_path, thumb_path
+
 def extract_images_from_doc(doc, doc_name):
     """
-    Extracts images from the document and saves them.
-    Returns a dictionary mapping image_hash/id to filename.
+    Extracts images from the document into the content-addressed image store.
+    Returns a dictionary mapping relationship ID (rId) to (image_hash, filename).
     """
     image_map = {}
     for i, rel in enumerate(doc.part.rels.values()):
-        if "image" in rel.target_ref:
+        if "image" in rel.reltype and not rel.is_external:
             try:
-                img_data = rel.target_part.blob
-                # Generate unique filename
-                filename = f"{doc_name}_img_{i}.png"
-                filepath = os.path.join(IMAGES_DIR, filename)
-                
-                with open(filepath, "wb") as f:
-                    f.write(img_data)
-                
-                # In a real rigorous extraction, we'd map the relationship ID (rId) to the position in text.
-                # structure. For now, we are bulk extracting context.
-                # To map securely, we need to inspect xml.
-                # For this efficiently-minded version, we'll store all images and let Gemini caption them.
-                image_map[rel.rId] = filename
+                part = rel.target_part
+                ext = os.path.splitext(part.partname)[1].lower() or ".png"
+                image_map[rel.rId] = store_image(part.blob, ext)
             except Exception as e:
                 print(f"Failed to extract image {i} from {doc_name}: {e}")
     return image_map
 
-def process_docx(file_path):
-    doc_name = os.path.splitext(os.path.basename(file_path))[0].replace(" ", "_")
+def load_image_manifest():
+    if os.path.exists(IMAGE_MANIFEST):
+        with open(IMAGE_MANIFEST, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"documents": {}, "images": {}, "anchors": {}}
+
+def save_image_manifest(manifest):
+    with open(IMAGE_MANIFEST, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+def record_images(chunks, manifest, emitted_hashes):
+    """
+    Records each image chunk's (doc, rId) -> hash mapping (and its position in the
+    document, when the engine emits one) in the manifest and drops image chunks whose
+    hash was already emitted by an earlier document, so every unique image is
+    captioned once. Returns the filtered chunk list.
+    """
+    kept = []
+    for chunk in chunks:
+        if chunk.get("type") != "image":
+            kept.append(chunk)
+            continue
+        digest = chunk["image_hash"]
+        doc_refs = manifest["documents"].setdefault(chunk["source"], {})
+        for rid in chunk.get("image_rids", []):
+            doc_refs[rid] = digest
+        manifest["images"][digest] = os.path.basename(chunk["image_path"])
+        if "after_chunk" in chunk:
+            manifest.setdefault("anchors", {}).setdefault(chunk["source"], {})[digest] = {
+                "after_chunk": chunk["after_chunk"],
+                "block_index": chunk.get("block_index")
+            }
+        if digest not in emitted_hashes:
+            emitted_hashes.add(digest)
+            kept.append(chunk)
+    return kept
+
+def heading_level(style_name):
+    """
+    Maps a Word paragraph style name to a heading level: 0 for Title, N for
+    "Heading N", None for body styles.
+    """
+    if not style_name:
+        return None
+    if style_name.lower() == "title":
+        return 0
+    match = re.match(r"heading\s*(\d)$", style_name, re.IGNORECASE)
+    return int(match.group(1)) if match else None
+
+def doc_name_for(file_path, root=None):
+    """
+    The document's name, used as its chunks' "source": its path relative to root
+    (the directory documents were discovered under) without the extension, so
+    same-named files in different folders stay apart; just the file name without root.
+    """
+    name = os.path.relpath(file_path, root) if root else os.path.basename(file_path)
+    return os.path.splitext(name)[0].replace(os.sep, "/").replace(" ", "_")
+
+def document_names(files, root=None):
+    """
+    Returns {file_path: document name}; raises ValueError if two files map to one name.
+    """
+    names, seen = {}, {}
+    for f in files:
+        name = doc_name_for(f, root)
+        if name in seen:
+            raise ValueError(f"{seen[name]} and {f} would both be named '{name}'; rename one of them")
+        names[f], seen[name] = name, f
+    return names
+
+def assign_chunk_ids(chunks):
+    """
+    Gives every chunk a stable "id" derived from its source, type and content
+    (plus an occurrence counter for repeated text), so IDs survive re-extraction
+    of an unchanged document and unrelated edits elsewhere in a changed one.
+    """
+    occurrences = {}
+    for chunk in chunks:
+        key = f"{chunk['source']}\x00{chunk['type']}\x00{chunk['content']}"
+        n = occurrences.get(key, 0)
+        occurrences[key] = n + 1
+        digest = hashlib.sha1(f"{key}\x00{n}".encode("utf-8")).hexdigest()[:16]
+        chunk["id"] = f"{chunk['source']}:{digest}"
+    return chunks
+
+def image_chunk(doc_name, digest, filename, rids):
+    caption_path, thumb_path = prepare_image_variants(filename)
+    return {
+        "source": doc_name,
+        "type": "image",
+        "content": f"Image File: {filename}",
+        "image_path": os.path.join(IMAGES_DIR, filename),
+        "caption_path": caption_path,
+        "thumb_path": thumb_path,
+        "image_hash": digest,
+        "image_rids": rids
+    }
+
+def rebuild_image_chunks(doc_name, image_manifest):
+    """
+    Rebuilds a document's image chunks from its (rId -> hash) refs in the image manifest,
+    for documents whose previous chunks are carried over instead of re-extracted.
+    """
+    by_hash = {}
+    for rid, digest in image_manifest["documents"].get(doc_name, {}).items():
+        by_hash.setdefault(digest, []).append(rid)
+    anchors = image_manifest.get("anchors", {}).get(doc_name, {})
+    return assign_chunk_ids([
+        dict(image_chunk(doc_name, digest, image_manifest["images"][digest], rids), **anchors.get(digest, {}))
+        for digest, rids in by_hash.items()
+    ])
+
+def embedded_rids(elem):
+    """
+    Relationship IDs of the pictures referenced inside a body element.
+    """
+    rids = [blip.get(BLIP_EMBED) for blip in elem.iter(BLIP)]
+    rids.extend(img.get(VML_RID) for img in elem.iter(IMAGEDATA))
+    return [rid for rid in rids if rid]
+
+def add_image_chunks(content, doc_name, image_map, first_seen):
+    """
+    Appends one chunk per unique image hash (every rId that embeds it is kept for the
+    manifest) and assigns chunk ids. first_seen maps rId -> (index into content of the
+    chunk preceding its first reference, body block index); image chunks gain
+    "after_chunk" (that chunk's id, or None) and "block_index" from it.
+    """
+    unique_images = {}
+    for rid, (digest, filename) in image_map.items():
+        unique_images.setdefault(digest, {"filename": filename, "rids": []})["rids"].append(rid)
+    image_chunks, anchors = [], []
+    for digest, img in unique_images.items():
+        image_chunks.append(image_chunk(doc_name, digest, img["filename"], img["rids"]))
+        positions = [first_seen[rid] for rid in img["rids"] if rid in first_seen]
+        anchors.append(min(positions) if positions else None)
+
+    content = assign_chunk_ids(content + image_chunks)
+    for chunk, anchor in zip(image_chunks, anchors):
+        chunk["after_chunk"] = content[anchor[0]]["id"] if anchor and anchor[0] >= 0 else None
+        chunk["block_index"] = anchor[1] if anchor else None
+    return content
+
+def process_docx(file_path, doc_name=None):
+    doc_name = doc_name or doc_name_for(file_path)
     doc = Document(file_path)
     
     # 1. Extract all images first to handle relationships
-    # Note: python-docx makes it hard to get exact image position without low-level XML parsing.
-    # To keep this "efficient" and simpler, we will extract all images as "Figures" for the document 
-    # and treat them as separate chunks that need captioning.
     print(f"Extracting images from {doc_name}...")
-    extract_images_from_doc(doc, doc_name)
+    image_map = extract_images_from_doc(doc, doc_name)
     
     # 2. Extract Text
     content = []
+    first_seen = {}  # rId -> where the image is first referenced, see add_image_chunks
+    body = doc.element.body
     print(f"Extracting text from {doc_name}...")
     
     for block in iter_block_items(doc):
         if isinstance(block, Paragraph):
             text = block.text.strip()
             if text:
-                content.append({
+                chunk = {
                     "source": doc_name,
                     "type": "text",
                     "content": text
-                })
+                }
+                level = heading_level(block.style.name if block.style is not None else None)
+                if level is not None:
+                    chunk["heading_level"] = level
+                content.append(chunk)
         elif isinstance(block, Table):
             # Convert table to string/markdown
             table_data = []
@@ -99,43 +332,256 @@ def process_docx(file_path):
                     "type": "table",
                     "content": table_text
                 })
+        rids = embedded_rids(block._element)
+        if rids:
+            block_index = body.index(block._element)
+            for rid in rids:
+                first_seen.setdefault(rid, (len(content) - 1, block_index))
     
     # Add image references to data (listing them as chunks to be processed)
-    # We re-scan the directory for images belonging to this doc
-    images = [f for f in os.listdir(IMAGES_DIR) if f.startswith(doc_name)]
-    for img in images:
-        content.append({
-            "source": doc_name,
-            "type": "image",
-            "content": f"Image File: {img}",
-            "image_path": os.path.join(IMAGES_DIR, img)
-        })
-        
-    return content
+    return add_image_chunks(content, doc_name, image_map, first_seen)
 
-def main():
-    files = [
-        "UZIO Overview (Master).docx",
-        "UZIO Scheduling.docx",
-        "UZIO Time Tracking.docx"
-    ]
-    
-    all_data = []
-    
+def discover_docx(root):
+    """
+    Recursively finds every .docx under root, skipping Word lock files (~$...).
+    """
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+        for name in filenames:
+            if name.lower().endswith(".docx") and not name.startswith("~$"):
+                found.append(os.path.join(dirpath, name))
+    return sorted(found)
+
+def _process_docx_safe(file_path, engine="python-docx", doc_name=None):
+    # Runs in a worker process; errors are returned so one bad file doesn't kill the pool.
+    try:
+        with span("extraction", file=os.path.basename(file_path), engine=engine) as attrs:
+            if engine == "lxml":
+                # Imported lazily: docx_fast builds on helpers from this module
+                from docx_fast import process_docx_fast
+                chunks = process_docx_fast(file_path, doc_name)
+            else:
+                chunks = process_docx(file_path, doc_name)
+            attrs["chunks"] = len(chunks)
+        return file_path, chunks, None
+    except Exception as e:
+        return file_path, [], str(e)
+
+def iter_extracted(files, workers=None, engine="python-docx", names=None):
+    """
+    Yields (file_path, chunks, error) per document as each one finishes.
+    Documents are extracted in a process pool unless only one worker is allowed.
+    names maps file paths to document names (see document_names).
+    """
+    names = names or {}
+    if workers == 1 or len(files) <= 1:
+        for f in files:
+            yield _process_docx_safe(f, engine, names.get(f))
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_process_docx_safe, f, engine, names.get(f)) for f in files]
+        for future in as_completed(futures):
+            yield future.result()
+
+def _sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def file_fingerprint(path, previous=None):
+    """
+    Returns the size, mtime and SHA-256 of a source document.
+    The hash is only recomputed when size or mtime differ from the previous entry.
+    """
+    st = os.stat(path)
+    if previous and previous.get("size") == st.st_size and previous.get("mtime") == st.st_mtime:
+        return {"size": st.st_size, "mtime": st.st_mtime, "sha256": previous["sha256"]}
+    return {"size": st.st_size, "mtime": st.st_mtime, "sha256": _sha256_file(path)}
+
+def load_extract_manifest():
+    if os.path.exists(EXTRACT_MANIFEST):
+        with open(EXTRACT_MANIFEST, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"output": None, "documents": {}}
+
+def save_extract_manifest(manifest):
+    with open(EXTRACT_MANIFEST, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+def iter_output_chunks(path):
+    """
+    Streams chunks from a previous extractor output (JSON array or JSONL).
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from json.load(f)
+
+def plan_extraction(files, manifest, output_path, force=False):
+    """
+    Splits files into (changed, unchanged) by comparing fingerprints with the manifest.
+    Everything counts as changed when forced, or when the manifest was written for
+    a different output file, or the output itself has gone missing.
+    """
+    if manifest.get("output") != output_path or not os.path.exists(output_path):
+        force = True
+    changed, unchanged, fingerprints = [], [], {}
     for f in files:
-        if os.path.exists(f):
-            data = process_docx(f)
-            all_data.extend(data)
+        previous = manifest["documents"].get(f)
+        fingerprints[f] = file_fingerprint(f, previous)
+        if force or not previous or previous["sha256"] != fingerprints[f]["sha256"]:
+            changed.append(f)
         else:
-            print(f"File not found: {f}")
-            
-    # Save to JSON
-    import json
-    with open(TEXT_OUTPUT, "w") as f:
-        json.dump(all_data, f, indent=2)
-    
-    print(f"Extraction complete. Data saved to {TEXT_OUTPUT}")
-    print(f"Total chunks: {len(all_data)}")
+            unchanged.append(f)
+    return changed, unchanged, fingerprints
+
+def run_extraction(files, output_path, workers=None, force=False, engine="python-docx", root=None):
+    """
+    Incrementally extracts files into output_path (.json or .jsonl).
+    Unchanged documents keep their previous chunks; only new or edited documents
+    are re-parsed, and documents no longer in the file list are dropped.
+    Chunks are streamed through a temporary JSONL file so memory stays flat.
+    Documents are named by their path relative to root (see doc_name_for).
+    """
+    names = document_names(files, root)
+    manifest = load_extract_manifest()
+    image_manifest = load_image_manifest()
+    changed, unchanged, fingerprints = plan_extraction(files, manifest, output_path, force)
+    # A document whose name changed (e.g. now qualified by its folder) has no chunks to carry over
+    renamed = [f for f in unchanged if manifest["documents"][f].get("doc_name") != names[f]]
+    changed, unchanged = changed + renamed, [f for f in unchanged if f not in renamed]
+    print(f"{len(changed)} documents to extract, {len(unchanged)} unchanged")
+
+    # A document that fails to extract falls back to its chunks from the previous run
+    previous_docs = manifest["documents"] if manifest.get("output") == output_path and os.path.exists(output_path) else {}
+    previous_refs = dict(image_manifest["documents"])
+    previous_anchors = dict(image_manifest.setdefault("anchors", {}))
+    keep_names = {names[f] for f in unchanged}
+    # Image chunks are rebuilt from the image manifest, so forget stale refs for everything else
+    for refs in (image_manifest["documents"], image_manifest["anchors"]):
+        for doc_name in list(refs):
+            if doc_name not in keep_names:
+                del refs[doc_name]
+
+    emitted_hashes = set()
+    chunk_ids = {f: [] for f in files}
+    total_chunks = 0
+    failed = []
+    tmp_path = f"{output_path}.tmp.jsonl"
+
+    with open(tmp_path, "w", encoding="utf-8") as out:
+        def write(chunks, file_path):
+            nonlocal total_chunks
+            for chunk in chunks:
+                out.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+                chunk_ids[file_path].append(chunk["id"])
+            out.flush()
+            total_chunks += len(chunks)
+
+        def carry_over(docs):
+            # Text/table chunks stream from the previous output; each document's image
+            # chunks follow its own text, so every document stays contiguous for chunker.py
+            pending = dict(docs)
+            def write_images(doc_name):
+                write(record_images(rebuild_image_chunks(doc_name, image_manifest), image_manifest, emitted_hashes),
+                      pending.pop(doc_name))
+            previous = None
+            for chunk in iter_output_chunks(output_path):
+                source = chunk.get("source")
+                if source != previous and previous in pending:
+                    write_images(previous)
+                previous = source
+                if source in pending and chunk.get("type") != "image":
+                    write([chunk], pending[source])
+            for doc_name in list(pending):
+                write_images(doc_name)
+
+        # 1. Carry over the chunks of unchanged documents
+        carry_over({names[f]: f for f in unchanged})
+
+        # 2. Extract new and changed documents
+        for done, (file_path, chunks, error) in enumerate(iter_extracted(changed, workers, engine, names), start=1):
+            if error:
+                print(f"Failed to extract {file_path}: {error}")
+                failed.append(file_path)
+                continue
+            write(record_images(chunks, image_manifest, emitted_hashes), file_path)
+            print(f"[{done}/{len(changed)}] {file_path}: {len(chunks)} chunks")
+
+        # 3. Keep the previous chunks of documents that failed (e.g. locked while open in Word)
+        fallback = {names[f]: f for f in failed if previous_docs.get(f, {}).get("doc_name") == names[f]}
+        for doc_name in fallback:
+            image_manifest["documents"][doc_name] = dict(previous_refs.get(doc_name, {}))
+            if doc_name in previous_anchors:
+                image_manifest["anchors"][doc_name] = dict(previous_anchors[doc_name])
+        if fallback:
+            carry_over(fallback)
+            for f in fallback.values():
+                print(f"Kept the previous {len(chunk_ids[f])} chunks of {f}")
+
+    if output_path.endswith(".jsonl"):
+        os.replace(tmp_path, output_path)
+    else:
+        with open(output_path, "w") as f:
+            json.dump(list(iter_output_chunks(tmp_path)), f, indent=2)
+        os.remove(tmp_path)
+
+    manifest = {"output": output_path, "documents": {}}
+    for f in files:
+        if f in failed:
+            if names[f] in fallback:
+                # The previous fingerprint stays, so the next run retries the document
+                manifest["documents"][f] = dict(previous_docs[f], chunk_ids=chunk_ids[f])
+            continue
+        manifest["documents"][f] = dict(fingerprints[f], doc_name=names[f], chunk_ids=chunk_ids[f])
+    save_extract_manifest(manifest)
+    save_image_manifest(image_manifest)
+
+    print(f"Extraction complete. Data saved to {output_path}")
+    print(f"Total chunks: {total_chunks} from {len(manifest['documents'])} documents")
+    if failed:
+        print(f"{len(failed)} documents failed, {len(fallback)} of them kept their previous chunks")
+    return total_chunks
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract text, tables and images from UZIO .docx files.")
+    parser.add_argument("--input-dir", help="Discover every .docx under this directory instead of the default UZIO manuals.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count, 1 = sequential).")
+    parser.add_argument("--output", default=None, help=f"Output path, .json or .jsonl (default: {TEXT_OUTPUT}, or {TEXT_JSONL_OUTPUT} with --input-dir).")
+    parser.add_argument("--full", action="store_true", help="Ignore the fingerprint manifest and re-extract every document.")
+    parser.add_argument("--engine", choices=["python-docx", "lxml"], default="python-docx",
+                        help="Extraction engine; lxml streams document.xml directly (see docx_fast.py).")
+    args = parser.parse_args()
+
+    if args.input_dir:
+        files = discover_docx(args.input_dir)
+        if not files:
+            print(f"No .docx files found under {args.input_dir}")
+            return
+        print(f"Found {len(files)} documents under {args.input_dir}")
+        output_path = args.output or TEXT_JSONL_OUTPUT
+    else:
+        files = []
+        for f in [
+            "UZIO Overview (Master).docx",
+            "UZIO Scheduling.docx",
+            "UZIO Time Tracking.docx"
+        ]:
+            if os.path.exists(f):
+                files.append(f)
+            else:
+                print(f"File not found: {f}")
+        output_path = args.output or TEXT_OUTPUT
+
+    run_extraction(files, output_path, workers=args.workers, force=args.full, engine=args.engine, root=args.input_dir)
 
 if __name__ == "__main__":
     main()
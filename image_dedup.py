@@ -0,0 +1,60 @@
+from PIL import Image
+
+# Configuration
+PHASH_THRESHOLD = 6  # max differing bits (of 64) for two screenshots to count as near-duplicates
+
+def dhash(path, size=8):
+    """
+    64-bit difference hash: the image is shrunk to (size+1) x size grayscale and each
+    bit records whether a pixel is brighter than its right neighbour. Robust to
+    rescaling and compression, sensitive to layout changes.
+    Returns None if the image can't be decoded.
+    """
+    try:
+        with Image.open(path) as img:
+            pixels = list(img.convert("L").resize((size + 1, size), Image.LANCZOS).getdata())
+    except Exception:
+        return None
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+class NearDuplicateIndex:
+    """
+    Finds a previously added hash within `threshold` bits of a query.
+    The 64 bits are split into threshold+1 bands: by the pigeonhole principle two
+    hashes within the threshold agree exactly on at least one band, so only the
+    entries sharing a band are compared instead of the whole index.
+    """
+    def __init__(self, threshold=PHASH_THRESHOLD, bits=64):
+        self.threshold = threshold
+        self.bands = max(1, min(threshold + 1, bits))
+        self.band_width = -(-bits // self.bands)
+        self.buckets = [{} for _ in range(self.bands)]
+
+    def _band_values(self, value):
+        mask = (1 << self.band_width) - 1
+        return [(value >> (i * self.band_width)) & mask for i in range(self.bands)]
+
+    def add(self, key, value):
+        for bucket, band in zip(self.buckets, self._band_values(value)):
+            bucket.setdefault(band, []).append((key, value))
+
+    def find(self, value):
+        """
+        Returns (key, distance) of the closest indexed hash within the threshold, or None.
+        """
+        best = None
+        for bucket, band in zip(self.buckets, self._band_values(value)):
+            for key, other in bucket.get(band, ()):
+                distance = hamming(value, other)
+                if distance <= self.threshold and (best is None or distance < best[1]):
+                    best = (key, distance)
+        return best
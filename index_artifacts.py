@@ -0,0 +1,256 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import secrets
+import subprocess
+import providers
+
+# Versioned index artifacts: every build writes a fresh directory under ARTIFACTS_DIR
+# with a manifest.json, then a one-line CURRENT pointer is swapped atomically to it.
+# Readers resolve CURRENT once and keep their version; the previous versions stay on
+# disk (up to KEEP_VERSIONS) so sessions still using them are never pulled out from under.
+
+# Configuration
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ARTIFACTS_DIR = os.path.join(BASE_DIR, providers.collection_name("indexes"))
+INDEXER_SCRIPT = os.path.join(BASE_DIR, "indexer.py")
+KEEP_VERSIONS = 3
+STALE_LOCK_SECONDS = 6 * 3600  # a build lock older than this is assumed abandoned
+QUEUED_TIMEOUT = 120  # seconds a background build may take to start before it counts as failed
+LOCK_TOKEN_ENV = "INDEX_BUILD_LOCK_TOKEN"  # hands the parent's build lock to the indexer.py it starts
+ARTIFACT_FORMAT = 1
+
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+STATUS_FILE = "build_status.json"
+LOCK_FILE = ".build.lock"
+BUILD_LOG = "build.log"
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def current_version(root=ARTIFACTS_DIR):
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+            version = f.read().strip()
+    except OSError:
+        return None
+    return version if version and os.path.isdir(os.path.join(root, version)) else None
+
+def read_manifest(index_dir):
+    return _read_json(os.path.join(index_dir, MANIFEST_FILE))
+
+def current_index(root=ARTIFACTS_DIR, backend=None):
+    """
+    Returns (index_dir, manifest) of the published version, or of an unversioned
+    index built in place before versioning existed; (None, None) when nothing is ready.
+    """
+    version = current_version(root)
+    if version:
+        index_dir = os.path.join(root, version)
+        manifest = read_manifest(index_dir)
+        if manifest:
+            return index_dir, manifest
+    from indexer import VECTOR_BACKEND, default_index_dir
+    from local_store import MmapVectorStore
+    backend = backend or VECTOR_BACKEND
+    legacy_dir = default_index_dir(backend)
+    if backend == "mmap":
+        ready = MmapVectorStore.exists(legacy_dir)
+    else:
+        ready = os.path.exists(os.path.join(legacy_dir, "chroma.sqlite3"))
+    if ready:
+        return legacy_dir, {"version": None, "backend": backend, "legacy": True}
+    return None, None
+
+def list_versions(root=ARTIFACTS_DIR):
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root)
+                  if name.startswith("v") and os.path.isfile(os.path.join(root, name, MANIFEST_FILE)))
+
+def publish(version, root=ARTIFACTS_DIR, keep=KEEP_VERSIONS):
+    """
+    Atomically points CURRENT at version, then prunes the oldest versions.
+    """
+    tmp_path = os.path.join(root, f"{CURRENT_FILE}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+    os.replace(tmp_path, os.path.join(root, CURRENT_FILE))
+    for old in [v for v in list_versions(root) if v != version][:-max(keep - 1, 0) or None]:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+
+# Build lock and status
+
+_children = {}  # pid -> Popen of background builds started by this process
+
+def _pid_alive(pid):
+    child = _children.get(pid)
+    if child is not None:
+        return child.poll() is None  # also reaps it, so a dead build never lingers as a zombie
+    if os.name == "nt":
+        return True  # no cheap check; rely on the lock's age
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def build_in_progress(root=ARTIFACTS_DIR):
+    lock = _read_json(os.path.join(root, LOCK_FILE))
+    if not lock:
+        return False
+    return time.time() - lock.get("started", 0) < STALE_LOCK_SECONDS and _pid_alive(lock.get("pid", 0))
+
+def acquire_lock(root=ARTIFACTS_DIR, token=None):
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, LOCK_FILE)
+    if os.path.exists(path) and not build_in_progress(root):
+        os.remove(path)  # abandoned by a crashed build
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump({"pid": os.getpid(), "started": time.time(), "token": token}, f)
+    return True
+
+def owns_lock(root=ARTIFACTS_DIR):
+    """
+    True if this process was started by start_background_build holding the lock for it.
+    """
+    token = os.environ.get(LOCK_TOKEN_ENV)
+    lock = _read_json(os.path.join(root, LOCK_FILE))
+    return bool(token and lock and lock.get("token") == token)
+
+def release_lock(root=ARTIFACTS_DIR):
+    try:
+        os.remove(os.path.join(root, LOCK_FILE))
+    except FileNotFoundError:
+        pass
+
+def write_status(root=ARTIFACTS_DIR, **fields):
+    os.makedirs(root, exist_ok=True)
+    _write_json_atomic(os.path.join(root, STATUS_FILE), dict(fields, updated=time.time()))
+
+def index_status(root=ARTIFACTS_DIR):
+    """
+    Readiness signal for the UI: {"ready", "version", "building", "state", ...}.
+    """
+    index_dir, manifest = current_index(root)
+    status = _read_json(os.path.join(root, STATUS_FILE)) or {}
+    building = build_in_progress(root)
+    if (status.get("state") == "queued" and not building
+            and time.time() - status.get("started", 0) > QUEUED_TIMEOUT):
+        status = dict(status, state="failed",
+                      error=f"the build process exited before it started (see {os.path.join(root, BUILD_LOG)})")
+    return dict(status,
+                ready=index_dir is not None,
+                version=(manifest or {}).get("version"),
+                index_dir=index_dir,
+                building=building)
+
+# Building
+
+def build_version(input_file, root=ARTIFACTS_DIR, backend=None, full=False, **build_kwargs):
+    """
+    Builds a new version directory and publishes it. Unless full=True, the current
+    version is copied forward first so only changed chunks are embedded.
+    Returns the published version name, or None if another build holds the lock or the build failed.
+    """
+    from indexer import VECTOR_BACKEND, build_index
+    backend = backend or VECTOR_BACKEND
+    if not owns_lock(root) and not acquire_lock(root):
+        print(f"Another index build is already running in {root}.")
+        return None
+    version = time.strftime("v%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+    index_dir = os.path.join(root, version)
+    write_status(root, state="building", version=version, started=time.time())
+    try:
+        previous_dir, previous = current_index(root, backend)
+        if (not full and previous and previous.get("backend") == backend
+                and previous.get("embed_model", providers.EMBED_MODEL) == build_kwargs.get("embed_model", providers.EMBED_MODEL)):
+            print(f"Copying {previous.get('version') or previous_dir} forward for an incremental build...")
+            shutil.copytree(previous_dir, index_dir, ignore=shutil.ignore_patterns(MANIFEST_FILE))
+        summary = build_index(input_file, index_dir, full=False, backend=backend, **build_kwargs)
+        if summary is None:
+            raise RuntimeError(f"No input at {input_file}")
+        manifest = {
+            "format": ARTIFACT_FORMAT,
+            "version": version,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "backend": backend,
+            "provider": providers.PROVIDER,
+            "embed_model": build_kwargs.get("embed_model", providers.EMBED_MODEL),
+            "input": os.path.relpath(input_file, BASE_DIR),
+            "input_sha256": _sha256_file(input_file),
+            "params": {key: value for key, value in build_kwargs.items() if isinstance(value, (int, float, str, dict))},
+            "previous": previous.get("version") if previous else None,
+            **summary
+        }
+        _write_json_atomic(os.path.join(index_dir, MANIFEST_FILE), manifest)
+        publish(version, root)
+        write_status(root, state="ready", version=version, finished=time.time())
+        print(f"Published index version {version}")
+        return version
+    except Exception as e:
+        shutil.rmtree(index_dir, ignore_errors=True)
+        write_status(root, state="failed", version=version, error=str(e), finished=time.time())
+        print(f"Index build failed: {e}")
+        return None
+    finally:
+        release_lock(root)
+
+def start_background_build(root=ARTIFACTS_DIR, extra_args=()):
+    """
+    Starts indexer.py in a detached process unless a build is already running.
+    The lock is taken here, before the process starts, and handed to it, so reruns
+    and concurrent sessions can't start a second build while it is still importing.
+    Returns True if a build was started.
+    """
+    token = secrets.token_hex(8)
+    if not acquire_lock(root, token):
+        return False
+    started = time.time()
+    write_status(root, state="queued", started=started)
+    kwargs = {"stderr": subprocess.STDOUT, "stdin": subprocess.DEVNULL, "cwd": BASE_DIR,
+              "env": dict(os.environ, **{LOCK_TOKEN_ENV: token})}
+    if os.name == "nt":
+        kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    try:
+        with open(os.path.join(root, BUILD_LOG), "ab") as log:
+            child = subprocess.Popen([sys.executable, INDEXER_SCRIPT, *extra_args], stdout=log, **kwargs)
+    except OSError as e:
+        release_lock(root)
+        write_status(root, state="failed", error=str(e), finished=time.time())
+        return False
+    _children[child.pid] = child
+    # The lock now names the build process, so it counts as released as soon as that dies
+    lock_path = os.path.join(root, LOCK_FILE)
+    if (_read_json(lock_path) or {}).get("token") == token:
+        _write_json_atomic(lock_path, {"pid": child.pid, "started": started, "token": token})
+    return True
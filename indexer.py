@@ -1,78 +1,237 @@
 import os
+import sys
 import json
-from llama_index.core import Document, VectorStoreIndex, StorageContext, Settings
-from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
+import time
+import hashlib
+import argparse
+from llama_index.core import Document, VectorStoreIndex, Settings
+from llama_index.core.node_parser import SentenceSplitter
 from llama_index.vector_stores.chroma import ChromaVectorStore
-from llama_index.llms.google_genai import GoogleGenAI
 import chromadb
-from dotenv import load_dotenv
-
-load_dotenv()
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+import providers
+from chunker import iter_items
+from embedding_cache import EMBED_BATCH_SIZE, EMBED_PARALLEL, EmbeddingCache
+from local_store import IVF_LISTS, STORE_DTYPE, MmapVectorStore
+from lexical import LEXICAL_FILE, BM25Writer
+from index_artifacts import build_version
 
 # Configuration
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 PROCESSED_DATA_DIR = os.path.join(BASE_DIR, "processed_data")
 ENRICHED_DATA_FILE = os.path.join(PROCESSED_DATA_DIR, "enriched_content.json")
 CHROMA_DB_DIR = os.path.join(BASE_DIR, "chroma_db")
-COLLECTION_NAME = "uzio_docs"
+DRY_RUN_CHROMA_DIR = os.path.join(BASE_DIR, "chroma_db_dry_run")
+COLLECTION_NAME = providers.collection_name("uzio_docs")
+# "chroma" (default) or "mmap" for the memory-mapped local store in local_store.py
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+LOCAL_STORE_DIR = os.path.join(BASE_DIR, providers.collection_name("vector_store"))
+DRY_RUN_STORE_DIR = os.path.join(BASE_DIR, "vector_store_dry_run")
+ID_PAGE_SIZE = 5000  # ids fetched per request when diffing against the collection
+CHUNK_SIZE = 1024  # SentenceSplitter defaults: tokens per node and overlap between nodes
+CHUNK_OVERLAP = 200
+INGEST_BATCH_SIZE = 256  # documents split, diffed and embedded together; bounds peak memory
 
-def build_index():
-    if not os.path.exists(ENRICHED_DATA_FILE):
-        print("Enriched data not found. Run processor.py first.")
-        return
+def document_id(text, metadata):
+    """
+    Content-addressed document ID: the same text and metadata always map to the same
+    ID, so an unchanged chunk is recognised in the collection and never re-embedded.
+    """
+    payload = json.dumps({"text": text, "metadata": metadata}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
 
-    # 1. Setup Models
-    # Using text-embedding-004 for cost/performance if available, else 001
-    Settings.embed_model = GoogleGenAIEmbedding(model_name="models/text-embedding-004", api_key=GOOGLE_API_KEY)
-    Settings.llm = GoogleGenAI(model="models/gemini-flash-latest", api_key=GOOGLE_API_KEY)
+def node_id(i, doc):
+    # Deterministic replacement for the splitter's random node UUIDs
+    return f"{doc.id_}:{i}"
+
+class ChromaIds:
+    """
+    Id-level view of a Chroma collection, with the same diff helpers as MmapVectorStore.
+    """
+    def __init__(self, collection):
+        self.collection = collection
+
+    def stored_ids(self, ids):
+        return set(self.collection.get(ids=list(ids), include=[])["ids"]) if ids else set()
+
+    def iter_ids(self, page_size=ID_PAGE_SIZE):
+        offset = 0
+        while True:
+            page = self.collection.get(include=[], limit=page_size, offset=offset)["ids"]
+            if page:
+                yield page
+            if len(page) < page_size:
+                return
+            offset += len(page)
 
-    # 2. Prepare Documents
-    with open(ENRICHED_DATA_FILE, "r") as f:
-        data = json.load(f)
+    def delete_nodes(self, ids):
+        for i in range(0, len(ids), ID_PAGE_SIZE):
+            self.collection.delete(ids=ids[i:i + ID_PAGE_SIZE])
+
+def default_index_dir(backend):
+    return LOCAL_STORE_DIR if backend == "mmap" else CHROMA_DB_DIR
+
+def open_vector_store(backend=VECTOR_BACKEND, index_dir=None, full=False, dtype=STORE_DTYPE, ivf_lists=IVF_LISTS, hnsw=None):
+    """
+    Returns (vector_store, id view) for the configured backend. full=True empties it first.
+    hnsw holds Chroma collection settings (e.g. {"hnsw:M": 16}), applied when the collection is created.
+    """
+    index_dir = index_dir or default_index_dir(backend)
+    if backend == "mmap":
+        vector_store = MmapVectorStore(index_dir, dtype=dtype, ivf_lists=ivf_lists)
+        if full:
+            vector_store.clear()
+        return vector_store, vector_store
+    db = chromadb.PersistentClient(path=index_dir)
+    if full and COLLECTION_NAME in [c if isinstance(c, str) else c.name for c in db.list_collections()]:
+        db.delete_collection(COLLECTION_NAME)
+    chroma_collection = db.get_or_create_collection(COLLECTION_NAME, metadata=hnsw or None)
+    return ChromaVectorStore(chroma_collection=chroma_collection), ChromaIds(chroma_collection)
+
+def item_to_document(item):
+    # Compatibility mapping for manual vs auto-generated data
+    text_content = item.get("content", "")
+    source = item.get("source", item.get("file_name", "Unknown File"))
+    doc_type = item.get("type", item.get("section_title", "Section"))
     
-    documents = []
-    print(f"Loading {len(data)} items...")
+    # Add metadata
+    metadata = {
+        "source": source,
+        "type": doc_type,
+    }
+    if "image_path" in item:
+        metadata["image_path"] = item["image_path"]
+    if item.get("thumb_path"):
+        metadata["thumb_path"] = item["thumb_path"]
+    if item.get("section"):
+        metadata["section"] = item["section"]
     
-    for item in data:
-        # Compatibility mapping for manual vs auto-generated data
-        text_content = item.get("content", "")
-        source = item.get("source", item.get("file_name", "Unknown File"))
-        doc_type = item.get("type", item.get("section_title", "Section"))
+    if "generated_questions" in item:
+        questions = item["generated_questions"]
+        # Handle list format from external prompt
+        if isinstance(questions, list):
+            questions = "\n".join(questions)
         
-        # Add metadata
-        metadata = {
-            "source": source,
-            "type": doc_type,
-        }
-        if "image_path" in item:
-            metadata["image_path"] = item["image_path"]
-        
-        if "generated_questions" in item:
-            questions = item["generated_questions"]
-            # Handle list format from external prompt
-            if isinstance(questions, list):
-                questions = "\n".join(questions)
-            
-            text_content += "\n\nRelated Questions:\n" + str(questions)
-        
-        doc = Document(text=text_content, metadata=metadata)
-        documents.append(doc)
-
-    # 3. Initialize ChromaDB
-    print("Initializing Vector Store...")
-    db = chromadb.PersistentClient(path=CHROMA_DB_DIR)
-    chroma_collection = db.get_or_create_collection(COLLECTION_NAME)
-    vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
-
-    # 4. Create Index (Processing & Embedding)
-    print("Building Index (this may take a moment)...")
-    index = VectorStoreIndex.from_documents(
-        documents, storage_context=storage_context
-    )
+        text_content += "\n\nRelated Questions:\n" + str(questions)
     
-    print(f"Index created successfully at {CHROMA_DB_DIR}")
+    return Document(text=text_content, metadata=metadata, id_=document_id(text_content, metadata))
+
+def iter_documents(path):
+    """
+    Lazily builds Documents from the enriched chunks (JSON array or JSONL),
+    without loading the whole file.
+    """
+    for item in iter_items(path):
+        yield item_to_document(item)
+
+def iter_batches(iterable, size):
+    batch = []
+    for entry in iterable:
+        batch.append(entry)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def build_index(input_file=ENRICHED_DATA_FILE, index_dir=None, full=False,
+                embed_cache=True, batch_size=EMBED_BATCH_SIZE, parallel=EMBED_PARALLEL,
+                ingest_batch_size=INGEST_BATCH_SIZE, backend=VECTOR_BACKEND,
+                dtype=STORE_DTYPE, ivf_lists=IVF_LISTS, hnsw=None, chunk_size=CHUNK_SIZE,
+                chunk_overlap=CHUNK_OVERLAP, embed_model=providers.EMBED_MODEL):
+    """
+    Brings the vector store (Chroma or the local mmap store) in line with the enriched chunks: only nodes whose
+    content or metadata changed are embedded and upserted, and nodes that no longer
+    exist are deleted. full=True drops the collection and re-embeds everything;
+    vectors come from the embedding cache where possible, so that costs no API calls.
+    Input is streamed in batches of ingest_batch_size documents. Across the whole run
+    only the set of node ids seen so far is kept in memory; the lexical index spills
+    each node's term counts to disk and assembles its postings once at the end.
+    Returns a summary of the run (None if there is no input).
+    """
+    if not os.path.exists(input_file):
+        print("Enriched data not found. Run processor.py first.")
+        return
+
+    # 1. Setup Models (MODEL_PROVIDER selects Gemini or the local stand-ins)
+    # Using text-embedding-004 for cost/performance if available, else 001
+    vectors = EmbeddingCache(enabled=embed_cache)
+    Settings.embed_model = providers.get_embed_model(embed_model, cache=vectors, batch_size=batch_size, parallel=parallel)
+    Settings.llm = providers.get_llm()
+
+    # 2. Initialize the Vector Store
+    index_dir = index_dir or default_index_dir(backend)
+    print(f"Initializing Vector Store ({backend})...")
+    vector_store, stored = open_vector_store(backend, index_dir, full, dtype, ivf_lists, hnsw)
+    index = VectorStoreIndex.from_vector_store(vector_store)
+
+    # 3. Stream documents through split -> diff -> embed/upsert, one batch at a time
+    print(f"Streaming items from {input_file} in batches of {ingest_batch_size}...")
+    splitter = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, id_func=node_id)
+    seen = set()
+    bm25 = BM25Writer(os.path.join(index_dir, LEXICAL_FILE))  # rebuilt every run from the current nodes
+    items = total_nodes = embedded = 0
+    start = time.monotonic()
+    for documents in iter_batches(iter_documents(input_file), ingest_batch_size):
+        items += len(documents)
+        nodes = []
+        for node in splitter.get_nodes_from_documents(documents):
+            if node.node_id not in seen:  # identical chunks collapse to a single node
+                seen.add(node.node_id)
+                nodes.append(node)
+                bm25.add(node.node_id, node.get_content())
+        total_nodes += len(nodes)
+        unchanged = stored.stored_ids([node.node_id for node in nodes])
+        new_nodes = [node for node in nodes if node.node_id not in unchanged]
+        if new_nodes:
+            index.insert_nodes(new_nodes)
+            embedded += len(new_nodes)
+        elapsed = time.monotonic() - start
+        print(f"  {items} items, {total_nodes} nodes, {embedded} embedded ({items / elapsed if elapsed else 0:.1f} items/s)")
+
+    # 4. Remove nodes that are no longer produced
+    stale_ids = [stored_id for page in stored.iter_ids() for stored_id in page if stored_id not in seen]
+    stored.delete_nodes(stale_ids)
+    if backend == "mmap":
+        vector_store.persist()
+    bm25.close()
+    elapsed = time.monotonic() - start
+    
+    print(f"Index updated successfully at {index_dir}")
+    print(f"{total_nodes} nodes: {embedded} embedded, {total_nodes - embedded} unchanged, {len(stale_ids)} deleted")
+    print(f"Throughput: {items} items in {elapsed:.1f}s ({items / elapsed if elapsed else 0:.1f} items/s)")
+    stats = vectors.stats()
+    print(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), {stats['entries']} vectors stored")
+    vectors.close()
+    return {"items": items, "nodes": total_nodes, "embedded": embedded, "deleted": len(stale_ids), "seconds": elapsed}
 
 if __name__ == "__main__":
-    build_index()
+    parser = argparse.ArgumentParser(description="Embed enriched chunks into the vector index.")
+    parser.add_argument("--input", default=ENRICHED_DATA_FILE, help="Enriched chunks from processor.py (.json or .jsonl).")
+    parser.add_argument("--full", action="store_true", help="Drop the collection and re-embed every chunk.")
+    parser.add_argument("--backend", choices=["chroma", "mmap"], default=VECTOR_BACKEND,
+                        help="Vector store: Chroma, or the memory-mapped local store.")
+    parser.add_argument("--dtype", choices=["float16", "int8"], default=STORE_DTYPE, help="mmap backend: stored vector precision.")
+    parser.add_argument("--ivf-lists", type=int, default=IVF_LISTS, help="mmap backend: IVF partitions (0 = exact search).")
+    parser.add_argument("--embed-batch-size", type=int, default=EMBED_BATCH_SIZE, help="Texts per embedding API call.")
+    parser.add_argument("--embed-parallel", type=int, default=EMBED_PARALLEL, help="Embedding batches in flight at once.")
+    parser.add_argument("--ingest-batch-size", type=int, default=INGEST_BATCH_SIZE, help="Documents split, diffed and embedded per batch.")
+    parser.add_argument("--no-embed-cache", action="store_true", help="Bypass the on-disk embedding cache.")
+    parser.add_argument("--index-dir", help="Update this index directory in place instead of publishing a new version.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Throughput run against the local stand-ins (MODEL_PROVIDER=local), into a scratch index.")
+    args = parser.parse_args()
+    if args.dry_run and not providers.is_local():
+        parser.error("--dry-run needs MODEL_PROVIDER=local so it never calls the paid API")
+    build_kwargs = dict(
+        # Dry runs measure real embedding throughput, so they skip the cache
+        embed_cache=not (args.no_embed_cache or args.dry_run),
+        batch_size=args.embed_batch_size, parallel=args.embed_parallel,
+        ingest_batch_size=args.ingest_batch_size, dtype=args.dtype, ivf_lists=args.ivf_lists
+    )
+    if args.dry_run or args.index_dir:
+        dry_run_dir = DRY_RUN_STORE_DIR if args.backend == "mmap" else DRY_RUN_CHROMA_DIR
+        build_index(args.input, args.index_dir or dry_run_dir, args.full, backend=args.backend, **build_kwargs)
+    else:
+        # Build a new versioned artifact and switch the app to it atomically
+        version = build_version(args.input, backend=args.backend, full=args.full, **build_kwargs)
+        sys.exit(0 if version else 1)
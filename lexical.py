@@ -0,0 +1,193 @@
+import os
+import re
+import json
+import math
+import dataclasses
+from collections import Counter
+
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+from telemetry import span
+
+# Configuration
+LEXICAL_FILE = "lexical_index.json"  # written next to the vector index by indexer.py
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60  # reciprocal rank fusion constant
+# vector: embedding search only; hybrid: fuse BM25 and vector results;
+# lexical-first: answer from BM25 alone when it is confident, otherwise hybrid
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+LEXICAL_MAX_TERMS = 6  # only short, keyword-style queries may skip the embedding call
+LEXICAL_MARGIN = 1.5  # top BM25 score must beat the runner-up by this factor
+
+TOKEN_PATTERN = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it my of on or the this to "
+    "what when where which who why with you your".split()
+)
+
+def tokenize(text):
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+class BM25Index:
+    """
+    Persisted inverted index with Okapi BM25 scoring. Holds only node ids, lengths and
+    postings; the text of a lexical hit is read from the vector store by its id.
+    """
+    def __init__(self, ids=None, lengths=None, postings=None):
+        self.ids = ids or []  # doc index -> node id
+        self.lengths = lengths or []  # doc index -> number of terms
+        self.postings = postings or {}  # term -> [[doc index, term frequency], ...]
+        self._avg_length = None
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if "docs" in data:  # older files also stored each node's text and metadata
+            return cls([doc["id"] for doc in data["docs"]], [doc["length"] for doc in data["docs"]], data["postings"])
+        return cls(data["ids"], data["lengths"], data["postings"])
+
+    def search(self, query, top_k=5):
+        """
+        Returns [(doc index, score, number of distinct query terms matched)], best first.
+        """
+        if not self.ids:
+            return []
+        if self._avg_length is None:
+            self._avg_length = sum(self.lengths) / len(self.lengths) or 1.0
+        scores, matched = Counter(), Counter()
+        n = len(self.ids)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc, tf in postings:
+                length = self.lengths[doc]
+                scores[doc] += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / self._avg_length))
+                matched[doc] += 1
+        return [(doc, score, matched[doc]) for doc, score in scores.most_common(top_k)]
+
+class BM25Writer:
+    """
+    Builds the lexical index file during indexing. Each node's term counts are appended
+    to a spill file as it is added, and postings are assembled from it on close, so the
+    build never holds node text.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.spill_path = f"{path}.terms"
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._spill = open(self.spill_path, "w", encoding="utf-8")
+
+    def add(self, node_id, text):
+        self._spill.write(json.dumps([node_id, Counter(tokenize(text))], ensure_ascii=False) + "\n")
+
+    def close(self):
+        self._spill.close()
+        ids, lengths, postings = [], [], {}
+        with open(self.spill_path, "r", encoding="utf-8") as f:
+            for doc, line in enumerate(f):
+                node_id, terms = json.loads(line)
+                ids.append(node_id)
+                lengths.append(sum(terms.values()))
+                for term, tf in terms.items():
+                    postings.setdefault(term, []).append([doc, tf])
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"ids": ids, "lengths": lengths, "postings": postings}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        os.remove(self.spill_path)
+
+def load_lexical_index(index_dir):
+    path = os.path.join(index_dir, LEXICAL_FILE)
+    return BM25Index.load(path) if os.path.exists(path) else None
+
+class HybridRetriever(BaseRetriever):
+    """
+    Fuses BM25 and vector results with reciprocal rank fusion. In "lexical-first" mode
+    a short query whose top BM25 hit contains every query term and clearly beats the
+    runner-up is answered from the lexical index alone, skipping the embedding call.
+    """
+    def __init__(self, index, bm25, similarity_top_k=5, mode=RETRIEVAL_MODE, **kwargs):
+        if mode not in ("vector", "hybrid", "lexical-first"):
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        super().__init__(**kwargs)
+        self.vector_retriever = index.as_retriever(similarity_top_k=similarity_top_k)
+        self.vector_store = index.vector_store
+        self.bm25 = bm25
+        self.similarity_top_k = similarity_top_k
+        self.mode = mode
+        self.fast_path_hits = 0
+        self.known_embedding = None  # (query, embedding) the caller already computed, see reuse_embedding
+
+    def reuse_embedding(self, query, embedding):
+        # The next retrieval of query uses this vector instead of embedding the query again
+        self.known_embedding = (query, embedding)
+
+    def _with_embedding(self, query_bundle):
+        known, self.known_embedding = self.known_embedding, None
+        if known and query_bundle.embedding is None and known[0] == query_bundle.query_str:
+            return dataclasses.replace(query_bundle, embedding=known[1])
+        return query_bundle
+
+    def _lexical(self, query):
+        return self.bm25.search(query, self.similarity_top_k) if self.bm25 is not None else []
+
+    def confident(self, query, hits):
+        terms = set(tokenize(query))
+        if not hits or not terms or len(terms) > LEXICAL_MAX_TERMS:
+            return False
+        _, top_score, top_matched = hits[0]
+        if top_matched < len(terms):
+            return False
+        return len(hits) == 1 or top_score >= LEXICAL_MARGIN * hits[1][1]
+
+    def _stored_nodes(self, node_ids):
+        # The lexical index keeps no text, so hits are read back from the vector store
+        if not node_ids:
+            return {}
+        return {node.node_id: node for node in self.vector_store.get_nodes(node_ids=list(node_ids))}
+
+    def _lexical_nodes(self, hits):
+        top = hits[0][1] if hits else 1.0
+        nodes = self._stored_nodes([self.bm25.ids[doc] for doc, _, _ in hits])
+        return [NodeWithScore(node=nodes[self.bm25.ids[doc]], score=score / top)
+                for doc, score, _ in hits if self.bm25.ids[doc] in nodes]
+
+    def _fuse(self, hits, vector_nodes):
+        fused = Counter()
+        for rank, (doc, _, _) in enumerate(hits):
+            fused[self.bm25.ids[doc]] += 1.0 / (RRF_K + rank + 1)
+        for rank, result in enumerate(vector_nodes):
+            fused[result.node.node_id] += 1.0 / (RRF_K + rank + 1)
+        ranked = fused.most_common(self.similarity_top_k)
+        nodes = {result.node.node_id: result.node for result in vector_nodes}
+        nodes.update(self._stored_nodes([node_id for node_id, _ in ranked if node_id not in nodes]))
+        return [NodeWithScore(node=nodes[node_id], score=score) for node_id, score in ranked if node_id in nodes]
+
+    def _retrieve(self, query_bundle: QueryBundle):
+        query_bundle = self._with_embedding(query_bundle)
+        with span("retrieval", mode=self.mode, fast_path=False) as attrs:
+            if self.mode == "vector" or self.bm25 is None:
+                return self.vector_retriever.retrieve(query_bundle)
+            hits = self._lexical(query_bundle.query_str)
+            if self.mode == "lexical-first" and self.confident(query_bundle.query_str, hits):
+                self.fast_path_hits += 1
+                attrs["fast_path"] = True
+                return self._lexical_nodes(hits)
+            return self._fuse(hits, self.vector_retriever.retrieve(query_bundle))
+
+    async def _aretrieve(self, query_bundle: QueryBundle):
+        query_bundle = self._with_embedding(query_bundle)
+        with span("retrieval", mode=self.mode, fast_path=False) as attrs:
+            if self.mode == "vector" or self.bm25 is None:
+                return await self.vector_retriever.aretrieve(query_bundle)
+            hits = self._lexical(query_bundle.query_str)
+            if self.mode == "lexical-first" and self.confident(query_bundle.query_str, hits):
+                self.fast_path_hits += 1
+                attrs["fast_path"] = True
+                return self._lexical_nodes(hits)
+            return self._fuse(hits, await self.vector_retriever.aretrieve(query_bundle))
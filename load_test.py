@@ -0,0 +1,122 @@
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+import aiohttp
+import numpy as np
+from benchmark import load_queries
+from indexer import ENRICHED_DATA_FILE
+from server import PORT
+
+# Load generator for server.py: replays generated_questions against an endpoint with
+# a fixed number of concurrent clients and reports throughput and latency percentiles.
+# Start the server with MODEL_PROVIDER=local to measure the service itself without API costs.
+
+# Configuration
+CONCURRENCY = 16
+REQUESTS = 200
+TIMEOUT = 120  # seconds per request
+
+async def call_json(session, url, payload):
+    async with session.post(url, json=payload) as response:
+        response.raise_for_status()
+        data = await response.json()
+    return {"cached": data.get("cached", False)}
+
+async def call_stream(session, url, payload):
+    """
+    Reads the server-sent events; returns the time to the first token and whether it was cached.
+    """
+    start = time.perf_counter()
+    first_token, result, event = None, {}, None
+    async with session.post(url, json=payload) as response:
+        response.raise_for_status()
+        async for line in response.content:
+            line = line.decode("utf-8").strip()
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                if event == "token" and first_token is None:
+                    first_token = time.perf_counter() - start
+                elif event == "done":
+                    result = json.loads(line[len("data: "):])
+                elif event == "error":
+                    raise RuntimeError(json.loads(line[len("data: "):])["error"])
+    return {"cached": result.get("cached", False), "first_token": first_token}
+
+async def run_load(args, questions):
+    paths = {"query": "/query", "chat": "/chat", "stream": "/chat/stream"}
+    url = args.url.rstrip("/") + paths[args.endpoint]
+    call = call_stream if args.endpoint == "stream" else call_json
+    results, errors = [], []
+    counter = iter(range(args.requests))
+
+    async def client(worker, session):
+        for i in counter:
+            question = questions[i % len(questions)]
+            if args.endpoint == "query":
+                payload = {"question": question}
+            else:
+                payload = {"session_id": f"load-{worker % args.sessions}", "message": question}
+            start = time.perf_counter()
+            try:
+                result = await call(session, url, payload)
+            except Exception as e:
+                errors.append(str(e))
+                continue
+            result["seconds"] = time.perf_counter() - start
+            results.append(result)
+
+    timeout = aiohttp.ClientTimeout(total=TIMEOUT)
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(worker, session) for worker in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+        async with session.get(args.url.rstrip("/") + "/health") as response:
+            health = await response.json()
+    return results, errors, elapsed, health
+
+def summarize(results, errors, elapsed, health):
+    report = {
+        "requests": len(results) + len(errors),
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else 0.0,
+        "cached": sum(result["cached"] for result in results),
+        "query_batching": health.get("query_batching")
+    }
+    for key in ("seconds", "first_token"):
+        values = [result[key] for result in results if result.get(key) is not None]
+        if values:
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            report[f"{key}_ms" if key != "seconds" else "latency_ms"] = {
+                "p50": round(float(p50) * 1000, 1), "p95": round(float(p95) * 1000, 1), "p99": round(float(p99) * 1000, 1)
+            }
+    if errors:
+        report["first_error"] = errors[0]
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the HTTP service in server.py.")
+    parser.add_argument("--url", default=f"http://localhost:{PORT}")
+    parser.add_argument("--endpoint", choices=["query", "chat", "stream"], default="query")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="Clients sending requests at once.")
+    parser.add_argument("--requests", type=int, default=REQUESTS, help="Total requests.")
+    parser.add_argument("--sessions", type=int, default=CONCURRENCY, help="Distinct chat sessions for chat/stream.")
+    parser.add_argument("--input", default=ENRICHED_DATA_FILE, help="Enriched chunks with generated_questions.")
+    args = parser.parse_args()
+
+    questions = [query["question"] for query in load_queries(args.input, max_queries=0)]
+    if not questions:
+        print(f"No generated_questions found in {args.input}. Run processor.py first.")
+        return 1
+    print(f"Sending {args.requests} {args.endpoint} requests from {args.concurrency} clients to {args.url}...")
+    report = summarize(*asyncio.run(run_load(args, questions)))
+    print(json.dumps(report, indent=2))
+    return 1 if report["errors"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,384 @@
+import os
+import json
+import shutil
+from typing import Any, List, Optional
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
+
+# Configuration
+STORE_FORMAT = 1
+STORE_DTYPE = os.getenv("VECTOR_STORE_DTYPE", "float16")  # float16 or int8 (per-row scale)
+IVF_LISTS = 0  # 0 = exact search over every row; >0 partitions rows into this many k-means lists
+IVF_PROBES = int(os.getenv("VECTOR_STORE_PROBES", "8"))  # lists scanned per query when IVF is on
+IVF_TRAIN_ROWS = 50000  # rows sampled to train the IVF centroids
+SCAN_BLOCK = 65536  # rows scored per vectorized block
+
+# Files in a store directory
+META_FILE = "store.json"
+VECTORS_FILE = "vectors.npy"
+SCALES_FILE = "scales.npy"
+NODES_FILE = "nodes.jsonl"
+OFFSETS_FILE = "offsets.npy"
+CENTROIDS_FILE = "centroids.npy"
+LISTS_FILE = "lists.npy"
+PENDING_VECTORS = "pending.f32"
+PENDING_NODES = "pending.jsonl"
+
+def normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def quantize(matrix, dtype):
+    """
+    Returns (stored rows, per-row scales or None) for unit-length float32 rows.
+    """
+    if dtype == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return matrix.astype(np.float16), None
+
+class MmapVectorStore(BasePydanticVectorStore):
+    """
+    Local vector store: unit-length embeddings quantized to float16 or int8 in a
+    memory-mapped .npy file, node text/metadata in a JSONL side file read by offset,
+    and vectorized exact top-k cosine search (optionally restricted to the nearest
+    IVF lists). Opening a store only maps the files, so cold start is near-instant.
+
+    Writes are staged: add() appends to pending files and delete_nodes() records ids;
+    persist() rewrites the store in blocks and swaps the files in. Queries see the
+    last persisted state.
+    """
+    stores_text: bool = True
+    flat_metadata: bool = False
+
+    _path: str = PrivateAttr()
+    _dtype: str = PrivateAttr()
+    _ivf_lists: int = PrivateAttr()
+    _meta: Any = PrivateAttr(default=None)
+    _vectors: Any = PrivateAttr(default=None)
+    _scales: Any = PrivateAttr(default=None)
+    _offsets: Any = PrivateAttr(default=None)
+    _centroids: Any = PrivateAttr(default=None)
+    _lists: Any = PrivateAttr(default=None)
+    _ids: Any = PrivateAttr(default=None)
+    _deleted: Any = PrivateAttr(default=None)
+    _pending_ids: Any = PrivateAttr(default=None)
+
+    def __init__(self, path, dtype=STORE_DTYPE, ivf_lists=IVF_LISTS, **kwargs):
+        if dtype not in ("float16", "int8"):
+            raise ValueError(f"Unsupported vector store dtype: {dtype}")
+        super().__init__(**kwargs)
+        self._path = path
+        self._dtype = dtype
+        self._ivf_lists = ivf_lists
+        self._deleted = set()
+        self._pending_ids = []
+        self._load()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MmapVectorStore"
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, META_FILE))
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    def _file(self, name):
+        return os.path.join(self._path, name)
+
+    def _load(self):
+        self._meta = self._vectors = self._scales = self._offsets = self._centroids = self._lists = self._ids = None
+        if not self.exists(self._path):
+            return
+        with open(self._file(META_FILE), "r", encoding="utf-8") as f:
+            self._meta = json.load(f)
+        if self._meta["count"]:
+            self._vectors = np.load(self._file(VECTORS_FILE), mmap_mode="r")
+            self._offsets = np.load(self._file(OFFSETS_FILE), mmap_mode="r")
+            if self._meta["dtype"] == "int8":
+                self._scales = np.load(self._file(SCALES_FILE), mmap_mode="r")
+            if self._meta.get("ivf_lists"):
+                self._centroids = np.load(self._file(CENTROIDS_FILE))
+                self._lists = np.load(self._file(LISTS_FILE))
+
+    @property
+    def count(self):
+        # Not __len__: an empty store must stay truthy for StorageContext.from_defaults
+        return self._meta["count"] if self._meta else 0
+
+    # Reading
+
+    def _read_rows(self, rows):
+        with open(self._file(NODES_FILE), "rb") as f:
+            records = []
+            for row in rows:
+                f.seek(int(self._offsets[row]))
+                records.append(json.loads(f.readline()))
+        return records
+
+    def _row_vectors(self, start, end):
+        block = np.asarray(self._vectors[start:end], dtype=np.float32)
+        if self._scales is not None:
+            block *= self._scales[start:end, None]
+        return block
+
+    def _candidate_ranges(self, query_vector):
+        if self._centroids is None:
+            return [(0, self.count)]
+        probes = np.argsort(-(self._centroids @ query_vector))[:IVF_PROBES]
+        return [(int(self._lists[p]), int(self._lists[p + 1])) for p in sorted(probes)]
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.filters is not None:
+            raise ValueError("MmapVectorStore does not support metadata filters")
+        if not self.count or query.query_embedding is None:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+        q = normalize(np.asarray([query.query_embedding], dtype=np.float32))[0]
+        k = query.similarity_top_k
+        best_rows, best_scores = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        for start, end in self._candidate_ranges(q):
+            for block_start in range(start, end, SCAN_BLOCK):
+                block_end = min(end, block_start + SCAN_BLOCK)
+                scores = self._row_vectors(block_start, block_end) @ q
+                rows = np.arange(block_start, block_end)
+                if len(scores) > k:
+                    keep = np.argpartition(-scores, k)[:k]
+                    rows, scores = rows[keep], scores[keep]
+                best_rows = np.concatenate([best_rows, rows])
+                best_scores = np.concatenate([best_scores, scores])
+                if len(best_scores) > k:
+                    keep = np.argpartition(-best_scores, k)[:k]
+                    best_rows, best_scores = best_rows[keep], best_scores[keep]
+        order = np.argsort(-best_scores)
+        nodes, ids = [], []
+        for record in self._read_rows(best_rows[order]):
+            node = metadata_dict_to_node(record["metadata"], text=record["text"])
+            nodes.append(node)
+            ids.append(record["id"])
+        return VectorStoreQueryResult(nodes=nodes, similarities=best_scores[order].tolist(), ids=ids)
+
+    # Id-level helpers used by indexer.py to diff against the store
+
+    def _id_rows(self):
+        if self._ids is None:
+            self._ids = {}
+            if self.count:
+                with open(self._file(NODES_FILE), "r", encoding="utf-8") as f:
+                    for row, line in enumerate(f):
+                        self._ids[json.loads(line)["id"]] = row
+        return self._ids
+
+    def stored_ids(self, ids):
+        """
+        The subset of ids already in the store (persisted or pending, not deleted).
+        """
+        rows = self._id_rows()
+        pending = set(self._pending_ids)
+        return {i for i in ids if (i in rows or i in pending) and i not in self._deleted}
+
+    def iter_ids(self, page_size=5000):
+        ids = [i for i in self._id_rows() if i not in self._deleted]
+        for start in range(0, len(ids), page_size):
+            yield ids[start:start + page_size]
+
+    def get_nodes(self, node_ids: Optional[List[str]] = None, filters=None, **kwargs: Any) -> List[BaseNode]:
+        """
+        Persisted nodes by id (used for lexical hits); unknown or deleted ids are skipped.
+        """
+        if filters is not None:
+            raise ValueError("MmapVectorStore does not support metadata filters")
+        rows = self._id_rows()
+        wanted = [rows[i] for i in (node_ids or []) if i in rows and i not in self._deleted]
+        return [metadata_dict_to_node(record["metadata"], text=record["text"]) for record in self._read_rows(wanted)]
+
+    # Writing
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        os.makedirs(self._path, exist_ok=True)
+        if not self._pending_ids:
+            self._remove_pending()  # staged rows from an interrupted run were never persisted
+        matrix = normalize(np.asarray([node.get_embedding() for node in nodes], dtype=np.float32))
+        with open(self._file(PENDING_VECTORS), "ab") as f:
+            f.write(matrix.tobytes())
+        with open(self._file(PENDING_NODES), "a", encoding="utf-8") as f:
+            for node in nodes:
+                record = {
+                    "id": node.node_id,
+                    "text": node.get_content(),
+                    "metadata": node_to_metadata_dict(node, remove_text=True, flat_metadata=self.flat_metadata)
+                }
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self._pending_ids.append(node.node_id)
+                self._deleted.discard(node.node_id)
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        for record in self._read_rows(range(self.count)):
+            if record["metadata"].get("ref_doc_id") == ref_doc_id or record["metadata"].get("doc_id") == ref_doc_id:
+                self._deleted.add(record["id"])
+
+    def delete_nodes(self, node_ids: Optional[List[str]] = None, filters=None, **delete_kwargs: Any) -> None:
+        if filters is not None:
+            raise ValueError("MmapVectorStore does not support metadata filters")
+        self._deleted.update(node_ids or [])
+
+    def clear(self) -> None:
+        if os.path.isdir(self._path):
+            shutil.rmtree(self._path)
+        self._deleted = set()
+        self._pending_ids = []
+        self._load()
+
+    def _remove_pending(self):
+        for name in (PENDING_VECTORS, PENDING_NODES):
+            if os.path.exists(self._file(name)):
+                os.remove(self._file(name))
+
+    def _sources(self):
+        """
+        (vectors, offsets, nodes file, scales) for the persisted rows and the pending rows.
+        """
+        sources = []
+        if self.count:
+            sources.append((self._vectors, self._offsets, self._file(NODES_FILE), self._scales))
+        if self._pending_ids:
+            dim = self._meta["dim"] if self._meta else None
+            pending = np.memmap(self._file(PENDING_VECTORS), dtype=np.float32, mode="r")
+            dim = dim or len(pending) // len(self._pending_ids)
+            offsets = [0]
+            with open(self._file(PENDING_NODES), "rb") as f:
+                for line in f:
+                    offsets.append(offsets[-1] + len(line))
+            sources.append((pending.reshape(-1, dim), np.asarray(offsets, dtype=np.int64),
+                            self._file(PENDING_NODES), None))
+        return sources
+
+    def _train_ivf(self, gather, count, dim):
+        lists = min(self._ivf_lists, count)
+        rng = np.random.default_rng(0)
+        sample = gather(np.sort(rng.choice(count, size=min(count, IVF_TRAIN_ROWS), replace=False)))
+        centroids = sample[rng.choice(len(sample), size=lists, replace=False)]
+        for _ in range(10):  # spherical k-means
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(lists):
+                members = sample[assign == c]
+                if len(members):
+                    centroids[c] = members.sum(axis=0)
+            centroids = normalize(centroids)
+        assign = np.empty(count, dtype=np.int32)
+        for start in range(0, count, SCAN_BLOCK):
+            rows = np.arange(start, min(count, start + SCAN_BLOCK))
+            assign[rows] = np.argmax(gather(rows) @ centroids.T, axis=1)
+        return centroids.astype(np.float32), assign
+
+    def persist(self, persist_path: Optional[str] = None, fs=None) -> None:
+        """
+        Applies pending adds and deletes: surviving rows are re-quantized block by
+        block into fresh files (grouped by IVF list when enabled), then swapped in.
+        """
+        if not self._pending_ids and not self._deleted and self._meta is not None:
+            return
+        os.makedirs(self._path, exist_ok=True)
+        sources = self._sources()
+        # Row locations (source, row) of the rows that survive; later duplicates win
+        location = {}
+        for s, (vectors, offsets, nodes_file, _) in enumerate(sources):
+            with open(nodes_file, "rb") as f:
+                for row in range(len(vectors)):
+                    f.seek(int(offsets[row]))
+                    node_id = json.loads(f.readline())["id"]
+                    if node_id in self._deleted:
+                        continue
+                    location[node_id] = (s, row)
+        kept = np.asarray(sorted(location.values()), dtype=np.int64).reshape(-1, 2)
+        count = len(kept)
+        dim = sources[0][0].shape[1] if sources else (self._meta or {}).get("dim", 0)
+
+        def gather(indexes):
+            block = np.empty((len(indexes), dim), dtype=np.float32)
+            for s, (vectors, _, _, scales) in enumerate(sources):
+                mask = kept[indexes, 0] == s
+                rows = kept[indexes[mask], 1]
+                part = np.asarray(vectors[rows], dtype=np.float32)
+                if scales is not None:
+                    part *= scales[rows, None]
+                block[mask] = part
+            return block
+
+        order = np.arange(count)
+        centroids = list_offsets = None
+        if self._ivf_lists and count:
+            centroids, assign = self._train_ivf(gather, count, dim)
+            order = np.argsort(assign, kind="stable")
+            list_offsets = np.searchsorted(assign[order], np.arange(len(centroids) + 1)).astype(np.int64)
+
+        tmp = {name: self._file(name + ".tmp") for name in (VECTORS_FILE, SCALES_FILE, NODES_FILE, OFFSETS_FILE)}
+        vectors_out = np.lib.format.open_memmap(tmp[VECTORS_FILE], mode="w+",
+                                                dtype=np.int8 if self._dtype == "int8" else np.float16,
+                                                shape=(count, dim))
+        scales_out = np.empty(count, dtype=np.float32) if self._dtype == "int8" else None
+        offsets_out = np.empty(count + 1, dtype=np.int64)
+        handles = [open(nodes_file, "rb") for _, _, nodes_file, _ in sources]
+        try:
+            with open(tmp[NODES_FILE], "wb") as nodes_out:
+                offsets_out[0] = 0
+                for start in range(0, count, SCAN_BLOCK):
+                    indexes = order[start:start + SCAN_BLOCK]
+                    stored, scales = quantize(gather(indexes), self._dtype)
+                    vectors_out[start:start + len(indexes)] = stored
+                    if scales_out is not None:
+                        scales_out[start:start + len(indexes)] = scales
+                    for i, (s, row) in enumerate(kept[indexes]):
+                        handle = handles[s]
+                        handle.seek(int(sources[s][1][row]))
+                        line = handle.readline()
+                        nodes_out.write(line)
+                        offsets_out[start + i + 1] = offsets_out[start + i] + len(line)
+        finally:
+            for handle in handles:
+                handle.close()
+        vectors_out.flush()
+        del vectors_out
+        with open(tmp[OFFSETS_FILE], "wb") as f:  # file handles, so np.save keeps the .tmp name
+            np.save(f, offsets_out)
+        if scales_out is not None:
+            with open(tmp[SCALES_FILE], "wb") as f:
+                np.save(f, scales_out)
+
+        # Release the old maps before replacing the files underneath them
+        self._vectors = self._scales = self._offsets = None
+        for name, path in tmp.items():
+            if os.path.exists(path):
+                os.replace(path, self._file(name))
+        if centroids is not None:
+            np.save(self._file(CENTROIDS_FILE), centroids)
+            np.save(self._file(LISTS_FILE), list_offsets)
+        else:
+            for name in (CENTROIDS_FILE, LISTS_FILE, SCALES_FILE if scales_out is None else None):
+                if name and os.path.exists(self._file(name)):
+                    os.remove(self._file(name))
+        meta = {"format": STORE_FORMAT, "dim": int(dim), "dtype": self._dtype, "count": int(count),
+                "ivf_lists": int(len(centroids)) if centroids is not None else 0}
+        with open(self._file(META_FILE + ".tmp"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(self._file(META_FILE + ".tmp"), self._file(META_FILE))
+        self._remove_pending()
+        self._deleted = set()
+        self._pending_ids = []
+        self._load()
@@ -1,30 +1,86 @@
 import os
+import re
 import json
 import time
-from llama_index.llms.gemini import Gemini
+import random
+import asyncio
+import argparse
 from llama_index.core.schema import ImageDocument
 from PIL import Image
-from dotenv import load_dotenv
-
-# Load API Key
-load_dotenv()
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-
-if not GOOGLE_API_KEY:
-    raise ValueError("GOOGLE_API_KEY not found in .env")
+import providers
+from chunker import count_tokens
+from llm_cache import LLMCache, MAX_CACHE_BYTES, text_hash, file_hash, template_version
+from image_dedup import NearDuplicateIndex, PHASH_THRESHOLD, dhash
+from telemetry import record_llm, span
 
 # Configuration
 INPUT_FILE = "processed_data/text_content.json"
 OUTPUT_FILE = "processed_data/enriched_content.json"
+JOURNAL_FILE = "processed_data/enriched_content.journal.jsonl"
+DRY_RUN_DIR = "processed_data/dry_run"  # --dry-run outputs, kept apart from the real ones
+# Serial enrichment pauses this long after each API call; the local stand-ins have no rate limit
+REQUEST_INTERVAL = float(os.getenv("REQUEST_INTERVAL", "0" if providers.is_local() else "0.5"))
+
+# Async enrichment (--async)
+ASYNC_CONCURRENCY = 8  # requests in flight
+REQUESTS_PER_MINUTE = 60
+TOKENS_PER_MINUTE = 1000000
+IMAGE_TOKENS = 258  # Gemini bills each image as a fixed number of input tokens
+MAX_RETRIES = 6
+MAX_BACKOFF = 60  # seconds
+
+# Batched question generation (--batch-questions)
+QUESTION_BATCH_TOKENS = 6000  # input token budget per request
+QUESTION_BATCH_SIZE = 20  # chunks per request
+
+ERROR_DESCRIPTIONS = {"Error generating description.", "Error processing image."}
+
+IMAGE_PROMPT = "Describe this image in detail. If it is a chart, extract the data points. If it is text, transcribe it. If it is a diagram, explain the flow."
+QUESTION_PROMPT = """
+        Read the following text and generate 3 potential questions a user might ask that can be answered by this text.
+        Format the output as a simple list of questions string.
+        
+        Text:
+        {text} # Truncate to avoid context limit if somehow massive, though chunks should be small.
+        """
+BATCH_QUESTION_PROMPT = """
+        For each text below, generate 3 potential questions a user might ask that can be answered by that text.
+        Respond with only a JSON object that maps every text ID to a list of 3 question strings, for example:
+        {{"c1": ["question 1", "question 2", "question 3"]}}
+
+        {texts}
+        """
+# Cache keys include the template fingerprint, so editing a prompt re-generates its outputs
+IMAGE_PROMPT_VERSION = template_version(IMAGE_PROMPT)
+QUESTION_PROMPT_VERSION = template_version(QUESTION_PROMPT)
+BATCH_QUESTION_PROMPT_VERSION = template_version(BATCH_QUESTION_PROMPT)
+
+# Initialize Gemini 2.0 Flash (Cutting Edge, available), or the local stand-in (MODEL_PROVIDER=local)
+MODEL_NAME = providers.model_id(providers.ENRICHMENT_MODEL)
+llm = providers.get_enrichment_llm(providers.ENRICHMENT_MODEL)
+
+# Journal entries written under a different model/prompt are redone on resume
+ENRICHMENT_VERSION = f"{MODEL_NAME}|{IMAGE_PROMPT_VERSION}|{QUESTION_PROMPT_VERSION}"
+
+# Persistent response cache (disable with --no-cache)
+cache = LLMCache()
+
+def image_cache_key(image_path):
+    return LLMCache.key(MODEL_NAME, IMAGE_PROMPT_VERSION, file_hash(image_path))
 
-# Initialize Gemini 2.0 Flash (Cutting Edge, available)
-llm = Gemini(model="models/gemini-2.0-flash-001", api_key=GOOGLE_API_KEY)
+def question_cache_key(text_content):
+    return LLMCache.key(MODEL_NAME, QUESTION_PROMPT_VERSION, text_hash(text_content[:4000]))
 
 def generate_image_description(image_path):
     """
     Generates a detailed description for an image using Gemini Vision.
     """
     try:
+        key = image_cache_key(image_path)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
         # LlamaIndex Gemini wrapper supports passing images
         # We construct a prompt for the multimodal model
         print(f"Generating description for {image_path}...")
@@ -37,10 +93,13 @@ def generate_image_description(image_path):
                 # Let's use the lower level completion or the specialized complete method if available.
                 # Actually, LlamaIndex Gemini `complete` handles images in the `image_documents` arg.
                 
-                resp = llm.complete(
-                    prompt="Describe this image in detail. If it is a chart, extract the data points. If it is text, transcribe it. If it is a diagram, explain the flow.",
-                    image_documents=[ImageDocument(image_path=image_path)]
-                )
+                with span("captioning", image=os.path.basename(image_path), attempt=attempt + 1) as attrs:
+                    resp = llm.complete(
+                        prompt=IMAGE_PROMPT,
+                        image_documents=[ImageDocument(image_path=image_path)]
+                    )
+                    record_llm("captioning", MODEL_NAME, count_tokens(IMAGE_PROMPT) + IMAGE_TOKENS, count_tokens(resp.text), attrs)
+                cache.put(key, resp.text)
                 return resp.text
             except Exception as e:
                 print(f"Attempt {attempt+1} failed: {e}")
@@ -51,75 +110,631 @@ def generate_image_description(image_path):
         print(f"Failed to describe image {image_path}: {e}")
         return "Error processing image."
 
+def question_prompt(text_content):
+    return QUESTION_PROMPT.format(text=text_content[:4000])
+
 def generate_synthetic_questions(text_content):
     """
     Generates synthetic questions based on the text content.
     """
     try:
-        prompt = f"""
-        Read the following text and generate 3 potential questions a user might ask that can be answered by this text.
-        Format the output as a simple list of questions string.
-        
-        Text:
-        {text_content[:4000]} # Truncate to avoid context limit if somehow massive, though chunks should be small.
+        key = question_cache_key(text_content)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+        prompt = question_prompt(text_content)
+        with span("question_generation", chunks=1) as attrs:
+            resp = llm.complete(prompt)
+            record_llm("question_generation", MODEL_NAME, count_tokens(prompt), count_tokens(resp.text), attrs)
+        cache.put(key, resp.text)
+        return resp.text
+    except Exception as e:
+        print(f"Failed to generate questions: {e}")
+        return ""
+
+def questions_to_list(questions):
+    """
+    Normalizes generated questions to a list of strings, stripping the bullets and
+    numbering of free-form responses.
+    """
+    if isinstance(questions, list):
+        return [str(q).strip() for q in questions if str(q).strip()]
+    lines = [re.sub(r"^\s*(?:[-*•]|\d+[.)])\s*", "", line).strip() for line in str(questions).splitlines()]
+    lines = [line for line in lines if line]
+    asked = [line for line in lines if "?" in line]
+    return asked or lines
+
+def parse_json_object(text):
+    """
+    Extracts the JSON object from a model response, tolerating code fences and
+    surrounding prose. Returns None if there is no parseable object.
+    """
+    fence = re.search(r"```(?:json)?\s*(.*?)```", text, re.DOTALL)
+    if fence:
+        text = fence.group(1)
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        return None
+    try:
+        return json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+
+def batch_question_cache_key(text_content):
+    return LLMCache.key(MODEL_NAME, BATCH_QUESTION_PROMPT_VERSION, text_hash(text_content[:4000]))
+
+def batch_question_prompt(texts):
+    """
+    texts: [(local_id, text)]. Short local IDs keep the prompt and response compact.
+    """
+    blocks = "\n\n".join(f"### {local_id}\n{text[:4000]}" for local_id, text in texts)
+    return BATCH_QUESTION_PROMPT.format(texts=blocks)
+
+def pack_question_batches(items, max_tokens=QUESTION_BATCH_TOKENS, max_items=QUESTION_BATCH_SIZE):
+    """
+    Greedily packs (key, text) pairs into batches under the token budget.
+    A single text larger than the budget gets a batch of its own.
+    """
+    batches, current, current_tokens = [], [], 0
+    for key, text in items:
+        tokens = count_tokens(text[:4000])
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append((key, text))
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def questions_to_prefetch(pending):
+    """
+    Splits the pending text items that need questions into cached results and
+    (key, text) pairs that still need a request.
+    """
+    prefetched, todo = {}, []
+    for _, item in pending:
+        if not wants_questions(item, item):
+            continue
+        cached = cache.get(batch_question_cache_key(item["content"]))
+        if cached is not None:
+            prefetched[item_key(item)] = json.loads(cached)
+        else:
+            todo.append((item_key(item), item["content"]))
+    return prefetched, todo
+
+def store_batch_result(batch, response_text, prefetched):
+    """
+    Records the questions returned for a batch; returns the (key, text) pairs the
+    model skipped or answered malformed, for a single-chunk fallback.
+    """
+    parsed = parse_json_object(response_text) or {}
+    missing = []
+    for n, (key, text) in enumerate(batch, start=1):
+        questions = parsed.get(f"c{n}")
+        if not isinstance(questions, list) or not questions:
+            missing.append((key, text))
+            continue
+        questions = questions_to_list(questions)
+        cache.put(batch_question_cache_key(text), json.dumps(questions))
+        prefetched[key] = questions
+    return missing
+
+def prefetch_questions_batched(pending):
+    """
+    Generates questions for all pending text items with one request per batch
+    instead of one per chunk. Returns {item_key: [questions]}.
+    """
+    prefetched, todo = questions_to_prefetch(pending)
+    batches = pack_question_batches(todo)
+    print(f"Question generation: {len(prefetched)} cached, {len(todo)} chunks in {len(batches)} batched requests")
+    for b, batch in enumerate(batches, start=1):
+        print(f"Generating questions for batch {b}/{len(batches)} ({len(batch)} chunks)...")
+        prompt = batch_question_prompt([(f"c{n}", text) for n, (_, text) in enumerate(batch, start=1)])
+        try:
+            with span("question_generation", chunks=len(batch)) as attrs:
+                resp = llm.complete(prompt)
+                record_llm("question_generation", MODEL_NAME, count_tokens(prompt), count_tokens(resp.text), attrs)
+            missing = store_batch_result(batch, resp.text, prefetched)
+        except Exception as e:
+            print(f"Batch {b} failed: {e}")
+            missing = batch
+        for key, text in missing:
+            prefetched[key] = questions_to_list(generate_synthetic_questions(text))
+        time.sleep(REQUEST_INTERVAL)
+    return prefetched
+
+async def aprefetch_questions_batched(pending, limiter, concurrency=ASYNC_CONCURRENCY):
+    prefetched, todo = questions_to_prefetch(pending)
+    batches = iter(pack_question_batches(todo))
+    print(f"Question generation: {len(prefetched)} cached, {len(todo)} chunks to generate in batches")
+
+    async def worker():
+        for batch in batches:
+            prompt = batch_question_prompt([(f"c{n}", text) for n, (_, text) in enumerate(batch, start=1)])
+            try:
+                with span("question_generation", chunks=len(batch)) as attrs:
+                    resp = await call_with_backoff(limiter, count_tokens(prompt), lambda: llm.acomplete(prompt))
+                    record_llm("question_generation", MODEL_NAME, count_tokens(prompt), count_tokens(resp.text), attrs)
+                missing = store_batch_result(batch, resp.text, prefetched)
+            except Exception as e:
+                print(f"Question batch failed: {e}")
+                missing = batch
+            for key, text in missing:
+                prefetched[key] = questions_to_list(await agenerate_synthetic_questions(text, limiter))
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return prefetched
+
+def caption_source(item):
+    """
+    Returns the image file to caption (the downscaled copy made by extractor.py
+    when available), or None if the image is missing.
+    """
+    img_path = item.get("image_path")
+    if not img_path or not os.path.exists(img_path):
+        return None
+    caption_path = item.get("caption_path")
+    if caption_path and os.path.exists(caption_path):
+        return caption_path
+    return img_path
+
+def apply_description(new_item, item, description):
+    new_item["image_description"] = description
+    # We replace the "content" with the description for the text-index
+    new_item["content"] = f"[IMAGE DESCRIPTION] {description}\n[ORIGINAL FILE] {item['content']}"
+
+def wants_questions(new_item, item):
+    # We only do this if the content is substantial enough (> 100 chars) ensures meaningful questions
+    return len(new_item.get("content", "")) > 100 and item["type"] == "text"
+
+class CaptionReuse:
+    """
+    Reuses captions across near-duplicate screenshots (difference hashes within a
+    bit threshold), so the same settings page with one toggle changed is only sent
+    to the vision model once. Seeded with captions already in the journal.
+    Tracks the vision calls and upload bytes saved.
+    """
+    def __init__(self, threshold=PHASH_THRESHOLD):
+        self.index = NearDuplicateIndex(threshold)
+        self.captions = {}  # key -> (description, image file name)
+        self.reuse_of = {}  # pending image key -> key of the image whose caption it reuses
+        self.calls_saved = 0
+        self.bytes_saved = 0
+
+    def seed(self, entries):
+        for key, new_item in entries:
+            description = new_item.get("image_description")
+            source = caption_source(new_item)
+            if new_item.get("type") != "image" or not source or description in ERROR_DESCRIPTIONS:
+                continue
+            value = dhash(source)
+            if value is not None:
+                self.index.add(key, value)
+                self.captions[key] = (description, os.path.basename(new_item["image_path"]))
+
+    def plan(self, pending):
+        """
+        Assigns each pending image either to an earlier near-duplicate or, if none
+        is close enough, makes it a new representative that will be captioned.
+        """
+        for _, item in pending:
+            source = caption_source(item) if item["type"] == "image" else None
+            value = dhash(source) if source else None
+            if value is None:
+                continue
+            match = self.index.find(value)
+            if match:
+                self.reuse_of[item_key(item)] = match[0]
+            else:
+                self.index.add(item_key(item), value)
+        print(f"Near-duplicate screenshots: {len(self.reuse_of)} of the pending images can reuse a caption")
+
+    def lookup(self, item):
+        """
+        Returns a lightly adapted copy of the near-duplicate's caption, or None if
+        this image has to be captioned itself.
         """
-        resp = llm.complete(prompt)
+        original = self.captions.get(self.reuse_of.get(item_key(item)))
+        if original is None:
+            return None
+        description, name = original
+        self.calls_saved += 1
+        self.bytes_saved += os.path.getsize(caption_source(item))
+        return f"{description}\n[NOTE] Near-identical to screenshot {name}; minor UI differences (toggles, values) may not be reflected."
+
+    def record(self, item, description):
+        if description not in ERROR_DESCRIPTIONS:
+            self.captions[item_key(item)] = (description, os.path.basename(item["image_path"]))
+
+    def report(self):
+        print(f"Caption reuse: {self.calls_saved} vision calls and {self.bytes_saved / 1024:.0f} KB of uploads saved")
+
+def describe_image(new_item, item, source, reuse=None):
+    """
+    Captions an image, reusing a near-duplicate's caption when possible.
+    """
+    description = reuse.lookup(item) if reuse else None
+    if description is not None:
+        new_item["caption_reused_from"] = reuse.reuse_of[item_key(item)]
+    else:
+        description = generate_image_description(source)
+        if reuse:
+            reuse.record(item, description)
+    apply_description(new_item, item, description)
+
+class RateLimiter:
+    """
+    Token-bucket limiter for requests-per-minute and tokens-per-minute quotas.
+    Both buckets refill continuously; acquire() waits until each has room.
+    A 429 from the API pauses every caller via pause().
+    """
+    def __init__(self, rpm, tpm=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = float(rpm)
+        self.tokens = float(tpm or 0)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+
+    async def acquire(self, tokens=0):
+        tokens = min(tokens, self.tpm) if self.tpm else 0
+        # Waiters queue on the lock, so capacity is handed out in FIFO order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill()
+                if self.requests >= 1 and self.tokens >= tokens:
+                    self.requests -= 1
+                    self.tokens -= tokens
+                    return
+                wait = (1 - self.requests) * 60 / self.rpm if self.requests < 1 else 0
+                if self.tpm and self.tokens < tokens:
+                    wait = max(wait, (tokens - self.tokens) * 60 / self.tpm)
+                await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+def rate_limit_delay(error):
+    """
+    Returns the server-suggested retry delay for a 429 / RESOURCE_EXHAUSTED error,
+    0 if it is a 429 without a hint, or None if the error is not a rate limit.
+    """
+    status = getattr(error, "code", None) or getattr(error, "status_code", None)
+    message = str(error)
+    if status != 429 and "429" not in message and "RESOURCE_EXHAUSTED" not in message:
+        return None
+    match = re.search(r"retry(?:Delay|[ _-]after)\W*(\d+(?:\.\d+)?)", message, re.IGNORECASE)
+    return float(match.group(1)) if match else 0
+
+async def call_with_backoff(limiter, tokens, make_call):
+    """
+    Runs make_call() under the limiter. 429 responses back off exponentially
+    (or for the server-suggested delay) and pause the limiter for everyone;
+    other errors are retried a few times with a short jittered delay.
+    """
+    for attempt in range(MAX_RETRIES):
+        await limiter.acquire(tokens)
+        try:
+            return await make_call()
+        except Exception as e:
+            if attempt == MAX_RETRIES - 1:
+                raise
+            hint = rate_limit_delay(e)
+            if hint is None:
+                if attempt >= 2:
+                    raise
+                delay = 1 + random.random()
+            else:
+                delay = hint or min(MAX_BACKOFF, 2 ** (attempt + 1)) * (0.5 + random.random() / 2)
+                limiter.pause(delay)
+            print(f"Attempt {attempt+1} failed ({e}); retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+async def agenerate_image_description(image_path, limiter):
+    try:
+        key = image_cache_key(image_path)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+        # The span includes rate-limit waits and retries, which are part of the stage's cost
+        with span("captioning", image=os.path.basename(image_path)) as attrs:
+            resp = await call_with_backoff(
+                limiter,
+                count_tokens(IMAGE_PROMPT) + IMAGE_TOKENS,
+                lambda: llm.acomplete(prompt=IMAGE_PROMPT, image_documents=[ImageDocument(image_path=image_path)])
+            )
+            record_llm("captioning", MODEL_NAME, count_tokens(IMAGE_PROMPT) + IMAGE_TOKENS, count_tokens(resp.text), attrs)
+        cache.put(key, resp.text)
+        return resp.text
+    except Exception as e:
+        print(f"Failed to describe image {image_path}: {e}")
+        return "Error generating description."
+
+async def agenerate_synthetic_questions(text_content, limiter):
+    prompt = question_prompt(text_content)
+    try:
+        key = question_cache_key(text_content)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+        with span("question_generation", chunks=1) as attrs:
+            resp = await call_with_backoff(limiter, count_tokens(prompt), lambda: llm.acomplete(prompt))
+            record_llm("question_generation", MODEL_NAME, count_tokens(prompt), count_tokens(resp.text), attrs)
+        cache.put(key, resp.text)
         return resp.text
     except Exception as e:
         print(f"Failed to generate questions: {e}")
         return ""
 
-def process_data():
-    if not os.path.exists(INPUT_FILE):
-        print(f"Input file {INPUT_FILE} not found. Run extractor.py first.")
+async def aenrich_item(item, limiter, prefetched=None, reuse=None):
+    new_item = item.copy()
+    if item["type"] == "image":
+        source = caption_source(item)
+        description = reuse.lookup(item) if reuse and source else None
+        if description is not None:
+            new_item["caption_reused_from"] = reuse.reuse_of[item_key(item)]
+            apply_description(new_item, item, description)
+        elif source:
+            description = await agenerate_image_description(source, limiter)
+            if reuse:
+                reuse.record(item, description)
+            apply_description(new_item, item, description)
+        else:
+            new_item["content"] = "[MISSING IMAGE]"
+    if wants_questions(new_item, item):
+        if prefetched and item_key(item) in prefetched:
+            new_item["generated_questions"] = prefetched[item_key(item)]
+        else:
+            new_item["generated_questions"] = questions_to_list(await agenerate_synthetic_questions(new_item["content"], limiter))
+    return new_item
+
+def load_items(path):
+    """
+    Loads extracted chunks from either the JSON array written by extractor.py
+    or the JSONL stream written by its --input-dir mode.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+def item_key(item):
+    # Chunk IDs come from extractor.py/chunker.py; older inputs fall back to a content hash
+    return item.get("id") or text_hash(f"{item.get('source')}\x00{item.get('type')}\x00{item.get('content')}")
+
+def read_journal(path=None):
+    """
+    Yields (key, enriched_item) for every complete journal line written by the
+    current ENRICHMENT_VERSION. A line torn by a crash mid-write is skipped.
+    """
+    path = path or JOURNAL_FILE
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry.get("version") == ENRICHMENT_VERSION:
+                yield entry["key"], entry["item"]
+
+def append_journal(journal, item, new_item):
+    journal.write(json.dumps({"key": item_key(item), "version": ENRICHMENT_VERSION, "item": new_item}, ensure_ascii=False) + "\n")
+    journal.flush()
+
+def compact_journal(data, path=None, output_file=None):
+    """
+    Writes the enriched items for `data`, in input order, to output_file and
+    rewrites the journal with only those entries so it doesn't grow across runs.
+    """
+    path = path or JOURNAL_FILE
+    output_file = output_file or OUTPUT_FILE
+    keys = [item_key(item) for item in data]
+    wanted = set(keys)
+    entries = {key: new_item for key, new_item in read_journal(path) if key in wanted}
+    keys = [key for key in keys if key in entries]
+
+    with open(output_file, "w") as f:
+        json.dump([entries[key] for key in keys], f, indent=2)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for key in keys:
+            f.write(json.dumps({"key": key, "version": ENRICHMENT_VERSION, "item": entries[key]}, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+    return len(keys)
+
+def enrichment_failed(new_item):
+    # A caption or question request that errored out; journaled so the output stays complete
+    return new_item.get("image_description") in ERROR_DESCRIPTIONS or new_item.get("generated_questions") == []
+
+def pending_items(data, restart=False):
+    """
+    Returns the (index, item) pairs not yet in the journal, or journaled with a failed
+    caption or question generation, so transient API errors are retried on resume.
+    """
+    if restart and os.path.exists(JOURNAL_FILE):
+        os.remove(JOURNAL_FILE)
+    journaled = dict(read_journal())
+    done = {key for key, new_item in journaled.items() if not enrichment_failed(new_item)}
+    pending = [(i, item) for i, item in enumerate(data) if item_key(item) not in done]
+    if len(pending) < len(data):
+        retries = sum(item_key(item) in journaled for _, item in pending)
+        print(f"Resuming: {len(data) - len(pending)} items already journaled, {len(pending)} to process"
+              + (f" ({retries} retrying a failed request)" if retries else ""))
+    return pending
+
+def plan_caption_reuse(pending, threshold):
+    if threshold is None:
+        return None
+    reuse = CaptionReuse(threshold)
+    reuse.seed(read_journal())
+    reuse.plan(pending)
+    return reuse
+
+def process_data(input_file=INPUT_FILE, restart=False, batch_questions=False, phash_threshold=None):
+    if not os.path.exists(input_file):
+        print(f"Input file {input_file} not found. Run extractor.py first.")
         return
 
-    with open(INPUT_FILE, "r") as f:
-        data = json.load(f)
-    
-    enriched_data = []
+    data = load_items(input_file)
+    pending = pending_items(data, restart)
+    prefetched = prefetch_questions_batched(pending) if batch_questions else {}
+    reuse = plan_caption_reuse(pending, phash_threshold)
     
     print(f"Processing {len(data)} items...")
+    start = time.monotonic()
     
-    for i, item in enumerate(data):
-        print(f"Processing item {i+1}/{len(data)}")
-        new_item = item.copy()
-        
-        # 1. Image Captioning
-        if item["type"] == "image":
-            img_path = item.get("image_path")
-            if img_path and os.path.exists(img_path):
-                description = generate_image_description(img_path)
-                new_item["image_description"] = description
-                # We replace the "content" with the description for the text-index
-                new_item["content"] = f"[IMAGE DESCRIPTION] {description}\n[ORIGINAL FILE] {item['content']}"
-            else:
-                new_item["content"] = "[MISSING IMAGE]"
-        
-        # 2. Synthetic Questions
-        # We only do this if the content is substantial enough (> 100 chars) ensures meaningful questions
-        content_text = new_item.get("content", "")
-        if len(content_text) > 100 and item["type"] == "text":
-             # Optimization: Only generate questions for "text" type (not table/image handled elsewhere)
-             # To save time/cost, we can also sample or just do all. Let's do all substantial text.
-             questions = generate_synthetic_questions(content_text)
-             new_item["generated_questions"] = questions
-        
-        enriched_data.append(new_item)
-        
-        # Save checkpoint every 50 items
-        if (i + 1) % 50 == 0:
-            print(f"Saving checkpoint at {i+1}...")
-            with open(OUTPUT_FILE, "w") as f:
-                json.dump(enriched_data, f, indent=2)
-        
-        # Rate limiting
-        time.sleep(0.5)
+    with open(JOURNAL_FILE, "a", encoding="utf-8") as journal:
+        for i, item in pending:
+            print(f"Processing item {i+1}/{len(data)}")
+            misses_before = cache.misses
+            new_item = item.copy()
+            
+            # 1. Image Captioning
+            if item["type"] == "image":
+                source = caption_source(item)
+                if source:
+                    describe_image(new_item, item, source, reuse)
+                else:
+                    new_item["content"] = "[MISSING IMAGE]"
+            
+            # 2. Synthetic Questions
+            if wants_questions(new_item, item):
+                 # Optimization: Only generate questions for "text" type (not table/image handled elsewhere)
+                 # To save time/cost, we can also sample or just do all. Let's do all substantial text.
+                 if item_key(item) in prefetched:
+                     questions = prefetched[item_key(item)]
+                 else:
+                     questions = questions_to_list(generate_synthetic_questions(new_item["content"]))
+                 new_item["generated_questions"] = questions
+            
+            # Append-only checkpoint: one line per item, resumable after a crash
+            append_journal(journal, item, new_item)
+            
+            # Rate limiting (cache hits made no API call)
+            if cache.misses > misses_before:
+                time.sleep(REQUEST_INTERVAL)
+
+    count = compact_journal(data)
+    
+    print(f"Enrichment complete. Saved {count} items to {OUTPUT_FILE}")
+    print_throughput(len(pending), time.monotonic() - start)
+    print_cache_stats()
+    if reuse:
+        reuse.report()
+
+def print_throughput(items, elapsed):
+    rate = items / elapsed if elapsed else 0.0
+    print(f"Throughput: {items} items in {elapsed:.1f}s ({rate:.2f} items/s, model {MODEL_NAME})")
+
+def print_cache_stats():
+    stats = cache.stats()
+    if cache.enabled:
+        print(f"LLM cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), "
+              f"{stats['entries']} entries, {stats['bytes'] / 1024:.0f} KB")
+
+async def process_data_async(input_file=INPUT_FILE, concurrency=ASYNC_CONCURRENCY,
+                             rpm=REQUESTS_PER_MINUTE, tpm=TOKENS_PER_MINUTE, restart=False,
+                             batch_questions=False, phash_threshold=None):
+    """
+    Concurrent version of process_data: up to `concurrency` requests in flight,
+    paced by an RPM/TPM token bucket instead of a fixed sleep per item.
+    Output order matches the input.
+    """
+    if not os.path.exists(input_file):
+        print(f"Input file {input_file} not found. Run extractor.py first.")
+        return
+
+    data = load_items(input_file)
+    pending = pending_items(data, restart)
+    limiter = RateLimiter(rpm, tpm)
+    prefetched = await aprefetch_questions_batched(pending, limiter, concurrency) if batch_questions else {}
+    reuse = plan_caption_reuse(pending, phash_threshold)
+    # Near-duplicates go last, once the captions they reuse exist
+    duplicates = set(reuse.reuse_of) if reuse else set()
+    primary = [p for p in pending if item_key(p[1]) not in duplicates]
+    queue = iter(primary + [p for p in pending if item_key(p[1]) in duplicates])
+    primary_remaining = len(primary)
+    done_primary = asyncio.Event()
+    if not primary_remaining:
+        done_primary.set()
+    done = 0
+    start = time.monotonic()
+
+    print(f"Processing {len(pending)} items (concurrency={concurrency}, rpm={rpm}, tpm={tpm})...")
+
+    with open(JOURNAL_FILE, "a", encoding="utf-8") as journal:
+        async def worker():
+            nonlocal done, primary_remaining
+            for _, item in queue:
+                if item_key(item) in duplicates and not done_primary.is_set():
+                    await done_primary.wait()
+                new_item = await aenrich_item(item, limiter, prefetched, reuse)
+                append_journal(journal, item, new_item)
+                if item_key(item) not in duplicates:
+                    primary_remaining -= 1
+                    if not primary_remaining:
+                        done_primary.set()
+                done += 1
+                if done % 10 == 0 or done == len(pending):
+                    rate = done / (time.monotonic() - start)
+                    print(f"Processed {done}/{len(pending)} items ({rate:.1f} items/s)")
+
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
 
-    with open(OUTPUT_FILE, "w") as f:
-        json.dump(enriched_data, f, indent=2)
+    count = compact_journal(data)
     
-    print(f"Enrichment complete. Saved to {OUTPUT_FILE}")
+    print(f"Enrichment complete. Saved {count} items to {OUTPUT_FILE}")
+    print_throughput(len(pending), time.monotonic() - start)
+    print_cache_stats()
+    if reuse:
+        reuse.report()
 
 if __name__ == "__main__":
-    process_data()
+    parser = argparse.ArgumentParser(description="Caption images and generate synthetic questions with Gemini.")
+    parser.add_argument("--input", default=INPUT_FILE, help="extractor.py or chunker.py output (.json or .jsonl).")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Enrich concurrently under an RPM/TPM rate limiter.")
+    parser.add_argument("--concurrency", type=int, default=ASYNC_CONCURRENCY, help="Requests in flight with --async.")
+    parser.add_argument("--rpm", type=float, default=REQUESTS_PER_MINUTE, help="Requests-per-minute quota for --async.")
+    parser.add_argument("--tpm", type=float, default=TOKENS_PER_MINUTE, help="Input tokens-per-minute quota for --async (0 disables).")
+    parser.add_argument("--batch-questions", action="store_true", help="Generate questions for many chunks per request, as JSON lists.")
+    parser.add_argument("--reuse-captions", action="store_true", help="Reuse captions across near-duplicate screenshots instead of captioning each one.")
+    parser.add_argument("--phash-threshold", type=int, default=PHASH_THRESHOLD, help="Max differing hash bits (of 64) for --reuse-captions.")
+    parser.add_argument("--restart", action="store_true", help="Discard the enrichment journal instead of resuming from it.")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the API, ignoring and not updating the response cache.")
+    parser.add_argument("--cache-max-mb", type=float, default=MAX_CACHE_BYTES / (1024 * 1024), help="Response cache size before LRU eviction.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help=f"Throughput run against the local stand-ins (MODEL_PROVIDER=local): no cache, outputs under {DRY_RUN_DIR}.")
+    args = parser.parse_args()
+    if args.dry_run:
+        if not providers.is_local():
+            parser.error("--dry-run needs MODEL_PROVIDER=local so it never calls the paid API")
+        os.makedirs(DRY_RUN_DIR, exist_ok=True)
+        OUTPUT_FILE = os.path.join(DRY_RUN_DIR, os.path.basename(OUTPUT_FILE))
+        JOURNAL_FILE = os.path.join(DRY_RUN_DIR, os.path.basename(JOURNAL_FILE))
+        args.no_cache = True
+        args.restart = True
+    cache.close()
+    cache = LLMCache(max_bytes=int(args.cache_max_mb * 1024 * 1024), enabled=not args.no_cache)
+    phash_threshold = args.phash_threshold if args.reuse_captions else None
+    if args.use_async:
+        asyncio.run(process_data_async(args.input, args.concurrency, args.rpm, args.tpm, args.restart,
+                                       args.batch_questions, phash_threshold))
+    else:
+        process_data(args.input, args.restart, args.batch_questions, phash_threshold)
@@ -0,0 +1,240 @@
+import os
+import re
+import time
+import json
+import asyncio
+import hashlib
+from typing import Any, Sequence
+
+import numpy as np
+from dotenv import load_dotenv
+from llama_index.core.base.llms.generic_utils import completion_response_to_chat_response
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.embeddings import BaseEmbedding
+from llama_index.core.llms import (
+    ChatMessage,
+    ChatResponse,
+    CompletionResponse,
+    CompletionResponseGen,
+    CustomLLM,
+    LLMMetadata,
+)
+from llama_index.core.llms.callbacks import llm_chat_callback, llm_completion_callback
+
+from embedding_cache import EMBED_BATCH_SIZE, EMBED_PARALLEL, QUERY_CACHE_SIZE, CachedEmbedding
+
+# Model provider selection, shared by processor.py, indexer.py and app.py.
+# MODEL_PROVIDER=gemini (default) uses the Google APIs; MODEL_PROVIDER=local swaps in
+# deterministic offline stand-ins so every stage can be profiled without the live API.
+load_dotenv()
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+PROVIDER = os.getenv("MODEL_PROVIDER", "gemini").lower()
+
+# Local stand-in tuning
+LOCAL_LLM_LATENCY = float(os.getenv("LOCAL_LLM_LATENCY", "0.05"))  # seconds per call
+LOCAL_LLM_TOKEN_LATENCY = float(os.getenv("LOCAL_LLM_TOKEN_LATENCY", "0.002"))  # seconds per generated token
+LOCAL_EMBED_LATENCY = float(os.getenv("LOCAL_EMBED_LATENCY", "0.01"))  # seconds per embedding call
+LOCAL_EMBED_DIM = int(os.getenv("LOCAL_EMBED_DIM", "768"))
+
+# Default models
+ENRICHMENT_MODEL = "models/gemini-2.0-flash-001"
+CHAT_MODEL = "models/gemini-flash-latest"
+EMBED_MODEL = "models/text-embedding-004"
+
+WORD_PATTERN = re.compile(r"\w+")
+
+def is_local():
+    return PROVIDER == "local"
+
+def model_id(model):
+    """
+    Identifier for cache keys and reports; local stand-ins never share entries with real models.
+    """
+    return f"local:{model}" if is_local() else model
+
+def collection_name(base):
+    """
+    Local stand-in embeddings live in their own Chroma collection so they never
+    mix with vectors from the real embedding model.
+    """
+    return f"{base}_local" if is_local() else base
+
+def _require_api_key():
+    if not GOOGLE_API_KEY:
+        raise ValueError("GOOGLE_API_KEY not found in .env (set MODEL_PROVIDER=local to run offline)")
+
+class HashingEmbedding(BaseEmbedding):
+    """
+    Offline embedding stand-in: signed feature hashing of words and word bigrams into
+    a fixed-size, L2-normalized vector. Deterministic, and similar texts land close
+    together, so retrieval behaves plausibly in tests and load runs.
+    """
+    dim: int = Field(default=LOCAL_EMBED_DIM, description="Vector size.")
+    latency: float = Field(default=LOCAL_EMBED_LATENCY, description="Simulated seconds per call.")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HashingEmbedding"
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        words = WORD_PATTERN.findall(text.lower())
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[digest % self.dim] += 1.0 if digest & (1 << 63) else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def _get_query_embedding(self, query: str):
+        time.sleep(self.latency)
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str):
+        time.sleep(self.latency)
+        return self._embed(text)
+
+    def _get_text_embeddings(self, texts):
+        # One simulated round-trip per batch, like a real batched API call
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    async def _aget_query_embedding(self, query: str):
+        await asyncio.sleep(self.latency)
+        return self._embed(query)
+
+    async def _aget_text_embedding(self, text: str):
+        await asyncio.sleep(self.latency)
+        return self._embed(text)
+
+    async def _aget_query_embeddings(self, queries):
+        # One simulated round-trip per batch of queries
+        await asyncio.sleep(self.latency)
+        return [self._embed(query) for query in queries]
+
+class CannedLLM(CustomLLM):
+    """
+    Offline LLM stand-in returning deterministic canned responses shaped like the
+    pipeline expects (captions, question lists, batched JSON, chat answers), after a
+    configurable per-call and per-token delay.
+    """
+    model_name: str = Field(default="canned")
+    latency: float = Field(default=LOCAL_LLM_LATENCY, description="Simulated seconds per call.")
+    token_latency: float = Field(default=LOCAL_LLM_TOKEN_LATENCY, description="Simulated seconds per output token.")
+    context_window: int = Field(default=32768)
+    num_output: int = Field(default=1024)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CannedLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(context_window=self.context_window, num_output=self.num_output, model_name=self.model_name)
+
+    def _respond(self, prompt, image_documents=None):
+        seed = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:8]
+        if image_documents:
+            name = os.path.basename(getattr(image_documents[0], "image_path", "") or "image")
+            return f"A screenshot ({name}, ref {seed}) of the UZIO web app showing a settings page with a form, toggles and a Save button."
+        batch_ids = re.findall(r"^\s*### (\S+)\s*$", prompt, re.MULTILINE)  # the first marker is indented by the template
+        if batch_ids:
+            return json.dumps({cid: [f"What does section {cid} ({seed}) explain?",
+                                     f"How do I configure the setting in {cid}?",
+                                     f"Where is {cid} found in UZIO?"] for cid in batch_ids})
+        if "generate 3 potential questions" in prompt:
+            return f"1. What does this section ({seed}) describe?\n2. How do I configure it?\n3. Where is it found in UZIO?"
+        return (f"Here is how to do that in UZIO (canned answer {seed}): "
+                "1. Open the Time Tracking settings. 2. Choose the relevant policy. 3. Update the fields and click Save.")
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        text = self._respond(prompt, kwargs.get("image_documents"))
+        time.sleep(self.latency + self.token_latency * len(text.split()))
+        return CompletionResponse(text=text)
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        text = self._respond(prompt, kwargs.get("image_documents"))
+        time.sleep(self.latency)
+        produced = ""
+        for word in text.split(" "):
+            time.sleep(self.token_latency)
+            delta = word if not produced else " " + word
+            produced += delta
+            yield CompletionResponse(text=produced, delta=delta)
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        # Non-blocking delay so concurrent callers overlap like real network calls
+        text = self._respond(prompt, kwargs.get("image_documents"))
+        await asyncio.sleep(self.latency + self.token_latency * len(text.split()))
+        return CompletionResponse(text=text)
+
+    @llm_completion_callback()
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        text = self._respond(prompt, kwargs.get("image_documents"))
+
+        async def gen():
+            await asyncio.sleep(self.latency)
+            produced = ""
+            for word in text.split(" "):
+                await asyncio.sleep(self.token_latency)
+                delta = word if not produced else " " + word
+                produced += delta
+                yield CompletionResponse(text=produced, delta=delta)
+
+        return gen()
+
+    @llm_chat_callback()
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        prompt = self.messages_to_prompt(messages)
+        return completion_response_to_chat_response(await self.acomplete(prompt, formatted=True, **kwargs))
+
+    @llm_chat_callback()
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any):
+        prompt = self.messages_to_prompt(messages)
+        completions = await self.astream_complete(prompt, formatted=True, **kwargs)
+
+        async def gen():
+            async for completion in completions:
+                yield ChatResponse(
+                    message=ChatMessage(role="assistant", content=completion.text),
+                    delta=completion.delta,
+                )
+
+        return gen()
+
+def get_enrichment_llm(model=ENRICHMENT_MODEL):
+    """
+    LLM used by processor.py for captioning and question generation
+    (complete/acomplete with optional image_documents).
+    """
+    if is_local():
+        return CannedLLM(model_name=model)
+    _require_api_key()
+    from llama_index.llms.gemini import Gemini
+    return Gemini(model=model, api_key=GOOGLE_API_KEY)
+
+def get_llm(model=CHAT_MODEL):
+    """
+    Chat/completion LLM used by indexer.py and app.py.
+    """
+    if is_local():
+        return CannedLLM(model_name=model)
+    from llama_index.llms.google_genai import GoogleGenAI
+    return GoogleGenAI(model=model, api_key=GOOGLE_API_KEY)
+
+def get_embed_model(model_name=EMBED_MODEL, cache=None, batch_size=EMBED_BATCH_SIZE, parallel=EMBED_PARALLEL,
+                    query_cache_size=QUERY_CACHE_SIZE):
+    """
+    Embedding model used by indexer.py and app.py, wrapped with the on-disk vector
+    cache (pass an EmbeddingCache(enabled=False) to bypass it) and an in-memory LRU
+    of query_cache_size query vectors (0 disables it).
+    """
+    if is_local():
+        inner = HashingEmbedding(model_name=model_id(model_name))
+    else:
+        from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
+        inner = GoogleGenAIEmbedding(model_name=model_name, api_key=GOOGLE_API_KEY)
+    return CachedEmbedding(inner, store=cache, batch_size=batch_size, parallel=parallel,
+                           query_cache_size=query_cache_size)
@@ -0,0 +1,328 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from collections import OrderedDict
+
+from aiohttp import web
+from llama_index.core import Settings
+from llama_index.core.llms import ChatMessage, MessageRole
+import providers
+from answer_cache import SemanticAnswerCache
+from chat_memory import SummaryMemory
+from embedding_cache import CoalescingEmbedding
+from engine import (
+    context_tokens,
+    index_params,
+    make_chat_engine,
+    memory_tokens,
+    open_index,
+    prompt_tokens,
+    record_generation,
+    reuse_query_embedding,
+)
+from index_artifacts import current_index, index_status
+from telemetry import METRICS, span
+
+# Headless HTTP service over the same published index as app.py, for the help-desk
+# widget and the Slack bot. One process loads the index once and serves many concurrent
+# requests on one event loop; concurrent question embeddings are coalesced into batches.
+#   POST /query        {"question"}                -> stateless answer with sources
+#   POST /chat         {"session_id", "message"}   -> answer using the session's memory
+#   POST /chat/stream  {"session_id", "message"}   -> the same as server-sent events
+#   GET  /health
+#   GET  /metrics                                  -> Prometheus text format (see telemetry.py)
+
+# Configuration
+HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+PORT = int(os.getenv("SERVER_PORT", "8000"))
+MAX_GENERATIONS = int(os.getenv("SERVER_MAX_GENERATIONS", "32"))  # LLM calls in flight; further requests queue
+MAX_SESSIONS = 1000  # least recently used chat sessions are dropped beyond this
+SESSION_TTL = 3600  # seconds of inactivity before a chat session is dropped
+INDEX_POLL_SECONDS = 30  # how often to look for a newly published index version
+MAX_QUESTION_CHARS = 4000
+SOURCE_PREVIEW_CHARS = 300
+
+class IndexState:
+    """
+    The loaded index version with its lexical index and answer cache. Replaced as a
+    whole when a new version is published, so a request keeps the version it started with.
+    """
+    def __init__(self, index_dir, manifest, index, bm25):
+        self.index_dir = index_dir
+        self.version = manifest.get("version")
+        self.index = index
+        self.bm25 = bm25
+        self.answer_cache = SemanticAnswerCache(version=self.version)
+
+def load_state(previous=None):
+    """
+    Loads the published index, or returns previous when it is still current.
+    """
+    index_dir, manifest = current_index()
+    if index_dir is None:
+        return previous
+    if previous is not None and previous.index_dir == index_dir:
+        return previous
+    index, bm25 = open_index(index_dir, *index_params(manifest))
+    print(f"Loaded index {manifest.get('version') or index_dir}")
+    return IndexState(index_dir, manifest, index, bm25)
+
+class Session:
+    def __init__(self):
+        self.memory = SummaryMemory.from_defaults(llm=Settings.llm)
+        self.engine = None
+        self.index_dir = None
+        self.lock = asyncio.Lock()  # one turn at a time per conversation
+        self.last_used = time.time()
+
+    def chat_engine(self, state):
+        # Rebuilt on a new index version; the memory carries over
+        if self.index_dir != state.index_dir:
+            self.engine = make_chat_engine(state.index, state.bm25, self.memory)
+            self.index_dir = state.index_dir
+        return self.engine
+
+class SessionStore:
+    def __init__(self, max_sessions=MAX_SESSIONS, ttl=SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sessions = OrderedDict()
+
+    def get(self, session_id):
+        now = time.time()
+        for stale in [key for key, session in self.sessions.items() if now - session.last_used > self.ttl]:
+            del self.sessions[stale]
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessions[session_id] = Session()
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        self.sessions.move_to_end(session_id)
+        session.last_used = now
+        return session
+
+class Service:
+    """
+    Per-process state: the loaded index version, the chat sessions and the LLM concurrency limit.
+    """
+    def __init__(self):
+        self.state = None
+        self.sessions = SessionStore()
+        self.generations = None
+        self.watcher = None
+
+SERVICE = web.AppKey("service", Service)
+
+def source_json(result):
+    node = result.node
+    return {
+        "id": node.node_id,
+        "score": round(float(result.score or 0.0), 4),
+        "text": node.get_content()[:SOURCE_PREVIEW_CHARS],
+        "metadata": {key: node.metadata[key] for key in ("source", "section", "type", "image_path") if node.metadata.get(key)}
+    }
+
+async def read_request(request, field):
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise web.HTTPBadRequest(text="Request body must be JSON")
+    text = body.get(field) if isinstance(body, dict) else None
+    if not isinstance(text, str) or not text.strip():
+        raise web.HTTPBadRequest(text=f"'{field}' is required")
+    if len(text) > MAX_QUESTION_CHARS:
+        raise web.HTTPBadRequest(text=f"'{field}' is longer than {MAX_QUESTION_CHARS} characters")
+    return body, text.strip()
+
+def current_state(service):
+    state = service.state
+    if state is None:
+        raise web.HTTPServiceUnavailable(text="The index is not built yet")
+    return state
+
+async def lookup_answer(state, question):
+    """
+    Returns (query embedding, cached entry or None) for a standalone question.
+    """
+    embedding = await Settings.embed_model.aget_query_embedding(question)
+    cached = state.answer_cache.lookup(embedding)
+    return embedding, cached[1] if cached else None
+
+async def answer(service, state, question, session=None):
+    start = time.perf_counter()
+    engine = session.chat_engine(state) if session else make_chat_engine(state.index, state.bm25)
+    standalone = session is None or not (engine.chat_history or session.memory.summary)
+    embedding, cached = await lookup_answer(state, question) if standalone else (None, None)
+    if cached:
+        if session:
+            await session.memory.aput_messages([ChatMessage(role=MessageRole.USER, content=question),
+                                                ChatMessage(role=MessageRole.ASSISTANT, content=cached["answer"])])
+        return {"answer": cached["answer"], "sources": [source_json(node) for node in cached["sources"]],
+                "cached": True, "version": state.version, "seconds": round(time.perf_counter() - start, 3)}
+    history_tokens = memory_tokens(session.memory) if session else 0
+    async with service.generations:
+        # Streamed internally, so generation is timed from the end of retrieval and
+        # memory compaction, which have their own spans
+        reuse_query_embedding(engine, question, embedding)
+        response = await engine.astream_chat(question)
+        retrieved = time.perf_counter()
+        first_token = None
+        async for _ in response.async_response_gen():
+            first_token = first_token or time.perf_counter()
+        done = time.perf_counter()
+    record_generation(done - retrieved, prompt_tokens(question, response.source_nodes, history_tokens),
+                      response.response, (first_token or done) - retrieved)
+    if standalone and response.response:
+        state.answer_cache.store(question, embedding, response.response, response.source_nodes)
+    return {"answer": response.response, "sources": [source_json(node) for node in response.source_nodes],
+            "cached": False, "version": state.version, "context_tokens": context_tokens(response.source_nodes),
+            "seconds": round(time.perf_counter() - start, 3)}
+
+async def handle_query(request):
+    _, question = await read_request(request, "question")
+    service = request.app[SERVICE]
+    return web.json_response(await answer(service, current_state(service), question))
+
+async def handle_chat(request):
+    body, message = await read_request(request, "message")
+    service = request.app[SERVICE]
+    state = current_state(service)
+    session = service.sessions.get(str(body.get("session_id") or "default"))
+    async with session.lock:
+        return web.json_response(await answer(service, state, message, session))
+
+async def send_event(stream, event, data):
+    await stream.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+
+async def handle_chat_stream(request):
+    """
+    Server-sent events: "sources" once retrieval is done, a "token" per delta, then "done"
+    with timings (or "error").
+    """
+    body, message = await read_request(request, "message")
+    service = request.app[SERVICE]
+    state = current_state(service)
+    session = service.sessions.get(str(body.get("session_id") or "default"))
+    stream = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await stream.prepare(request)
+    start = time.perf_counter()
+    async with session.lock:
+        try:
+            engine = session.chat_engine(state)
+            standalone = not (engine.chat_history or session.memory.summary)
+            embedding, cached = await lookup_answer(state, message) if standalone else (None, None)
+            if cached:
+                await session.memory.aput_messages([ChatMessage(role=MessageRole.USER, content=message),
+                                                    ChatMessage(role=MessageRole.ASSISTANT, content=cached["answer"])])
+                await send_event(stream, "sources", [source_json(node) for node in cached["sources"]])
+                await send_event(stream, "token", {"delta": cached["answer"]})
+                await send_event(stream, "done", {"cached": True, "version": state.version,
+                                                  "seconds": round(time.perf_counter() - start, 3)})
+                return stream
+            history_tokens = memory_tokens(session.memory)
+            async with service.generations:
+                reuse_query_embedding(engine, message, embedding)
+                response = await engine.astream_chat(message)
+                retrieved = time.perf_counter()
+                await send_event(stream, "sources", [source_json(node) for node in response.source_nodes])
+                first_token = None
+                async for delta in response.async_response_gen():
+                    first_token = first_token or time.perf_counter()
+                    await send_event(stream, "token", {"delta": delta})
+            done = time.perf_counter()
+            record_generation(done - retrieved, prompt_tokens(message, response.source_nodes, history_tokens),
+                              response.response, (first_token or done) - retrieved)
+            if standalone and response.response:
+                state.answer_cache.store(message, embedding, response.response, response.source_nodes)
+            await send_event(stream, "done", {"cached": False, "version": state.version,
+                                              "first_token_seconds": round((first_token or done) - start, 3),
+                                              "seconds": round(done - start, 3)})
+        except ConnectionResetError:
+            return stream  # the client went away
+        except Exception as e:
+            print(f"ERROR: streaming chat failed: {e}")
+            await send_event(stream, "error", {"error": str(e)})
+    return stream
+
+async def handle_health(request):
+    service = request.app[SERVICE]
+    state = service.state
+    status = index_status()
+    return web.json_response({
+        "ready": state is not None,
+        "version": state.version if state else None,
+        "published_version": status.get("version"),
+        "building": status["building"],
+        "sessions": len(service.sessions.sessions),
+        "answer_cache": state.answer_cache.stats() if state else None,
+        "query_batching": Settings.embed_model.stats()
+    })
+
+async def handle_metrics(request):
+    return web.Response(text=METRICS.render(), content_type="text/plain")
+
+@web.middleware
+async def handle_errors(request, handler):
+    if request.path in ("/metrics", "/health"):
+        return await handler(request)
+    # One trace per request: retrieval, embedding and generation spans nest under it
+    with span("request", method=request.method, path=request.path) as attrs:
+        try:
+            response = await handler(request)
+        except web.HTTPException as e:
+            attrs["status"] = e.status
+            raise
+        except Exception as e:
+            print(f"ERROR: {request.method} {request.path} failed: {e}")
+            attrs["status"] = 500
+            return web.json_response({"error": str(e)}, status=500)
+        attrs["status"] = response.status
+        return response
+
+async def watch_index(service):
+    # Picks up newly published versions; requests already running keep their state
+    while True:
+        await asyncio.sleep(INDEX_POLL_SECONDS)
+        try:
+            service.state = await asyncio.to_thread(load_state, service.state)
+        except Exception as e:
+            print(f"WARNING: Could not load the published index: {e}")
+
+async def on_startup(app):
+    service = app[SERVICE]
+    service.generations = asyncio.Semaphore(MAX_GENERATIONS)
+    service.state = await asyncio.to_thread(load_state)
+    if service.state is None:
+        print("WARNING: No index found; requests get 503 until one is published.")
+    service.watcher = asyncio.get_running_loop().create_task(watch_index(service))
+
+async def on_cleanup(app):
+    app[SERVICE].watcher.cancel()
+
+def create_app():
+    Settings.embed_model = CoalescingEmbedding(providers.get_embed_model())
+    Settings.llm = providers.get_llm()
+    app = web.Application(middlewares=[handle_errors], client_max_size=64 * 1024)
+    app[SERVICE] = Service()
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_post("/query", handle_query)
+    app.router.add_post("/chat", handle_chat)
+    app.router.add_post("/chat/stream", handle_chat_stream)
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/metrics", handle_metrics)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the UZIO index over HTTP.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,267 @@
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# Per-stage timing and cost accounting for the pipeline and the query path.
+# Every span (extraction, captioning, question generation, embedding, retrieval,
+# summarization, generation, rendering) is appended to a JSONL trace file and aggregated into
+# Prometheus-style metrics; `python telemetry.py` summarizes the trace file per stage.
+
+# Configuration
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join(BASE_DIR, "processed_data", "traces.jsonl"))
+TRACING = os.getenv("TRACING", "1") != "0"  # TRACING=0 keeps the metrics but writes no trace file
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # standalone /metrics endpoint for app.py (0 = off)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+_span_id = contextvars.ContextVar("span_id", default=None)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(labels):
+    return ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+
+class Metrics:
+    """
+    In-process counters and latency histograms, rendered in the Prometheus text format.
+    Safe to share between threads.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # stage -> {"buckets": [...], "sum", "count"}
+
+    def add(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, stage, seconds, error=False):
+        with self.lock:
+            histogram = self.histograms.setdefault(stage, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+        if error:
+            self.add("stage_errors_total", stage=stage)
+
+    def render(self):
+        lines = ["# TYPE stage_duration_seconds histogram"]
+        with self.lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                for bound, count in zip(self.buckets, histogram["buckets"]):
+                    lines.append(f'stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+                lines.append(f'stage_duration_seconds_sum{{stage="{stage}"}} {histogram["sum"]:.6f}')
+                lines.append(f'stage_duration_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                lines.append(f"# TYPE {name} counter")
+                for (counter, labels), value in sorted(self.counters.items()):
+                    if counter == name:
+                        lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+
+class TraceWriter:
+    """
+    Appends one JSON line per span. Opened lazily, so importing this module never
+    creates the file; several processes may append to the same file.
+    """
+    def __init__(self, path=TRACE_FILE, enabled=TRACING):
+        self.path = path
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.file = None
+
+    def write(self, record):
+        if not self.enabled:
+            return
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self.lock:
+            try:
+                if self.file is None:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    self.file = open(self.path, "a", encoding="utf-8", buffering=1)
+                self.file.write(line)
+            except OSError as e:
+                print(f"WARNING: Could not write trace to {self.path}, tracing disabled: {e}")
+                self.enabled = False
+
+TRACES = TraceWriter()
+
+def record(stage, seconds, error=None, **attrs):
+    """
+    Records a stage timed by the caller (e.g. across a streamed response).
+    """
+    METRICS.observe(stage, seconds, error is not None)
+    TRACES.write({
+        "ts": round(time.time(), 3),
+        "trace": _trace_id.get(),
+        "parent": _span_id.get(),
+        "stage": stage,
+        "ms": round(seconds * 1000, 3),
+        **({"error": str(error)} if error is not None else {}),
+        **attrs
+    })
+
+def _reset(var, token):
+    try:
+        var.reset(token)
+    except ValueError:
+        pass  # the block ended in another context (e.g. a generator finished by a different task)
+
+@contextmanager
+def span(stage, **attrs):
+    """
+    Times the block as one stage. Yields the attribute dict, so the block can add
+    counts (tokens, items, cache hits) that end up in the trace record.
+    A span opened outside any other starts a new trace; spans opened inside it
+    share its trace id and name it as their parent.
+    """
+    span_id = uuid.uuid4().hex[:16]
+    trace_token = _trace_id.set(_trace_id.get() or uuid.uuid4().hex[:16])
+    span_token = _span_id.set(span_id)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        _reset(_span_id, span_token)
+        record(stage, elapsed, error, span=span_id, **attrs)
+        _reset(_trace_id, trace_token)
+
+def _count(attrs, **values):
+    if attrs is not None:
+        for key, value in values.items():
+            attrs[key] = attrs.get(key, 0) + value
+
+def record_llm(stage, model, input_tokens, output_tokens, attrs=None):
+    """
+    Counts one LLM API call; attrs is the enclosing span's attribute dict, if any.
+    """
+    METRICS.add("llm_calls_total", stage=stage, model=model)
+    METRICS.add("llm_tokens_total", input_tokens, stage=stage, model=model, direction="input")
+    METRICS.add("llm_tokens_total", output_tokens, stage=stage, model=model, direction="output")
+    _count(attrs, api_calls=1, input_tokens=input_tokens, output_tokens=output_tokens)
+
+def record_embedding(model, kind, texts, tokens, attrs=None):
+    """
+    Counts one embedding API call of `texts` texts.
+    """
+    METRICS.add("embedding_calls_total", model=model, kind=kind)
+    METRICS.add("embedding_texts_total", texts, model=model, kind=kind)
+    METRICS.add("embedding_tokens_total", tokens, model=model, kind=kind)
+    _count(attrs, api_calls=1, input_tokens=tokens)
+
+def start_metrics_server(port=METRICS_PORT, host="0.0.0.0"):
+    """
+    Serves GET /metrics from a daemon thread (for processes without their own HTTP server).
+    Returns the server, or None if it could not bind.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = METRICS.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer((host, port), Handler)
+    except OSError as e:
+        print(f"WARNING: Could not serve metrics on port {port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+# Reporting
+
+def iter_traces(path=TRACE_FILE, since=None):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by a crash
+            if since is None or entry.get("ts", 0) >= since:
+                yield entry
+
+def summarize(entries):
+    """
+    Per-stage count, errors, latency percentiles, total time and token/call sums.
+    """
+    stages = {}
+    for entry in entries:
+        stage = stages.setdefault(entry["stage"], {"ms": [], "errors": 0, "input_tokens": 0, "output_tokens": 0, "api_calls": 0})
+        stage["ms"].append(entry["ms"])
+        stage["errors"] += "error" in entry
+        for key in ("input_tokens", "output_tokens", "api_calls"):
+            stage[key] += entry.get(key, 0) or 0
+    summary = {}
+    for name, stage in stages.items():
+        p50, p95, p99 = np.percentile(stage["ms"], [50, 95, 99])
+        summary[name] = {
+            "count": len(stage["ms"]),
+            "errors": stage["errors"],
+            "p50_ms": round(float(p50), 1),
+            "p95_ms": round(float(p95), 1),
+            "p99_ms": round(float(p99), 1),
+            "total_s": round(sum(stage["ms"]) / 1000, 2),
+            "api_calls": stage["api_calls"],
+            "input_tokens": stage["input_tokens"],
+            "output_tokens": stage["output_tokens"]
+        }
+    return dict(sorted(summary.items(), key=lambda item: -item[1]["total_s"]))
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the JSONL trace file per stage (slowest first).")
+    parser.add_argument("--trace-file", default=TRACE_FILE)
+    parser.add_argument("--hours", type=float, help="Only spans from the last N hours.")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON.")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.trace_file):
+        print(f"No trace file at {args.trace_file}.")
+        return 1
+    since = time.time() - args.hours * 3600 if args.hours else None
+    summary = summarize(iter_traces(args.trace_file, since))
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return 0
+    print(f"{'stage':22} {'count':>7} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'total s':>9} {'calls':>7} {'tokens in/out':>15}")
+    for name, stage in summary.items():
+        print(f"{name:22} {stage['count']:>7} {stage['errors']:>5} {stage['p50_ms']:>9.1f} {stage['p95_ms']:>9.1f} "
+              f"{stage['p99_ms']:>9.1f} {stage['total_s']:>9.2f} {stage['api_calls']:>7} "
+              f"{stage['input_tokens']:>7}/{stage['output_tokens']:<7}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())